@@ -1,7 +1,7 @@
 """
 AIGC 配置管理端点
 
-提供 AI 服务配置的查看接口
+提供 AI 服务配置、运行指标的查看接口
 """
 from fastapi import APIRouter
 from app.services.aigc_service import get_aigc_service
@@ -38,3 +38,27 @@ async def health_check():
         "model": config["default_model"],
         "rate_limit": config["rate_limit_per_minute"]
     }
+
+
+@router.get("/metrics")
+async def get_aigc_metrics():
+    """
+    获取 AIGC 服务运行指标
+    
+    Returns:
+        响应缓存命中 / 未命中 / 淘汰计数等
+    """
+    aigc = get_aigc_service()
+    return aigc.get_metrics()
+
+
+@router.delete("/cache")
+async def clear_aigc_cache():
+    """
+    清空 LLM 响应缓存
+    
+    Returns:
+        删除的条目数
+    """
+    aigc = get_aigc_service()
+    return {"deleted": aigc.clear_cache()}
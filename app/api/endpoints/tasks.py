@@ -10,8 +10,15 @@ from datetime import datetime
 import pandas as pd
 
 from app.core.database import get_db
+from app.core.code_hierarchy import is_hierarchical, parent_map
 from app.models.task import Task
 from app.services.analysis_service import process_analysis_task, TaskStatus
+from app.services.answer_memory_service import (
+    memory_scope,
+    record_correction,
+    remember_task_results,
+    invalidate_answer_memory
+)
 
 router = APIRouter()
 
@@ -27,7 +34,8 @@ class ColumnConfig(BaseModel):
     mode: str  # "fixed" or "open"
     engine: Optional[str] = "llm"  # "llm" or "bertopic"
     max_codes: Optional[int] = 10
-    codes: Optional[List[Dict[str, str]]] = []  # For fixed mode
+    codes: Optional[List[Dict[str, str]]] = []  # For fixed mode（分层编码表的小类用 parent 字段指向大类编码）
+    parent_codes: Optional[List[Dict[str, str]]] = []  # 分层编码表的大类（code / description，可选）
     mapping_dict: Optional[Dict[str, str]] = {}  # 映射字典
     default_code: Optional[str] = ""  # 默认分类编码
     classification_mode: Optional[str] = "ai_only"  # 分类配置模式
@@ -57,6 +65,7 @@ class ResultItem(BaseModel):
     row_id: Optional[str] = None
     original_text: str
     assigned_code: str
+    parent_code: Optional[str] = None  # 分层编码表的大类
     confidence: Optional[float] = None
     method: Optional[str] = None
 
@@ -65,6 +74,10 @@ class ColumnResult(BaseModel):
     results: List[ResultItem] = []
     config: Dict[str, Any] = {}
 
+class ResultCorrection(BaseModel):
+    column: str
+    code: str
+
 class TaskStatusResponse(BaseModel):
     task_id: str
     status: str
@@ -187,6 +200,7 @@ async def get_task_status(task_id: str, db: Session = Depends(get_db)):
                     "row_id": r.row_id,
                     "original_text": val.get("original_text"),
                     "assigned_code": val.get("code"),
+                    "parent_code": val.get("parent_code"),
                     "confidence": val.get("confidence"),
                     "method": "ai"
                 })
@@ -204,6 +218,122 @@ async def get_task_status(task_id: str, db: Session = Depends(get_db)):
         completed_at=task.completed_at
     )
 
+@router.get("/tasks/{task_id}/match-profile")
+async def get_match_profile(task_id: str, column: Optional[str] = None, db: Session = Depends(get_db)):
+    """获取任务的确定性匹配命中率画像（各规则 / 各阶段命中、落空行数与耗时）"""
+    task = db.query(Task).filter(Task.id == task_id).first()
+    
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    meta = (task.statistics or {}).get("_meta", {})
+    profiles = {
+        col_name: col_meta.get("profile")
+        for col_name, col_meta in meta.items()
+        if col_meta.get("profile") is not None
+    }
+    
+    if column is not None:
+        if column not in profiles:
+            raise HTTPException(status_code=404, detail=f"列 '{column}' 没有匹配画像")
+        profiles = {column: profiles[column]}
+    
+    return {"task_id": task.id, "status": task.status, "columns": profiles}
+
+def _move_count(counts: Dict[str, int], old_code: Optional[str], new_code: str) -> Dict[str, int]:
+    """计数从 old_code 移到 new_code（返回新字典）"""
+    counts = dict(counts)
+    if old_code in counts:
+        counts[old_code] -= 1
+        if counts[old_code] <= 0:
+            del counts[old_code]
+    counts[new_code] = counts.get(new_code, 0) + 1
+    return counts
+
+
+@router.put("/tasks/{task_id}/results/{row_id}")
+async def correct_result(task_id: str, row_id: str, correction: ResultCorrection, db: Session = Depends(get_db)):
+    """人工修正某行某列的分类结果，并写入答案记忆（后续任务遇到相同回答直接复用）"""
+    task = db.query(Task).filter(Task.id == task_id).first()
+    
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    col_config = (task.column_configs or {}).get(correction.column)
+    if col_config is None:
+        raise HTTPException(status_code=400, detail=f"列 '{correction.column}' 不存在")
+    
+    # 只接受该列编码表中的编码，以及分类结果中会出现的特殊编码（默认编码、空回答、未匹配）
+    allowed_codes = {str(c['code']) for c in col_config.get("codes", [])} | {"N/A", "未匹配"}
+    if col_config.get("default_code"):
+        allowed_codes.add(col_config["default_code"])
+    if correction.code not in allowed_codes:
+        raise HTTPException(status_code=422, detail=f"编码 '{correction.code}' 不在列 '{correction.column}' 的编码表中")
+    
+    result = db.query(AnalysisResult).filter(
+        AnalysisResult.task_id == task_id,
+        AnalysisResult.row_id == row_id
+    ).first()
+    if not result or correction.column not in (result.data or {}):
+        raise HTTPException(status_code=404, detail="分类结果未找到")
+    
+    # JSON 列需整体赋值才能被 SQLAlchemy 识别为已修改
+    data = dict(result.data)
+    cell = dict(data[correction.column])
+    old_code = cell.get("code")
+    old_parent = cell.get("parent_code") or "N/A"
+    cell.update({"code": correction.code, "confidence": 1.0, "method": "manual"})
+    hierarchical = is_hierarchical(col_config.get("codes", []))
+    if hierarchical:
+        cell["parent_code"] = parent_map(col_config.get("codes", [])).get(correction.code)
+    data[correction.column] = cell
+    result.data = data
+    
+    # 同步更新该列的编码计数（分层编码表同时更新大类计数）
+    if task.statistics and correction.column in task.statistics:
+        statistics = dict(task.statistics)
+        statistics[correction.column] = _move_count(statistics[correction.column], old_code, correction.code)
+        parent_statistics = dict(statistics.get("_parent_codes") or {})
+        if hierarchical and correction.column in parent_statistics:
+            parent_statistics[correction.column] = _move_count(
+                parent_statistics[correction.column], old_parent, cell["parent_code"] or "N/A"
+            )
+            statistics["_parent_codes"] = parent_statistics
+        task.statistics = statistics
+    db.commit()
+    
+    scope = memory_scope(task.project_id)
+    if scope is not None:
+        record_correction(db, scope, col_config.get("codes", []), cell.get("original_text") or "", correction.code)
+    
+    return {"task_id": task_id, "row_id": row_id, "column": correction.column, "code": correction.code}
+
+
+@router.post("/tasks/{task_id}/answer-memory")
+async def backfill_answer_memory(task_id: str, db: Session = Depends(get_db)):
+    """将已完成任务的 AI 分类结果写入答案记忆（用于历史任务回填）"""
+    task = db.query(Task).filter(Task.id == task_id).first()
+    
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    if task.status != TaskStatus.COMPLETED:
+        raise HTTPException(status_code=400, detail="Task not completed yet")
+    
+    remembered = remember_task_results(db, task)
+    return {"task_id": task_id, "remembered": remembered}
+
+
+@router.delete("/answer-memory")
+async def clear_answer_memory(project_id: str, codebook_hash: Optional[str] = None, db: Session = Depends(get_db)):
+    """清除项目的答案记忆（可选：只清除某个编码表版本）"""
+    scope = memory_scope(project_id)
+    if scope is None:
+        raise HTTPException(status_code=400, detail="project_id is required")
+    deleted = invalidate_answer_memory(db, scope, codebook_hash)
+    return {"project_id": project_id, "deleted": deleted}
+
+
 @router.get("/tasks/{task_id}/export")
 async def export_results(task_id: str, db: Session = Depends(get_db)):
     """Export analysis results as Excel file"""
@@ -243,6 +373,11 @@ async def export_results(task_id: str, db: Session = Depends(get_db)):
         new_col_name = f"{col_name}_AI分类"
         # Use list comprehension with map lookup
         df[new_col_name] = [result_map.get(r_id, {}).get(col_name, {}).get("code", "") for r_id in ids]
+        # 分层编码表额外导出大类
+        if is_hierarchical(column_configs[col_name].get("codes", [])):
+            df[f"{col_name}_AI大类"] = [
+                result_map.get(r_id, {}).get(col_name, {}).get("parent_code") or "" for r_id in ids
+            ]
 
     # Save to export directory
     export_path = os.path.join(EXPORT_DIR, f"results_{task_id}.xlsx")
@@ -1,5 +1,6 @@
 import os
 import json
+import asyncio
 import random
 import re
 import uuid
@@ -8,12 +9,16 @@ from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from datetime import datetime
+import numpy as np
 import pandas as pd
+from scipy import sparse
 from bertopic import BERTopic
 from sentence_transformers import SentenceTransformer
 
 from app.core.database import get_db
 from app.core.config import settings
+from app.core.matching import MultiPatternScanner
+from app.core.normalization import normalize_text
 from app.services.aigc_service import get_aigc_service
 from app.models.test_result import TestResult
 from app.services.redis_service import get_redis
@@ -43,6 +48,7 @@ class CodeResult(BaseModel):
     description: str
     keywords: Optional[List[str]] = None
     count: Optional[int] = None
+    score: Optional[float] = None  # 关键词匹配强度（归入该主题的文本平均命中关键词数）
 
 
 class ClusterTestResponse(BaseModel):
@@ -132,8 +138,8 @@ async def extract_with_llm(texts: List[str], sample_size: int, max_codes: int) -
     match = re.search(r'\[.*\]', content, re.DOTALL)
     if match:
         results = json.loads(match.group(0))
-        # 使用关键词匹配进行分类（避免再次调用 LLM）
-        classified_data = classify_texts_by_keywords(texts, results)
+        # 使用关键词匹配进行分类（避免再次调用 LLM），放到线程中避免阻塞事件循环
+        classified_data = await asyncio.to_thread(classify_texts_by_keywords, texts, results)
         return results, classified_data
     else:
         raise HTTPException(status_code=500, detail="LLM返回格式解析失败")
@@ -284,33 +290,84 @@ async def name_clusters_with_llm(clusters: List[dict]) -> List[dict]:
         ]
 
 
+def keyword_score_matrix(texts: List[str], themes: List[dict]) -> tuple[np.ndarray, sparse.csr_matrix]:
+    """计算文本 × 主题的关键词命中计数矩阵
+    
+    所有主题的关键词合并为一个多模式扫描器，每个不同的文本只扫描一次，
+    得到稀疏的 (文本 × 关键词) 命中矩阵，再乘以 (关键词 × 主题) 归属矩阵。
+    
+    Returns:
+        tuple: (row_index, scores) - 每条文本对应的去重行号，以及去重文本 × 主题的得分矩阵
+    """
+    # 关键词统一使用规范形式；同一主题重复列出的关键词按出现次数计分（与逐个子串判断一致）
+    keyword_ids = {}
+    incidence_rows, incidence_cols = [], []
+    for theme_index, theme in enumerate(themes):
+        for keyword in theme.get('keywords') or []:
+            kw = normalize_text(keyword)
+            if not kw:
+                continue
+            incidence_rows.append(keyword_ids.setdefault(kw, len(keyword_ids)))
+            incidence_cols.append(theme_index)
+    incidence = sparse.csr_matrix(
+        (np.ones(len(incidence_rows), dtype=np.int32), (incidence_rows, incidence_cols)),
+        shape=(len(keyword_ids), len(themes))
+    )
+    
+    # 相同文本只扫描一次
+    row_index, distinct_texts = pd.factorize(pd.Series(texts, dtype=object))
+    scanner = MultiPatternScanner(list(keyword_ids))
+    hit_rows, hit_cols = scanner.scan_many([normalize_text(text) for text in distinct_texts])
+    hit_matrix = sparse.csr_matrix(
+        (np.ones(len(hit_rows), dtype=np.int32), (hit_rows, hit_cols)),
+        shape=(len(distinct_texts), len(keyword_ids))
+    )
+    
+    scores = (hit_matrix @ incidence).tocsr()
+    return row_index, scores
+
+
+def _row_argmax(scores: sparse.csr_matrix) -> tuple[np.ndarray, np.ndarray]:
+    """按行取最大得分及取得最大值的最小列号（与逐个主题比较 score > best_score 的并列规则一致）"""
+    n_rows, n_cols = scores.shape
+    row_nnz = np.diff(scores.indptr)
+    best_score = np.zeros(n_rows, dtype=scores.dtype)
+    best_col = np.zeros(n_rows, dtype=np.int64)
+    nonempty = row_nnz > 0
+    if not nonempty.any():
+        return best_col, best_score
+    
+    starts = scores.indptr[:-1][nonempty]
+    best_score[nonempty] = np.maximum.reduceat(scores.data, starts)
+    candidate = np.where(scores.data == np.repeat(best_score, row_nnz), scores.indices, n_cols)
+    best_col[nonempty] = np.minimum.reduceat(candidate, starts)
+    return best_col, best_score
+
+
 def classify_texts_by_keywords(texts: List[str], themes: List[dict]) -> dict:
-    """使用关键词匹配将文本分类到各主题（无需 LLM，节省资源）"""
+    """使用关键词匹配将文本分类到各主题（无需 LLM，节省资源）
+    
+    每条文本归入关键词命中数最多的主题（并列时取靠前的主题），无命中归入"其他"。
+    同时为每个主题写入 score：归入该主题的文本平均命中关键词数，用于展示匹配强度。
+    """
     
     # 初始化分类结果
     classified_data = {t['code']: [] for t in themes}
     classified_data['其他'] = []
     
-    for text in texts:
-        text_lower = text.lower()
-        matched = False
-        best_match = None
-        best_score = 0
-        
-        # 遍历每个主题，计算关键词匹配得分
-        for theme in themes:
-            keywords = theme.get('keywords', [])
-            score = 0
-            for kw in keywords:
-                if kw.lower() in text_lower:
-                    score += 1
-            
-            if score > best_score:
-                best_score = score
-                best_match = theme['code']
-        
-        if best_match and best_score > 0:
-            classified_data[best_match].append(text)
+    best_theme = np.zeros(len(texts), dtype=np.int64)
+    best_score = np.zeros(len(texts), dtype=np.int64)
+    if themes and texts:
+        row_index, scores = keyword_score_matrix(texts, themes)
+        distinct_theme, distinct_score = _row_argmax(scores)
+        best_theme = distinct_theme[row_index]
+        best_score = distinct_score[row_index]
+    
+    theme_score_sum = np.zeros(len(themes))
+    for text, theme_index, score in zip(texts, best_theme.tolist(), best_score.tolist()):
+        if score > 0:
+            classified_data[themes[theme_index]['code']].append(text)
+            theme_score_sum[theme_index] += score
         else:
             classified_data['其他'].append(text)
     
@@ -318,9 +375,12 @@ def classify_texts_by_keywords(texts: List[str], themes: List[dict]) -> dict:
     if not classified_data.get('其他'):
         del classified_data['其他']
     
-    # 统计每个主题的数量，更新 count
-    for theme in themes:
+    # 统计每个主题的数量，更新 count 和 score
+    best_theme_counts = np.bincount(best_theme[best_score > 0], minlength=len(themes))
+    for theme_index, theme in enumerate(themes):
         theme['count'] = len(classified_data.get(theme['code'], []))
+        assigned = int(best_theme_counts[theme_index])
+        theme['score'] = round(theme_score_sum[theme_index] / assigned, 2) if assigned else 0.0
     
     return classified_data
 
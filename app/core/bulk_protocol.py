@@ -0,0 +1,326 @@
+"""
+批量分类的提示词 / 响应协议
+
+- legacy：模型逐行回显 {"index": n, "code": "类别名称"}，按名称（含子串模糊匹配）解析
+- compact：编码表编号，模型只返回与文本顺序对齐的编号数组 {"codes": [3, 1, ...]}，
+  按编号直接查表；输出 token 约为 legacy 的几分之一（输出是生成中最慢的部分）。
+  可选 JSON Schema 结构化输出，约束编号只能取编码表中的值。
+
+两种协议提供相同接口：template / build_messages / response_format /
+row_output_tokens / decode / confidences，由 batch_classify_with_ai_bulk_prompt 按配置选择。
+提示词使用 app.core.prompts 的静态前缀模板，待分类文本始终在最后。
+
+每行置信度（模型级联用）：
+- 优先使用输出 token 的对数概率：该行编码（编号或名称）所占 token 的联合概率；
+- 服务商不返回 logprobs 时，可让模型自报 0-100 的把握（report_confidence，会改变前缀并增加少量输出）。
+"""
+import re
+import math
+from abc import ABC, abstractmethod
+from bisect import bisect_right
+from typing import List, Dict, Any, Optional, Tuple
+
+from app.core.llm_batching import estimate_tokens
+from app.core.prompts import PromptTemplate, render_codebook, numbered_texts
+
+PROTOCOL_LEGACY = "legacy"
+PROTOCOL_COMPACT = "compact"
+
+# 每行置信度来源
+CONFIDENCE_LOGPROBS = "logprobs"
+CONFIDENCE_SELF_REPORT = "self_report"
+
+_BULK_INSTRUCTIONS = "你是文本分类专家，擅长批量处理文本分类任务。请将用户给出的每条文本分别分类到最合适的类别中。"
+
+
+# legacy 响应中的一项：捕获序号和编码名称（用于定位编码名称在响应中的位置）
+_LEGACY_ITEM = re.compile(r'"index"\s*:\s*(\d+)\s*,\s*"code"\s*:\s*"((?:[^"\\]|\\.)*)"')
+# compact 响应中的编号数组
+_COMPACT_ARRAY = re.compile(r'"codes"\s*:\s*\[([^\]]*)\]')
+_COMPACT_ID = re.compile(r'\d+')
+
+
+def _bulk_input(batch_texts: List[str]) -> str:
+    return f"待分类文本（共 {len(batch_texts)} 条）：\n{numbered_texts(batch_texts)}"
+
+
+def _span_probabilities(
+    content: str,
+    token_logprobs: List[List[Any]],
+    spans: List[Tuple[int, int]]
+) -> Optional[List[float]]:
+    """
+    每个字符区间 [start, end) 的联合概率（区间覆盖的各 token 概率之积）
+
+    token 拼接结果与响应文本不一致时无法对齐，返回 None。
+    """
+    offsets = []
+    position = 0
+    for token, _ in token_logprobs:
+        offsets.append(position)
+        position += len(token)
+    if position != len(content):
+        return None
+
+    probabilities = []
+    for start, end in spans:
+        first = max(bisect_right(offsets, start) - 1, 0)
+        last = bisect_right(offsets, end - 1)
+        probabilities.append(math.exp(sum(logprob for _, logprob in token_logprobs[first:last])))
+    return probabilities
+
+
+def _reported_confidence(value: Any) -> Optional[float]:
+    """模型自报的把握（0-100，兼容 0-1 小数）转换为 0-1"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if value > 1:
+        value = value / 100
+    return min(max(float(value), 0.0), 1.0)
+
+
+class _BulkProtocol(ABC):
+    """两种协议的公共部分（子类缺少协议方法时在构造时报错，而不是批量分类进行到一半）"""
+
+    name = ""
+    template: PromptTemplate
+    report_confidence = False
+
+    def build_messages(self, batch_texts: List[str]) -> List[Dict[str, str]]:
+        """批量分类的消息（文本不截断，长度由 token 预算打包控制）"""
+        return self.template.messages(_bulk_input(batch_texts))
+
+    @abstractmethod
+    def decode(self, parsed: Any, n_rows: int) -> Dict[int, str]:
+        """解析响应 {行序号（从 0 开始）: 编码}，只包含有效的行"""
+
+    @abstractmethod
+    def code_spans(self, content: str, n_rows: int) -> Dict[int, Tuple[int, int]]:
+        """各行编码在响应文本中的字符区间 {行序号: (start, end)}"""
+
+    @abstractmethod
+    def reported_confidences(self, parsed: Any, n_rows: int) -> Dict[int, float]:
+        """模型自报的每行把握 {行序号: 0-1}"""
+
+    def confidences(
+        self,
+        parsed: Any,
+        content: Optional[str],
+        token_logprobs: Optional[List[List[Any]]],
+        n_rows: int
+    ) -> Dict[int, float]:
+        """
+        每行置信度 {行序号（从 0 开始）: 0-1}
+
+        有 token 对数概率时按编码所占 token 的联合概率计算，否则使用模型自报的把握；
+        都没有时返回空字典（由调用方决定如何处理无信号的行）。
+        """
+        if content and token_logprobs:
+            spans = self.code_spans(content, n_rows)
+            if spans:
+                rows = list(spans)
+                probabilities = _span_probabilities(content, token_logprobs, [spans[row] for row in rows])
+                if probabilities is not None:
+                    return dict(zip(rows, probabilities))
+        if self.report_confidence:
+            return self.reported_confidences(parsed, n_rows)
+        return {}
+
+
+class LegacyProtocol(_BulkProtocol):
+    """逐行回显编码名称"""
+
+    name = PROTOCOL_LEGACY
+
+    def __init__(self, codes: List[Dict[str, str]], use_json_schema: bool = False, report_confidence: bool = False):
+        self.valid_codes = [c['code'] for c in codes]
+        self.report_confidence = report_confidence
+        item_format = '"code": "类别名称", "confidence": 把握' if report_confidence else '"code": "类别名称"'
+        confidence_note = "\nconfidence 为你对该分类的把握，取 0-100 的整数。" if report_confidence else ""
+        self.template = PromptTemplate(
+            instructions=_BULK_INSTRUCTIONS,
+            codebook_title="可选类别：",
+            codebook_text=render_codebook(codes),
+            output_format=f"""请按以下 JSON 格式输出，每条文本对应一个分类结果：
+{{
+    "results": [
+        {{"index": 1, {item_format}}},
+        {{"index": 2, {item_format}}},
+        ...
+    ]
+}}
+{confidence_note}
+只输出 JSON，不要其他内容。"""
+        )
+        self.response_format = {"type": "json_object"}
+        self.row_output_tokens = (
+            12 + max((estimate_tokens(code) for code in self.valid_codes), default=0)
+            + (6 if report_confidence else 0)
+        )
+
+    def resolve_code(self, assigned_code: Any) -> Optional[str]:
+        """校验模型返回的编码名称，无法对应到编码表时返回 None（视为该行失败）"""
+        if not isinstance(assigned_code, str) or not assigned_code:
+            return None
+        if assigned_code in self.valid_codes:
+            return assigned_code
+        for valid_code in self.valid_codes:
+            if valid_code in assigned_code or assigned_code in valid_code:
+                return valid_code
+        return None
+
+    def decode(self, parsed: Any, n_rows: int) -> Dict[int, str]:
+        """解析响应，返回 {行序号（从 0 开始）: 编码}，只包含序号合法、编码有效的行"""
+        results_list = parsed.get('results', []) if isinstance(parsed, dict) else parsed
+        if not isinstance(results_list, list):
+            return {}
+
+        decoded = {}
+        for item in results_list:
+            if not isinstance(item, dict):
+                continue
+            try:
+                index = int(item.get('index'))
+            except (TypeError, ValueError):
+                continue
+            if 1 <= index <= n_rows:
+                code = self.resolve_code(item.get('code'))
+                if code is not None:
+                    decoded[index - 1] = code
+        return decoded
+
+    def code_spans(self, content: str, n_rows: int) -> Dict[int, Tuple[int, int]]:
+        spans = {}
+        for match in _LEGACY_ITEM.finditer(content):
+            index = int(match.group(1))
+            if 1 <= index <= n_rows and match.end(2) > match.start(2):
+                spans.setdefault(index - 1, (match.start(2), match.end(2)))
+        return spans
+
+    def reported_confidences(self, parsed: Any, n_rows: int) -> Dict[int, float]:
+        results_list = parsed.get('results', []) if isinstance(parsed, dict) else parsed
+        if not isinstance(results_list, list):
+            return {}
+        reported = {}
+        for item in results_list:
+            if not isinstance(item, dict):
+                continue
+            try:
+                index = int(item.get('index'))
+            except (TypeError, ValueError):
+                continue
+            confidence = _reported_confidence(item.get('confidence'))
+            if 1 <= index <= n_rows and confidence is not None:
+                reported[index - 1] = confidence
+        return reported
+
+
+class CompactProtocol(_BulkProtocol):
+    """编码编号数组，与文本顺序对齐"""
+
+    name = PROTOCOL_COMPACT
+
+    def __init__(self, codes: List[Dict[str, str]], use_json_schema: bool = False, report_confidence: bool = False):
+        self.valid_codes = [c['code'] for c in codes]
+        self.report_confidence = report_confidence
+        if report_confidence:
+            output_format = """按文本顺序输出每条文本所属类别的编号，以及你对该分类的把握（0-100 的整数），
+两个数组的长度都必须等于文本条数：
+{"codes": [类别编号, 类别编号, ...], "confidence": [把握, 把握, ...]}
+
+只输出 JSON，不要其他内容。"""
+        else:
+            output_format = """按文本顺序输出每条文本所属类别的编号，数组长度必须等于文本条数：
+{"codes": [类别编号, 类别编号, ...]}
+
+只输出 JSON，不要其他内容。"""
+        self.template = PromptTemplate(
+            instructions=_BULK_INSTRUCTIONS,
+            codebook_title="可选类别（编号. 类别名称: 说明）：",
+            codebook_text=render_codebook(codes, numbered=True),
+            output_format=output_format
+        )
+        # 每行输出：编号 + 逗号 / 空格（自报把握时再加一个 0-100 的数）
+        self.row_output_tokens = 2 + estimate_tokens(str(len(codes))) + (2 if report_confidence else 0)
+        if use_json_schema and codes:
+            properties = {
+                "codes": {
+                    "type": "array",
+                    "items": {"type": "integer", "enum": list(range(1, len(codes) + 1))}
+                }
+            }
+            if report_confidence:
+                properties["confidence"] = {"type": "array", "items": {"type": "integer"}}
+            self.response_format = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "bulk_classification",
+                    "strict": True,
+                    "schema": {
+                        "type": "object",
+                        "properties": properties,
+                        "required": list(properties),
+                        "additionalProperties": False
+                    }
+                }
+            }
+        else:
+            self.response_format = {"type": "json_object"}
+
+    def decode(self, parsed: Any, n_rows: int) -> Dict[int, str]:
+        """
+        按编号直接查表，返回 {行序号（从 0 开始）: 编码}
+
+        数组长度与文本条数不一致时无法确定对齐关系，整批视为失败；
+        单个编号非法时只有该行失败。
+        """
+        ids = parsed.get('codes') if isinstance(parsed, dict) else parsed
+        if not isinstance(ids, list) or len(ids) != n_rows:
+            return {}
+
+        decoded = {}
+        for row, code_id in enumerate(ids):
+            if isinstance(code_id, str) and code_id.strip().isdigit():
+                code_id = int(code_id)
+            if isinstance(code_id, int) and not isinstance(code_id, bool) and 1 <= code_id <= len(self.valid_codes):
+                decoded[row] = self.valid_codes[code_id - 1]
+        return decoded
+
+    def code_spans(self, content: str, n_rows: int) -> Dict[int, Tuple[int, int]]:
+        match = _COMPACT_ARRAY.search(content)
+        if not match:
+            return {}
+        ids = list(_COMPACT_ID.finditer(match.group(1)))
+        if len(ids) != n_rows:
+            return {}
+        offset = match.start(1)
+        return {row: (offset + m.start(), offset + m.end()) for row, m in enumerate(ids)}
+
+    def reported_confidences(self, parsed: Any, n_rows: int) -> Dict[int, float]:
+        values = parsed.get('confidence') if isinstance(parsed, dict) else None
+        if not isinstance(values, list) or len(values) != n_rows:
+            return {}
+        reported = {}
+        for row, value in enumerate(values):
+            confidence = _reported_confidence(value)
+            if confidence is not None:
+                reported[row] = confidence
+        return reported
+
+
+_PROTOCOLS = {
+    PROTOCOL_LEGACY: LegacyProtocol,
+    PROTOCOL_COMPACT: CompactProtocol,
+}
+
+
+def get_protocol(
+    name: str,
+    codes: List[Dict[str, str]],
+    use_json_schema: bool = False,
+    report_confidence: bool = False
+):
+    """按名称创建协议实例，未知名称回退到 legacy"""
+    return _PROTOCOLS.get(name, LegacyProtocol)(
+        codes, use_json_schema=use_json_schema, report_confidence=report_confidence
+    )
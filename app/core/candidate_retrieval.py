@@ -0,0 +1,138 @@
+"""
+大编码表的候选编码检索
+
+编码表很大（上百个编码）时，每个批量分类请求都带上整个编码表，提示词的大部分是编码表。
+候选检索把每个请求的编码表缩小到与文本相关的编码：
+1. 编码名称 + 说明编码为句向量（按编码表哈希缓存，同一编码表只编码一次）；
+2. 每条文本编码为句向量，取余弦相似度最高的 top-k 个编码作为候选；
+3. 文本按句向量聚类，每类约 LLM_CANDIDATE_GROUP_ROWS 条（约一个请求），候选集相近的文本在同一类；
+   每类按候选排名加权选出最多 LLM_CANDIDATE_MAX_CODES 个编码作为该组编码表，
+   top-k 候选都在组编码表中的文本留在该组；
+4. 其余文本按最相似的编码排序后依次合并（保证组内每条文本的 top-k 候选都在组编码表中）。
+每组请求只发送组编码表（按原编码表顺序），提示词长度只取决于候选编码数，不再随编码表增长。
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+from app.core.local_classifier import embed_texts
+from app.core.prompts import render_codebook, prefix_hash
+
+# 编码表句向量缓存：编码表哈希 → 句向量矩阵（只保留最近的 _MAX_CACHED_CODEBOOKS 个）
+_MAX_CACHED_CODEBOOKS = 32
+_code_embedding_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+# 相似度矩阵分块计算的行数（避免 文本数 × 编码数 的矩阵一次性占用大量内存）
+_SIMILARITY_CHUNK_ROWS = 8192
+
+
+def code_embeddings(codes: List[Dict[str, str]]) -> np.ndarray:
+    """编码表的句向量（编码名称 + 说明），同一编码表只计算一次"""
+    code_texts = [render_codebook([c]) for c in codes]
+    key = prefix_hash("\n".join(code_texts))
+    with _cache_lock:
+        cached = _code_embedding_cache.get(key)
+        if cached is not None:
+            _code_embedding_cache.move_to_end(key)
+            return cached
+    vectors = embed_texts(code_texts)
+    with _cache_lock:
+        _code_embedding_cache[key] = vectors
+        while len(_code_embedding_cache) > _MAX_CACHED_CODEBOOKS:
+            _code_embedding_cache.popitem(last=False)
+    return vectors
+
+
+def top_candidates(text_vectors: np.ndarray, code_vectors: np.ndarray, top_k: int) -> np.ndarray:
+    """每条文本相似度最高的 top_k 个编码序号（按相似度从高到低）"""
+    top_k = min(top_k, code_vectors.shape[0])
+    chunks = []
+    for start in range(0, text_vectors.shape[0], _SIMILARITY_CHUNK_ROWS):
+        similarity = text_vectors[start:start + _SIMILARITY_CHUNK_ROWS] @ code_vectors.T
+        partition = np.argpartition(-similarity, top_k - 1, axis=1)[:, :top_k]
+        order = np.argsort(-np.take_along_axis(similarity, partition, axis=1), axis=1, kind="stable")
+        chunks.append(np.take_along_axis(partition, order, axis=1))
+    return np.concatenate(chunks) if chunks else np.zeros((0, top_k), dtype=np.int64)
+
+
+def _merge_by_candidates(candidates: np.ndarray, rows: List[int], max_codes: int) -> List[Tuple[List[int], List[int]]]:
+    """按最相似的编码排序后依次合并，组内候选并集超过 max_codes 时另起一组"""
+    if not rows:
+        return []
+    subset = candidates[rows]
+    # lexsort 以最后一个键为主键：依次按第 1、2、3 相似的编码排序
+    order = np.lexsort([subset[:, i] for i in reversed(range(min(3, subset.shape[1])))])
+
+    groups = []
+    group_codes: set = set()
+    group_rows: List[int] = []
+    for i in order.tolist():
+        union = group_codes.union(subset[i].tolist())
+        if group_rows and len(union) > max_codes:
+            groups.append((sorted(group_codes), group_rows))
+            union = set(subset[i].tolist())
+            group_rows = []
+        group_codes = union
+        group_rows.append(rows[i])
+    groups.append((sorted(group_codes), group_rows))
+    return groups
+
+
+def group_by_candidates(
+    candidates: np.ndarray,
+    text_vectors: np.ndarray,
+    n_codes: int,
+    max_codes: int,
+    group_rows: int,
+    seed: int = 0
+) -> List[Tuple[List[int], List[int]]]:
+    """
+    按候选集分组，保证每条文本的 top-k 候选都在所在组的编码表中
+
+    Returns:
+        [(组编码表的编码序号（升序，即原编码表顺序）, 组内文本序号), ...]
+    """
+    n_rows, top_k = candidates.shape
+    if n_rows == 0:
+        return []
+    max_codes = max(max_codes, top_k)
+    n_clusters = max(1, min(n_rows, int(round(n_rows / max(group_rows, 1)))))
+    if n_clusters > 1:
+        labels = MiniBatchKMeans(n_clusters=n_clusters, random_state=seed, n_init=3).fit_predict(text_vectors)
+    else:
+        labels = np.zeros(n_rows, dtype=np.int64)
+    # 候选排名越靠前权重越大
+    rank_weights = np.arange(top_k, 0, -1, dtype=float)
+
+    groups = []
+    leftover: List[int] = []
+    for cluster in range(n_clusters):
+        rows = np.flatnonzero(labels == cluster)
+        if len(rows) == 0:
+            continue
+        scores = np.bincount(candidates[rows].ravel(), weights=np.tile(rank_weights, len(rows)), minlength=n_codes)
+        codebook = np.argsort(-scores, kind="stable")[:max_codes]
+        covered = np.isin(candidates[rows], codebook).all(axis=1)
+        if covered.any():
+            # 组编码表只保留组内文本实际用到的候选
+            groups.append((sorted(set(candidates[rows[covered]].ravel().tolist())), rows[covered].tolist()))
+        leftover.extend(rows[~covered].tolist())
+    return groups + _merge_by_candidates(candidates, leftover, max_codes)
+
+
+def candidate_groups(
+    texts: List[str],
+    codes: List[Dict[str, str]],
+    top_k: int,
+    max_codes: int,
+    group_rows: int
+) -> List[Tuple[List[int], List[int]]]:
+    """检索每条文本的候选编码并分组（同步，CPU / GPU 密集，应在线程中调用）"""
+    code_vectors = code_embeddings(codes)
+    text_vectors = embed_texts(texts)
+    candidates = top_candidates(text_vectors, code_vectors, top_k)
+    return group_by_candidates(candidates, text_vectors, len(codes), max_codes, group_rows)
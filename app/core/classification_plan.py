@@ -0,0 +1,176 @@
+"""
+分类规则计划（Rule Plan）
+
+将一列的分类配置（classification_mode + mapping_dict + codes + default_code）
+编译为不可变的执行计划：有序的确定性匹配阶段 + 一个兜底策略。
+单条分类、批量分类和向量化分类都执行同一个计划；
+计划按配置哈希缓存，相同编码表的重复任务直接复用编译产物。
+"""
+import json
+import time
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.core.matching import ColumnMatch, DeterministicMatcher, get_deterministic_matcher
+from app.core.normalization import normalize_many, normalize_text
+
+# ============ 匹配阶段 ============
+STAGE_FULL = "full"  # 映射精确 → 映射部分 → 编码名称 → 关键词
+STAGE_MAPPING = "mapping"  # 映射精确 → 映射部分
+STAGE_CODE_OR_KEYWORD = "code_or_keyword"  # 逐个编码检查名称与关键词（旧模式）
+
+# ============ 兜底策略 ============
+FALLBACK_AI = "ai"
+FALLBACK_DEFAULT = "default"
+FALLBACK_NO_MATCH = "no_match"
+
+# classification_mode → (匹配阶段, 兜底策略, AI 兜底前是否先做关键词预匹配)
+_MODE_TABLE: Dict[str, Tuple[Tuple[str, ...], str, bool]] = {
+    # 固定编码 / 开放编码：先完整确定性匹配
+    "fixed_then_ai": ((STAGE_FULL,), FALLBACK_AI, False),
+    "fixed_then_default": ((STAGE_FULL,), FALLBACK_DEFAULT, False),
+    "open_then_ai": ((STAGE_FULL,), FALLBACK_AI, False),
+    "open_then_default": ((STAGE_FULL,), FALLBACK_DEFAULT, False),
+    "ai_only": ((STAGE_FULL,), FALLBACK_AI, False),
+    # 向后兼容旧模式
+    "fixed_mapping_only": ((STAGE_MAPPING, STAGE_CODE_OR_KEYWORD), FALLBACK_NO_MATCH, False),
+    "mapping_then_ai": ((STAGE_MAPPING,), FALLBACK_AI, True),
+    "mapping_then_default": ((STAGE_MAPPING,), FALLBACK_DEFAULT, False),
+    "fixed_mapping_then_default": ((STAGE_MAPPING, STAGE_CODE_OR_KEYWORD), FALLBACK_DEFAULT, False),
+    "fixed_mapping_then_ai": ((STAGE_MAPPING, STAGE_CODE_OR_KEYWORD), FALLBACK_AI, True),
+}
+# 未知模式按 ai_only 处理
+_DEFAULT_MODE = "ai_only"
+
+
+@dataclass(frozen=True)
+class ClassificationPlan:
+    """
+    编译后的分类计划（不可变，可跨任务复用）
+
+    Attributes:
+        mode: 分类模式
+        config_hash: 配置哈希（缓存键）
+        stages: 有序的确定性匹配阶段
+        fallback: 兜底策略（ai / default / no_match）
+        fallback_code: default 兜底使用的编码
+        ai_use_keywords: AI 兜底前是否先做关键词预匹配（旧模式行为）
+        matcher: 编译好的确定性匹配器
+    """
+    mode: str
+    config_hash: str
+    stages: Tuple[str, ...]
+    fallback: str
+    fallback_code: str
+    ai_use_keywords: bool
+    matcher: DeterministicMatcher
+
+    @property
+    def uses_ai(self) -> bool:
+        return self.fallback == FALLBACK_AI
+
+    @property
+    def labels(self) -> List[str]:
+        return self.matcher.labels
+
+    def _resolve(self, text: str) -> Tuple[int, int, int]:
+        """按阶段顺序匹配规范化文本，返回 (label 位置, 阶段, 规则序号)"""
+        for stage in self.stages:
+            if stage == STAGE_FULL:
+                hit = self.matcher.resolve(text)
+            elif stage == STAGE_MAPPING:
+                hit = self.matcher.resolve_mapping(text)
+            else:
+                hit = self.matcher.resolve_code_or_keyword(text)
+            if hit[1] >= 0:
+                return hit
+        return -1, -1, -1
+
+    def match(self, text: str) -> Optional[Dict[str, Any]]:
+        """执行所有确定性阶段，返回 None 表示需要走兜底策略"""
+        return self.matcher.result(*self._resolve(normalize_text(text)))
+
+    def match_many(self, values: Sequence[str]) -> ColumnMatch:
+        """整列执行确定性阶段"""
+        if self.stages == (STAGE_FULL,):
+            return self.matcher.match_many(values)
+
+        started = time.perf_counter()
+        normalized = normalize_many(values)
+        timings = {"normalize": time.perf_counter() - started}
+
+        started = time.perf_counter()
+        code_index = np.full(len(normalized), -1, dtype=np.int64)
+        method_index = np.full(len(normalized), -1, dtype=np.int8)
+        rule_index = np.full(len(normalized), -1, dtype=np.int64)
+        for pos, text in enumerate(normalized):
+            code_index[pos], method_index[pos], rule_index[pos] = self._resolve(text)
+        timings["scan"] = time.perf_counter() - started
+        return ColumnMatch(self.matcher.labels, code_index, method_index, rule_index, timings)
+
+    def fallback_result(self) -> Dict[str, Any]:
+        """非 AI 兜底策略的结果"""
+        if self.fallback == FALLBACK_NO_MATCH:
+            return {
+                "code": "未匹配",
+                "confidence": 0.0,
+                "method": "no_match"
+            }
+        return {
+            "code": self.fallback_code,
+            "confidence": 0.5,
+            "method": "default_fallback"
+        }
+
+
+def plan_config_hash(
+    classification_mode: str,
+    codes: List[Dict[str, Any]],
+    mapping_dict: Dict[str, str],
+    default_code: str
+) -> str:
+    """计算分类配置的哈希（保留顺序，顺序决定匹配优先级）"""
+    payload = json.dumps(
+        [classification_mode, codes or [], list((mapping_dict or {}).items()), default_code or ""],
+        ensure_ascii=False,
+        default=str
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+_PLAN_CACHE: "OrderedDict[str, ClassificationPlan]" = OrderedDict()
+_PLAN_CACHE_SIZE = 64
+
+
+def compile_plan(
+    classification_mode: str,
+    codes: List[Dict[str, Any]],
+    mapping_dict: Dict[str, str],
+    default_code: str
+) -> ClassificationPlan:
+    """获取（或编译并缓存）分类计划"""
+    key = plan_config_hash(classification_mode, codes, mapping_dict, default_code)
+    plan = _PLAN_CACHE.get(key)
+    if plan is not None:
+        _PLAN_CACHE.move_to_end(key)
+        return plan
+
+    mode = classification_mode if classification_mode in _MODE_TABLE else _DEFAULT_MODE
+    stages, fallback, ai_use_keywords = _MODE_TABLE[mode]
+    plan = ClassificationPlan(
+        mode=mode,
+        config_hash=key,
+        stages=stages,
+        fallback=fallback,
+        fallback_code=default_code or "其他",
+        ai_use_keywords=ai_use_keywords,
+        matcher=get_deterministic_matcher(codes, mapping_dict)
+    )
+    _PLAN_CACHE[key] = plan
+    if len(_PLAN_CACHE) > _PLAN_CACHE_SIZE:
+        _PLAN_CACHE.popitem(last=False)
+    return plan
@@ -0,0 +1,76 @@
+"""
+分层编码表（大类 → 小类）
+
+ColumnConfig.codes 中的小类用 parent 字段指向所属大类的编码，大类的说明写在
+ColumnConfig.parent_codes（可选）中：
+
+    codes = [
+        {"code": "价格偏高", "description": "...", "parent": "价格"},
+        {"code": "性价比低", "description": "...", "parent": "价格"},
+        {"code": "其他", "description": "..."},   # 没有 parent：自成一个大类
+    ]
+    parent_codes = [{"code": "价格", "description": "对价格、费用的评价"}]
+
+只要有一个小类带 parent，该列即按分层编码表两阶段分类（见
+app.core.coding_extraction.batch_classify_hierarchical）：先在大类中选择，
+再在该大类的小类中选择。
+"""
+from typing import Dict, List, Optional
+
+PARENT_KEY = "parent"
+
+# 大类没有说明时，用前几个小类名称作为说明
+_DESCRIPTION_CHILDREN = 8
+
+
+def is_hierarchical(codes: List[Dict[str, str]]) -> bool:
+    """编码表是否为分层编码表（至少一个小类带 parent）"""
+    return any(c.get(PARENT_KEY) for c in codes or [])
+
+
+def parent_of(code: Dict[str, str]) -> str:
+    """小类所属大类的编码（没有 parent 的小类自成一个大类）"""
+    return str(code.get(PARENT_KEY) or code['code'])
+
+
+def parent_map(codes: List[Dict[str, str]]) -> Dict[str, str]:
+    """{小类编码: 大类编码}"""
+    return {c['code']: parent_of(c) for c in codes}
+
+
+def children_by_parent(codes: List[Dict[str, str]]) -> Dict[str, List[Dict[str, str]]]:
+    """
+    按大类分组小类（大类按首次出现的顺序，小类保持编码表顺序）
+
+    返回的小类去掉 parent 字段，可直接作为第二阶段的（扁平）编码表。
+    """
+    groups: Dict[str, List[Dict[str, str]]] = {}
+    for c in codes:
+        child = {key: value for key, value in c.items() if key != PARENT_KEY}
+        groups.setdefault(parent_of(c), []).append(child)
+    return groups
+
+
+def parent_codebook(
+    codes: List[Dict[str, str]],
+    parent_codes: Optional[List[Dict[str, str]]] = None
+) -> List[Dict[str, str]]:
+    """
+    第一阶段的大类编码表（只包含有小类的大类）
+
+    说明优先取 parent_codes 中的说明；自成大类的小类用自身说明；
+    其余用所含小类名称（"包含：A、B、C 等"）。
+    """
+    declared = {str(p['code']): p.get('description') or "" for p in parent_codes or []}
+    parents = []
+    for parent, children in children_by_parent(codes).items():
+        description = declared.get(parent)
+        if not description:
+            if len(children) == 1 and children[0]['code'] == parent:
+                description = children[0].get('description') or ""
+            else:
+                names = [c['code'] for c in children[:_DESCRIPTION_CHILDREN]]
+                more = " 等" if len(children) > _DESCRIPTION_CHILDREN else ""
+                description = f"包含：{'、'.join(names)}{more}"
+        parents.append({"code": parent, "description": description})
+    return parents
@@ -1,12 +1,26 @@
 import json
 import re
+import time
 import asyncio
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Optional, Callable, Awaitable
 from bertopic import BERTopic
 from sentence_transformers import SentenceTransformer
 import numpy as np
+import pandas as pd
 
+from app.core.config import settings
 from app.services.aigc_service import get_aigc_service
+from app.services.concurrency import CircuitOpenError
+from app.core.matching import DeterministicMatcher, get_deterministic_matcher, match_many_async
+from app.core.classification_plan import compile_plan
+from app.core.match_profile import MatchProfile
+from app.core.llm_batching import estimate_tokens, get_token_budget, pack_batches, retry_delay
+from app.core.bulk_protocol import get_protocol, CONFIDENCE_LOGPROBS, CONFIDENCE_SELF_REPORT
+from app.core.prompts import single_text_template, single_text_input
+from app.core.normalization import normalize_text
+from app.core.local_classifier import LocalClassifier, embed_texts, stratified_sample, char_ngram_features, self_train
+from app.core.candidate_retrieval import candidate_groups
+from app.core.code_hierarchy import is_hierarchical, parent_map, children_by_parent, parent_codebook
 
 async def extract_codes_with_llm(texts: List[str], max_codes: int = 10, sample_size: int = 500) -> List[Dict[str, str]]:
     """
@@ -229,44 +243,48 @@ async def extract_codes_with_bertopic(texts: List[str], max_codes: int = 10) ->
 async def classify_text_with_codes(text: str, codes: List[Dict[str, str]], use_keywords: bool = False) -> Dict[str, Any]:
     """
     将单条文本分类到指定编码
+    
+    分层编码表（小类带 parent，见 app.core.code_hierarchy）先选大类，再在该大类的小类中选择，
+    结果额外包含 parent_code。
     """
     try:
         # 先尝试关键词匹配
         if use_keywords:
+            normalized = normalize_text(text)
             for code_info in codes:
                 if 'keywords' in code_info:
                     for keyword in code_info.get('keywords', []):
-                        if keyword.lower() in text.lower():
+                        keyword = normalize_text(keyword)
+                        if keyword and keyword in normalized:
                             return {
                                 "code": code_info['code'],
                                 "confidence": 0.9
                             }
         
+        if is_hierarchical(codes):
+            parent = await classify_text_with_codes(text, parent_codebook(codes))
+            child = await classify_text_with_codes(text, children_by_parent(codes)[parent["code"]])
+            return {**child, "parent_code": parent["code"]}
+        
         # 使用 AIGC 服务进行分类
         aigc = get_aigc_service()
         
-        codebook_text = "\n".join([
-            f"- {c['code']}: {c.get('description', c['code'])}" 
-            for c in codes
-        ])
+        # 静态前缀（说明 + 编码表）在前，文本在最后，便于前缀缓存
+        template = single_text_template(codes)
         
-        prompt = f"""请将以下文本分类到最合适的类别中。
-
-类别：
-{codebook_text}
-
-文本："{text}"
-
-只输出类别名称，不要其他内容。"""
-
-        assigned_code = await aigc.chat_completion(
-            messages=[
-                {"role": "system", "content": "你是文本分类专家。"},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.1,
-            max_tokens=50
-        )
+        deadline = time.monotonic() + settings.LLM_CIRCUIT_MAX_PAUSE_SECONDS
+        while True:
+            try:
+                assigned_code = await aigc.chat_completion(
+                    messages=template.messages(single_text_input(text)),
+                    temperature=0.1,
+                    max_tokens=50
+                )
+                break
+            except CircuitOpenError:
+                # 服务熔断中：暂停等待恢复，而不是直接返回默认编码
+                if not await aigc.wait_for_circuit(deadline):
+                    raise
         
         assigned_code = assigned_code.strip()
         
@@ -300,7 +318,9 @@ async def classify_text_with_codes(text: str, codes: List[Dict[str, str]], use_k
 def try_deterministic_match(
     text: str,
     codes: List[Dict[str, str]],
-    mapping_dict: Dict[str, str]
+    mapping_dict: Dict[str, str],
+    matcher: Optional[DeterministicMatcher] = None,
+    profile: Optional[MatchProfile] = None
 ) -> Optional[Dict[str, Any]]:
     """
     尝试确定性匹配（固定编码 + 映射字典）
@@ -311,56 +331,127 @@ def try_deterministic_match(
     2. 映射字典部分匹配（包含关系）
     3. 固定编码名称匹配
     4. 固定编码关键词匹配
-    """
-    # 1. 映射字典精确匹配
-    if text in mapping_dict:
-        return {
-            "code": mapping_dict[text],
-            "confidence": 1.0,
-            "method": "exact_mapping"
-        }
-    
     
-    # 2. 映射字典部分匹配（包含关系）
-    for key, value in mapping_dict.items():
-        if key in text or text in key:
-            return {
-                "code": value,
-                "confidence": 0.9,
-                "method": "partial_mapping"
-            }
+    文本与规则均按 normalize_text 规范化后比较（忽略全角/半角、大小写、空白和标点差异）
     
-    # 3. 固定编码名称匹配
-    for code_info in codes:
-        code = code_info['code']
-        if code in text:
-            return {
-                "code": code,
-                "confidence": 0.8,
-                "method": "fixed_code_match"
-            }
+    Args:
+        matcher: 预编译的匹配器；批量调用时应传入同一个实例，
+                 未传入时按配置从缓存获取（必要时编译）
+        profile: 可选的命中率画像，传入时记录命中规则、阶段和耗时
+    """
+    if matcher is None:
+        matcher = get_deterministic_matcher(codes, mapping_dict)
+    if profile is None:
+        return matcher.match(text)
     
-    # 4. 固定编码关键词匹配
-    for code_info in codes:
-        code = code_info['code']
-        if 'keywords' in code_info:
-            for keyword in code_info.get('keywords', []):
-                if keyword and keyword.lower() in text.lower():
-                    return {
-                        "code": code,
-                        "confidence": 0.7,
-                        "method": "keyword_match"
-                    }
+    started = time.perf_counter()
+    hit = matcher.resolve(normalize_text(text))
+    profile.record(hit, time.perf_counter() - started)
+    return matcher.result(*hit)
+
+
+def _dedup_key(text: str) -> str:
+    """
+    去重键：文本的规范形式（空值统一为空串）
     
-    # 未匹配
-    return None
+    规范化后为空的非空文本（如纯标点）保留去除首尾空白后的原文，避免被当作空值
+    """
+    if not text:
+        return ""
+    return normalize_text(text) or text.strip()
+
+
+def _fan_out_results(
+    distinct_results: List[Dict[str, Any]],
+    row_value: np.ndarray,
+    row_ids: List[str]
+) -> List[Dict[str, Any]]:
+    """将每个去重值的结果回填到对应的所有行"""
+    return [
+        {**distinct_results[pos], "row_id": row_id}
+        for pos, row_id in zip(row_value.tolist(), row_ids)
+    ]
+
+
+def _merge_counts(target: Dict[str, Any], source: Dict[str, Any]) -> None:
+    """累加统计：计数与耗时（*_seconds）相加，其余值（模型名、协议等）保留首次的值"""
+    for key, value in source.items():
+        if key not in target:
+            target[key] = value
+        elif isinstance(value, int) and not isinstance(value, bool):
+            target[key] += value
+        elif key.endswith("_seconds"):
+            target[key] = round(target[key] + value, 3)
+
+
+def _joint_confidence(parent: Optional[float], child: Optional[float]) -> Optional[float]:
+    """两阶段分类的置信度：两级都有置信度时相乘，否则取小类的置信度"""
+    if parent is None or child is None:
+        return child
+    return round(parent * child, 4)
+
+
+def _self_train_predictions(
+    values: List[str],
+    labeled_positions: List[int],
+    labels: List[str],
+    unmatched_positions: List[int]
+) -> Tuple[Dict[int, Tuple[str, float]], int]:
+    """
+    用同列已确定的取值训练字符 n-gram 分类器（自训练），预测未匹配的取值
+
+    Returns:
+        ({去重值序号: (编码, 概率)}, 伪标注数)
+    """
+    n_labeled = len(labeled_positions)
+    features = char_ngram_features([values[pos] for pos in labeled_positions + unmatched_positions])
+    predicted, confidence, pseudo = self_train(
+        features,
+        np.arange(n_labeled),
+        labels,
+        np.arange(n_labeled, n_labeled + len(unmatched_positions)),
+        settings.SELF_TRAIN_MIN_CONFIDENCE,
+        settings.SELF_TRAIN_ROUNDS
+    )
+    predictions = {
+        pos: (code, round(row_confidence, 4))
+        for pos, code, row_confidence in zip(unmatched_positions, predicted, confidence.tolist())
+    }
+    return predictions, pseudo
+
+
+async def _run_off_loop(func, *args):
+    """按配置在线程中执行同步的 CPU 密集函数，避免阻塞事件循环"""
+    if settings.DETERMINISTIC_MATCH_OFFLOAD:
+        return await asyncio.to_thread(func, *args)
+    return func(*args)
+
+
+def _factorize_dedup_keys(texts: List[str]) -> Tuple[np.ndarray, List[str], List[str]]:
+    """
+    按去重键对整列分组
+
+    先对原始取值做向量化去重，只对不同的原始取值计算去重键，再二次去重。
+    返回 (每行对应的去重值序号, 去重键列表, 代表原文列表)：
+    去重键按首次出现顺序排列，代表原文为该键首次出现时的原文（去除首尾空白），
+    用于确定性匹配和发送给 AI。
+    """
+    raw_codes, raw_values = pd.factorize(pd.Series(texts, dtype=object).fillna(""))
+    if len(raw_values) == 0:
+        return np.zeros(0, dtype=np.int64), [], []
+    key_codes, keys = pd.factorize(pd.Series([_dedup_key(v) for v in raw_values], dtype=object))
+    representatives = [None] * len(keys)
+    for raw_pos, key_pos in enumerate(key_codes.tolist()):
+        if representatives[key_pos] is None:
+            representatives[key_pos] = raw_values[raw_pos].strip()
+    return key_codes[raw_codes], list(keys), representatives
 
 
 async def batch_classify_with_ai(
     texts: List[str],
     codes: List[Dict[str, str]],
     batch_size: int = 50,
-    max_concurrent: int = 5
+    max_concurrent: Optional[int] = None
 ) -> List[Dict[str, Any]]:
     """
     批量 AI 分类（多线程并发）
@@ -369,7 +460,7 @@ async def batch_classify_with_ai(
         texts: 待分类的文本列表
         codes: 编码列表
         batch_size: 每批处理的文本数量（默认50）
-        max_concurrent: 最大并发数（默认5）
+        max_concurrent: 最大并发数（默认由 AIGCService 的自适应并发窗口控制）
     
     Returns:
         分类结果列表，顺序与输入 texts 一致
@@ -377,8 +468,8 @@ async def batch_classify_with_ai(
     if not texts:
         return []
     
-    # 创建信号量控制并发
-    semaphore = asyncio.Semaphore(max_concurrent)
+    # 创建信号量控制并发（实际并发由 AIGCService 的自适应窗口决定）
+    semaphore = asyncio.Semaphore(max_concurrent or settings.LLM_CONCURRENCY_MAX)
     
     async def classify_single(text: str, index: int) -> Tuple[int, Dict[str, Any]]:
         """分类单条文本，返回 (索引, 结果)"""
@@ -422,19 +513,39 @@ async def batch_classify_with_ai_bulk_prompt(
     texts: List[str],
     codes: List[Dict[str, str]],
     row_ids: List[str] = None,
-    batch_size: int = 50,
-    max_concurrent: int = 3
+    batch_size: Optional[int] = None,
+    max_concurrent: Optional[int] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    model: Optional[str] = None,
+    temperature: float = 0.1,
+    confidence_source: Optional[str] = None
 ) -> List[Dict[str, Any]]:
     """
     批量 AI 分类（单次请求处理多条文本，更高效）
     使用 AIGCService 统一管理限流
     
+    每个请求按 token 预算打包（编码表提示词 + 文本 + 预期输出），
+    在模型的输入 / 输出预算内尽量多放行；超长文本独占一个请求，不截断。
+    响应协议由 LLM_BATCH_RESPONSE_PROTOCOL 选择（见 app.core.bulk_protocol）。
+    编码数达到 LLM_CANDIDATE_MIN_CODES 且开启 LLM_CANDIDATE_RETRIEVAL_ENABLED 时，按句向量为每条文本
+    检索候选编码，候选相近的文本分为一组，每组请求只带组内候选编码（见 app.core.candidate_retrieval）。
+    
+    单个请求失败或部分行缺失 / 编码无效时，只重新请求失败的行；整批失败时
+    退避后二分重试，单条文本重试 LLM_BATCH_MAX_RETRIES 次后才标记为 ai_error。
+    服务熔断时整批暂停等待恢复（最长 LLM_CIRCUIT_MAX_PAUSE_SECONDS），不计入重试次数。
+    
     Args:
         texts: 待分类的文本列表
         codes: 编码列表
         row_ids: 每条文本对应的唯一ID列表（用于横向分析）
-        batch_size: 每个 API 请求处理的文本数量（默认50）
-        max_concurrent: 最大并发请求数（默认3）
+        batch_size: 每个 API 请求最多处理的文本数量（默认 LLM_BATCH_MAX_ROWS）
+        max_concurrent: 最大并发请求数（默认由 AIGCService 的自适应并发窗口控制）
+        stats: 可选的统计输出字典，写入请求数、重试计数、所用协议与候选检索信息（candidate_retrieval）
+        model: 使用的模型（默认为端点配置的模型），token 预算按该模型计算
+        temperature: 采样温度
+        confidence_source: 每行置信度来源（模型级联用）：None 不计算（confidence 为 None）；
+            "logprobs" 按编码 token 的对数概率计算（服务商不支持时为 None）；
+            "self_report" 让模型自报把握
     
     Returns:
         分类结果列表，顺序与输入 texts 一致，每个结果包含 row_id
@@ -447,117 +558,605 @@ async def batch_classify_with_ai_bulk_prompt(
         row_ids = [str(i) for i in range(len(texts))]
     
     aigc = get_aigc_service()
-    semaphore = asyncio.Semaphore(max_concurrent)
+    semaphore = asyncio.Semaphore(max_concurrent or settings.LLM_CONCURRENCY_MAX)
     
-    async def classify_batch(batch_texts: List[str], batch_row_ids: List[str], start_index: int) -> List[Tuple[int, Dict[str, Any]]]:
-        """一次 API 请求分类多条文本"""
+    # 提示词 / 响应协议：compact（编码编号数组）或 legacy（逐行回显编码名称）
+    def make_protocol(protocol_codes: List[Dict[str, str]]):
+        return get_protocol(
+            settings.LLM_BATCH_RESPONSE_PROTOCOL,
+            protocol_codes,
+            settings.LLM_BATCH_JSON_SCHEMA,
+            report_confidence=confidence_source == CONFIDENCE_SELF_REPORT
+        )
+    
+    protocol = make_protocol(codes)
+    fallback_code = codes[0]['code'] if codes else "错误"
+    retry_stats = {
+        "requests": 0,
+        "retries": 0,
+        "partial_batches": 0,
+        "salvaged_rows": 0,
+        "bisections": 0,
+        "recovered_rows": 0,
+        "failed_rows": 0,
+        "circuit_pauses": 0
+    }
+    # 熔断暂停的截止时间（首次暂停时设置，请求恢复成功后清除）
+    circuit_deadline: List[Optional[float]] = [None]
+    # 每个去重值的置信度（仅 confidence_source 不为 None 时写入）
+    unique_confidences: Dict[int, float] = {}
+    
+    async def request_batch(protocol, positions: List[int], use_cache: bool) -> Dict[int, str]:
+        """一次 API 请求分类多条文本（使用该批的协议 / 编码表），返回解析成功的 {去重值序号: 编码}"""
+        batch_texts = [unique_texts[pos] for pos in positions]
+        content, token_logprobs = None, None
         async with semaphore:
+            retry_stats["requests"] += 1
             try:
-                codebook_text = "\n".join([
-                    f"- {c['code']}: {c.get('description', c['code'])}" 
-                    for c in codes
-                ])
-                
-                # 构建批量分类的 prompt
-                texts_block = "\n".join([
-                    f"{i+1}. {t[:200]}" for i, t in enumerate(batch_texts)
-                ])
-                
-                prompt = f"""请将以下 {len(batch_texts)} 条文本分别分类到最合适的类别中。
+                # 使用 AIGCService，自带限流
+                if confidence_source == CONFIDENCE_LOGPROBS:
+                    parsed, content, token_logprobs = await aigc.chat_completion_json_with_logprobs(
+                        messages=protocol.build_messages(batch_texts),
+                        model=model,
+                        temperature=temperature,
+                        use_cache=use_cache,
+                        response_format=protocol.response_format
+                    )
+                else:
+                    parsed = await aigc.chat_completion_json(
+                        messages=protocol.build_messages(batch_texts),
+                        model=model,
+                        temperature=temperature,
+                        use_cache=use_cache,
+                        response_format=protocol.response_format
+                    )
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                print(f"Error in batch classification ({len(positions)} texts): {e}")
+                return {}
+        
+        # 只接受序号合法、编码有效的行，其余行由调用方重新请求
+        decoded = protocol.decode(parsed, len(positions))
+        if confidence_source and decoded:
+            for row, confidence in protocol.confidences(parsed, content, token_logprobs, len(positions)).items():
+                if row in decoded:
+                    unique_confidences[positions[row]] = round(confidence, 4)
+        return {positions[row]: code for row, code in decoded.items()}
+    
+    async def classify_batch(protocol, positions: List[int], failures: int = 0, retried: bool = False) -> None:
+        """
+        分类一批去重值（重试和二分沿用同一协议 / 编码表），失败时逐步恢复：
+        - 部分行解析成功：保留成功的行，只重新请求缺失 / 无效的行
+        - 整批失败（异常、JSON 无法解析、无有效行）：退避后二分，直到单条
+        - 失败次数沿二分传递（退避逐级加长）；单条累计失败超过 LLM_BATCH_MAX_RETRIES 次：标记为 ai_error
+        """
+        # 重试请求绕过响应缓存，避免重复取回同一个无效响应
+        try:
+            parsed_codes = await request_batch(protocol, positions, use_cache=not retried)
+        except CircuitOpenError:
+            # 服务熔断中：整批暂停，恢复后原样重试（不计入失败次数）
+            retry_stats["circuit_pauses"] += 1
+            if circuit_deadline[0] is None:
+                circuit_deadline[0] = time.monotonic() + settings.LLM_CIRCUIT_MAX_PAUSE_SECONDS
+            if await aigc.wait_for_circuit(circuit_deadline[0]):
+                await classify_batch(protocol, positions, failures, retried)
+                return
+            retry_stats["failed_rows"] += len(positions)
+            for pos in positions:
+                unique_results[pos] = {
+                    "row_id": unique_row_ids[pos],
+                    "code": fallback_code,
+                    "confidence": 0.0,
+                    "method": "ai_error"
+                }
+            return
+        if parsed_codes:
+            circuit_deadline[0] = None
+        for pos, code in parsed_codes.items():
+            unique_results[pos] = {
+                "row_id": unique_row_ids[pos],
+                "code": code,
+                "confidence": unique_confidences.get(pos),
+                "method": "ai_batch_classification"
+            }
+        if retried:
+            retry_stats["recovered_rows"] += len(parsed_codes)
+        
+        missing = [pos for pos in positions if pos not in parsed_codes]
+        if not missing:
+            return
+        
+        if parsed_codes:
+            retry_stats["partial_batches"] += 1
+            retry_stats["salvaged_rows"] += len(parsed_codes)
+            retry_stats["retries"] += 1
+            await classify_batch(protocol, missing, failures, retried=True)
+            return
+        
+        failures += 1
+        if len(positions) == 1 and failures > settings.LLM_BATCH_MAX_RETRIES:
+            retry_stats["failed_rows"] += 1
+            pos = positions[0]
+            unique_results[pos] = {
+                "row_id": unique_row_ids[pos],
+                "code": fallback_code,
+                "confidence": 0.0,
+                "method": "ai_error"
+            }
+            return
+        
+        await asyncio.sleep(retry_delay(failures))
+        if len(positions) > 1:
+            retry_stats["bisections"] += 1
+            retry_stats["retries"] += 2
+            mid = len(positions) // 2
+            await asyncio.gather(
+                classify_batch(protocol, positions[:mid], failures, retried=True),
+                classify_batch(protocol, positions[mid:], failures, retried=True)
+            )
+        else:
+            retry_stats["retries"] += 1
+            await classify_batch(protocol, positions, failures, retried=True)
+    
+    # 相同文本只请求一次，结果回填到所有对应行
+    text_rows: Dict[str, List[int]] = {}
+    for i, text in enumerate(texts):
+        text_rows.setdefault(text, []).append(i)
+    unique_texts = list(text_rows)
+    unique_row_ids = [row_ids[rows[0]] for rows in text_rows.values()]
+    
+    # 大编码表：按候选编码分组，每组使用只含组内候选编码的协议
+    groups = [(protocol, list(range(len(unique_texts))))]
+    if settings.LLM_CANDIDATE_RETRIEVAL_ENABLED and len(codes) >= settings.LLM_CANDIDATE_MIN_CODES:
+        try:
+            code_groups = await asyncio.to_thread(
+                candidate_groups,
+                unique_texts,
+                codes,
+                settings.LLM_CANDIDATE_TOP_K,
+                settings.LLM_CANDIDATE_MAX_CODES,
+                settings.LLM_CANDIDATE_GROUP_ROWS
+            )
+            groups = [(make_protocol([codes[i] for i in group_codes]), rows) for group_codes, rows in code_groups]
+        except Exception as e:
+            print(f"[Batch AI] Candidate retrieval failed, sending full codebook: {e}")
+    
+    # 按 token 预算分批：固定提示词 + 每行文本（含序号前缀）+ 每行预期输出
+    # 未指定模型时请求可能发往池中任一模型的端点：取各模型中最小的预算
+    budgets = [get_token_budget(budget_model) for budget_model in aigc.request_models(model)]
+    max_input_tokens = min(budget[0] for budget in budgets)
+    max_output_tokens = min(budget[1] for budget in budgets)
+    model_name = "/".join(aigc.request_models(model))
+    row_tokens = [estimate_tokens(text) + 3 for text in unique_texts]
+    max_rows = batch_size or settings.LLM_BATCH_MAX_ROWS
+    
+    def pack(group_protocol, rows: List[int]) -> List[List[int]]:
+        base_tokens = sum(estimate_tokens(m["content"]) for m in group_protocol.build_messages([]))
+        return [
+            rows[start:end]
+            for start, end in pack_batches(
+                [row_tokens[pos] for pos in rows],
+                base_tokens,
+                group_protocol.row_output_tokens,
+                max_input_tokens,
+                max_output_tokens,
+                max_rows
+            )
+        ]
+    
+    batches = [(group_protocol, batch) for group_protocol, rows in groups for batch in pack(group_protocol, rows)]
+    
+    candidate_stats = None
+    if groups[0][0] is not protocol:
+        # 估算提示词 token：候选编码表 vs 完整编码表（同样的文本按完整编码表打包）
+        full_batches = pack(protocol, list(range(len(unique_texts))))
+        candidate_stats = {
+            "codes": len(codes),
+            "groups": len(groups),
+            "avg_group_codes": round(sum(len(p.valid_codes) for p, _ in groups) / len(groups), 1),
+            "estimated_prompt_tokens": sum(
+                estimate_tokens(p.template.prefix) + sum(row_tokens[pos] for pos in batch) for p, batch in batches
+            ),
+            "estimated_prompt_tokens_full_codebook": (
+                estimate_tokens(protocol.template.prefix) * len(full_batches) + sum(row_tokens)
+            ),
+        }
+        # 文本太少、分组过碎时候选编码表反而更费 token：退回完整编码表
+        candidate_stats["used"] = (
+            candidate_stats["estimated_prompt_tokens"] < candidate_stats["estimated_prompt_tokens_full_codebook"]
+        )
+        if not candidate_stats["used"]:
+            batches = [(protocol, batch) for batch in full_batches]
+    
+    unique_results = [None] * len(unique_texts)
+    tasks = [classify_batch(batch_protocol, positions) for batch_protocol, positions in batches]
+    
+    if candidate_stats is not None and candidate_stats["used"]:
+        print(f"[Batch AI] {len(unique_texts)} texts in {len(groups)} candidate groups "
+              f"(avg {candidate_stats['avg_group_codes']} of {len(codes)} codes), packed into {len(batches)} requests "
+              f"(model: {model_name}, protocol: {protocol.name}, "
+              f"estimated prompt tokens: {candidate_stats['estimated_prompt_tokens']} vs "
+              f"{candidate_stats['estimated_prompt_tokens_full_codebook']} with full codebook)")
+    else:
+        print(f"[Batch AI] {len(unique_texts)} texts packed into {len(batches)} requests "
+              f"(model: {model_name}, protocol: {protocol.name}, prefix: {protocol.template.prefix_hash}, budget: {max_input_tokens} input / {max_output_tokens} output tokens)")
+    
+    # 并发执行所有批次（各批次内部负责重试，结果直接写入 unique_results）
+    await asyncio.gather(*tasks)
+    
+    if retry_stats["retries"]:
+        print(f"[Batch AI] Retries: {retry_stats['retries']}, salvaged: {retry_stats['salvaged_rows']}, "
+              f"recovered: {retry_stats['recovered_rows']}, failed: {retry_stats['failed_rows']}")
+    if stats is not None:
+        stats.update(retry_stats)
+        stats["protocol"] = protocol.name
+        # 候选检索时每组前缀不同，不记录单个前缀哈希
+        stats["prompt_prefix_hash"] = None if candidate_stats and candidate_stats["used"] else protocol.template.prefix_hash
+        if candidate_stats is not None:
+            stats["candidate_retrieval"] = candidate_stats
+    
+    all_results = [None] * len(texts)
+    for result, rows in zip(unique_results, text_rows.values()):
+        for i in rows:
+            all_results[i] = {**result, "row_id": row_ids[i]}
+    
+    return all_results
 
-可选类别：
-{codebook_text}
 
-待分类文本：
-{texts_block}
+async def batch_classify_with_cascade(
+    texts: List[str],
+    codes: List[Dict[str, str]],
+    batch_size: Optional[int] = None,
+    max_concurrent: Optional[int] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    cascade_stats: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
+    """
+    模型级联批量分类：便宜模型先分类全部文本，只把没把握的行交给强模型
+    
+    1. 便宜模型（LLM_CASCADE_CHEAP_MODEL）分类全部文本，并给出每行置信度
+       （LLM_CASCADE_CONFIDENCE_SOURCE：token 对数概率或模型自报）
+    2. 置信度低于 LLM_CASCADE_CONFIDENCE_THRESHOLD 的行、便宜模型失败的行升级；
+       开启 LLM_CASCADE_AGREEMENT_CHECK 时，其余行再用便宜模型以较高温度采样一次，
+       两次结果不一致的行同样升级（没有置信度信号的行只靠一致性检查判断）
+    3. 升级的行由强模型（LLM_CASCADE_STRONG_MODEL）重新分类；强模型失败时保留便宜模型的结果
+    
+    结果的 method 记录由哪一级决定：ai_cascade_cheap / ai_cascade_strong（失败仍为 ai_error）；
+    没有置信度信号且一致性检查的再采样失败、未经任何校验即采用的便宜模型结果为 ai_cascade_unverified，
+    confidence 为决定该行的模型给出的置信度（无信号时为 None）。
+    
+    Args:
+        texts: 待分类的文本列表
+        codes: 编码列表
+        batch_size: 每个 API 请求最多处理的文本数量
+        max_concurrent: 最大并发请求数
+        stats: 可选的统计输出字典，写入各级请求数 / 重试计数之和（与 batch_classify_with_ai_bulk_prompt 相同的键）
+        cascade_stats: 可选的统计输出字典，写入各级处理的行数与耗时
+    
+    Returns:
+        分类结果列表，顺序与输入 texts 一致
+    """
+    if not texts:
+        return []
+    
+    cheap_model = settings.LLM_CASCADE_CHEAP_MODEL or get_aigc_service().default_model
+    strong_model = settings.LLM_CASCADE_STRONG_MODEL
+    source = settings.LLM_CASCADE_CONFIDENCE_SOURCE
+    threshold = settings.LLM_CASCADE_CONFIDENCE_THRESHOLD
+    agreement_check = settings.LLM_CASCADE_AGREEMENT_CHECK
+    tier_stats: List[Dict[str, Any]] = []
+    
+    async def run_tier(indexes: List[int], **kwargs) -> Tuple[List[Dict[str, Any]], float]:
+        tier_stats.append({})
+        started = time.perf_counter()
+        tier_results = await batch_classify_with_ai_bulk_prompt(
+            [texts[i] for i in indexes],
+            codes,
+            batch_size=batch_size,
+            max_concurrent=max_concurrent,
+            stats=tier_stats[-1],
+            **kwargs
+        )
+        return tier_results, time.perf_counter() - started
+    
+    # ============ 第一级：便宜模型 ============
+    results, cheap_seconds = await run_tier(list(range(len(texts))), model=cheap_model, confidence_source=source)
+    
+    escalate: List[int] = []
+    accepted: List[int] = []
+    low_confidence = no_signal = cheap_errors = 0
+    for i, result in enumerate(results):
+        if result["method"] == "ai_error":
+            cheap_errors += 1
+            escalate.append(i)
+            continue
+        result["method"] = "ai_cascade_cheap"
+        if result["confidence"] is None:
+            no_signal += 1
+            # 没有置信度信号：有一致性检查时交给它判断，否则保守升级
+            (accepted if agreement_check else escalate).append(i)
+        elif result["confidence"] < threshold:
+            low_confidence += 1
+            escalate.append(i)
+        else:
+            accepted.append(i)
+    
+    # ============ 一致性检查：便宜模型再采样一次 ============
+    disagreements = 0
+    agreement_seconds = 0.0
+    if agreement_check and accepted:
+        second, agreement_seconds = await run_tier(
+            accepted, model=cheap_model, temperature=settings.LLM_CASCADE_SAMPLE_TEMPERATURE
+        )
+        # 第二次采样失败的行不作判断，保留第一次的结果（没有置信度信号的行标记为未校验）
+        disagreeing = [
+            i for i, result in zip(accepted, second)
+            if result["method"] != "ai_error" and result["code"] != results[i]["code"]
+        ]
+        for i, result in zip(accepted, second):
+            if result["method"] == "ai_error" and results[i]["confidence"] is None:
+                results[i]["method"] = "ai_cascade_unverified"
+        disagreements = len(disagreeing)
+        escalate = sorted(escalate + disagreeing)
+    
+    # ============ 第二级：强模型 ============
+    strong_rows = 0
+    strong_seconds = 0.0
+    if escalate:
+        print(f"[Cascade] Escalating {len(escalate)}/{len(texts)} texts from {cheap_model} to {strong_model} "
+              f"(low confidence: {low_confidence}, disagreements: {disagreements}, cheap errors: {cheap_errors})")
+        strong, strong_seconds = await run_tier(escalate, model=strong_model, confidence_source=source)
+        for i, result in zip(escalate, strong):
+            if result["method"] != "ai_error":
+                results[i] = {**result, "row_id": results[i]["row_id"], "method": "ai_cascade_strong"}
+                strong_rows += 1
+    
+    if stats is not None:
+        # 各级请求数 / 重试计数相加，协议与前缀哈希取第一级
+        for tier in tier_stats:
+            _merge_counts(stats, tier)
+    if cascade_stats is not None:
+        cascade_stats.update({
+            "cheap_model": cheap_model,
+            "strong_model": strong_model,
+            "confidence_source": source,
+            "threshold": threshold,
+            "rows": len(texts),
+            "cheap_rows": sum(1 for r in results if r["method"] == "ai_cascade_cheap"),
+            "unverified_rows": sum(1 for r in results if r["method"] == "ai_cascade_unverified"),
+            "strong_rows": strong_rows,
+            "escalated": len(escalate),
+            "low_confidence": low_confidence,
+            "disagreements": disagreements,
+            "no_signal": no_signal,
+            "cheap_errors": cheap_errors,
+            "cheap_seconds": round(cheap_seconds, 3),
+            "agreement_seconds": round(agreement_seconds, 3),
+            "strong_seconds": round(strong_seconds, 3),
+        })
+    
+    return results
 
-请按以下 JSON 格式输出，每条文本对应一个分类结果：
-{{
-    "results": [
-        {{"index": 1, "code": "类别名称"}},
-        {{"index": 2, "code": "类别名称"}},
-        ...
-    ]
-}}
 
-只输出 JSON，不要其他内容。"""
+async def batch_classify_with_local_model(
+    texts: List[str],
+    codes: List[Dict[str, str]],
+    llm_classify: Callable[[List[str]], Awaitable[List[Dict[str, Any]]]],
+    local_stats: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
+    """
+    本地模型分类：LLM 只标注分层样本和不确定的行，其余由句向量分类器本地分类
+    
+    1. 所有文本编码为句向量，按聚类分层抽取 LOCAL_MODEL_SEED_RATIO 的样本交给 LLM 标注
+    2. 用 LLM 标注训练分类器（LOCAL_MODEL_ALGORITHM），预测其余文本
+    3. 前两名概率差低于 LOCAL_MODEL_MARGIN_THRESHOLD 的行不确定：最多 LOCAL_MODEL_ACTIVE_ROUNDS 轮，
+       每轮把最不确定的 LOCAL_MODEL_QUERY_SIZE 行交给 LLM 标注后重新训练
+    4. 本地分类确定的行 method 为 local_model，confidence 为分类器给出的概率；
+       仍不确定的行全部交给 LLM
+    
+    文本少于 LOCAL_MODEL_MIN_ROWS、句向量模型不可用或标注中少于 2 个编码时全部交给 LLM。
+    
+    Args:
+        texts: 待分类的文本列表（已去重）
+        codes: 编码列表
+        llm_classify: LLM 分类函数（文本列表 → 结果列表，如 batch_classify_with_ai_bulk_prompt / 模型级联）
+        local_stats: 可选的统计输出字典，写入 LLM 标注 / 本地分类行数、轮数与耗时
+    
+    Returns:
+        分类结果列表，顺序与输入 texts 一致
+    """
+    n_rows = len(texts)
+    if n_rows < settings.LOCAL_MODEL_MIN_ROWS:
+        return await llm_classify(texts)
+    
+    started = time.perf_counter()
+    try:
+        # 句向量编码是 CPU / GPU 密集操作，在线程中执行
+        embeddings = await asyncio.to_thread(embed_texts, texts)
+    except Exception as e:
+        print(f"[Local Model] Embedding failed, falling back to LLM for all {n_rows} texts: {e}")
+        return await llm_classify(texts)
+    embedding_seconds = time.perf_counter() - started
+    
+    results: List[Optional[Dict[str, Any]]] = [None] * n_rows
+    llm_rows = 0
+    
+    async def label(indexes: List[int]) -> None:
+        """LLM 标注指定行（结果即为这些行的最终结果）"""
+        nonlocal llm_rows
+        llm_results = await llm_classify([texts[i] for i in indexes])
+        for i, result in zip(indexes, llm_results):
+            results[i] = {**result, "row_id": str(i)}
+        llm_rows += len(indexes)
+    
+    # ============ 分层抽样，LLM 标注 ============
+    seed_size = min(max(settings.LOCAL_MODEL_SEED_MIN, int(n_rows * settings.LOCAL_MODEL_SEED_RATIO)),
+                    settings.LOCAL_MODEL_SEED_MAX)
+    seed = await asyncio.to_thread(stratified_sample, embeddings, seed_size, settings.LOCAL_MODEL_STRATA)
+    print(f"[Local Model] Labeling {len(seed)} stratified samples of {n_rows} texts with LLM...")
+    await label(seed.tolist())
+    
+    # ============ 训练 → 预测 → 不确定性采样 ============
+    classifier = LocalClassifier(settings.LOCAL_MODEL_ALGORITHM)
+    threshold = settings.LOCAL_MODEL_MARGIN_THRESHOLD
+    rounds = 0
+    pending = np.zeros(0, dtype=np.int64)
+    predicted: List[str] = []
+    confidence = margin = np.zeros(0)
+    trained = False
+    while True:
+        pending = np.asarray([i for i in range(n_rows) if results[i] is None], dtype=np.int64)
+        if len(pending) == 0:
+            break
+        train = [i for i in range(n_rows) if results[i] is not None and results[i]["method"] != "ai_error"]
+        try:
+            await asyncio.to_thread(classifier.fit, embeddings[train], [results[i]["code"] for i in train])
+        except ValueError as e:
+            print(f"[Local Model] Cannot train classifier ({e}), falling back to LLM")
+            trained = False
+            break
+        trained = True
+        predicted, confidence, margin = await asyncio.to_thread(classifier.predict, embeddings[pending])
+        uncertain = int((margin < threshold).sum())
+        print(f"[Local Model] Round {rounds}: trained on {len(train)} labels, "
+              f"{len(pending) - uncertain}/{len(pending)} confident")
+        if rounds >= settings.LOCAL_MODEL_ACTIVE_ROUNDS or uncertain <= settings.LOCAL_MODEL_QUERY_SIZE:
+            break
+        rounds += 1
+        # 不确定性采样：标注前两名概率差最小的行
+        query = pending[np.argsort(margin, kind="stable")[:settings.LOCAL_MODEL_QUERY_SIZE]]
+        await label(sorted(query.tolist()))
+    
+    local_rows = 0
+    if trained:
+        for i, code, row_confidence, row_margin in zip(pending.tolist(), predicted, confidence.tolist(), margin.tolist()):
+            if row_margin >= threshold:
+                results[i] = {
+                    "row_id": str(i),
+                    "code": code,
+                    "confidence": round(row_confidence, 4),
+                    "method": "local_model"
+                }
+                local_rows += 1
+    
+    # ============ 仍不确定的行交给 LLM ============
+    remaining = [i for i in range(n_rows) if results[i] is None]
+    if remaining:
+        print(f"[Local Model] {local_rows} texts classified locally, sending {len(remaining)} uncertain texts to LLM")
+        await label(remaining)
+    
+    if local_stats is not None:
+        local_stats.update({
+            "algorithm": settings.LOCAL_MODEL_ALGORITHM,
+            "embedding_model": settings.LOCAL_MODEL_EMBEDDING_MODEL,
+            "rows": n_rows,
+            "seed_rows": len(seed),
+            "active_rounds": rounds,
+            "llm_rows": llm_rows,
+            "local_rows": local_rows,
+            "fallback_rows": len(remaining),
+            "classes": len(classifier.classes),
+            "embedding_seconds": round(embedding_seconds, 3),
+            "total_seconds": round(time.perf_counter() - started, 3),
+        })
+    
+    return results
 
-                # 使用 AIGCService，自带限流
-                parsed = await aigc.chat_completion_json(
-                    messages=[
-                        {"role": "system", "content": "你是文本分类专家，擅长批量处理文本分类任务。请只输出JSON格式结果。"},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.1
-                )
-                
-                results_list = parsed.get('results', [])
-                
-                # 验证并构建结果
-                valid_codes = [c['code'] for c in codes]
-                output = []
-                
-                for i, text in enumerate(batch_texts):
-                    # 找到对应的结果
-                    result_item = next(
-                        (r for r in results_list if r.get('index') == i + 1), 
-                        None
-                    )
-                    
-                    if result_item:
-                        assigned_code = result_item.get('code', '')
-                        # 验证编码有效性
-                        if assigned_code not in valid_codes:
-                            for valid_code in valid_codes:
-                                if valid_code in assigned_code or assigned_code in valid_code:
-                                    assigned_code = valid_code
-                                    break
-                            else:
-                                assigned_code = valid_codes[0] if valid_codes else "未分类"
-                    else:
-                        assigned_code = valid_codes[0] if valid_codes else "未分类"
-                    
-                    output.append((start_index + i, {
-                        "row_id": batch_row_ids[i],
-                        "code": assigned_code,
-                        "confidence": None,
-                        "method": "ai_batch_classification"
-                    }))
-                
-                return output
-                
-            except Exception as e:
-                print(f"Error in batch classification: {e}")
-                # 返回默认结果
-                return [
-                    (start_index + i, {
-                        "row_id": batch_row_ids[i],
-                        "code": codes[0]['code'] if codes else "错误",
-                        "confidence": 0.0,
-                        "method": "ai_error"
-                    })
-                    for i in range(len(batch_texts))
-                ]
+
+async def batch_classify_hierarchical(
+    texts: List[str],
+    codes: List[Dict[str, str]],
+    parent_codes: Optional[List[Dict[str, str]]],
+    classify: Callable[[List[str], List[Dict[str, str]]], Awaitable[List[Dict[str, Any]]]],
+    hierarchy_stats: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
+    """
+    分层编码表的两阶段批量分类（编码表结构见 app.core.code_hierarchy）
     
-    # 分批处理
-    all_results = [None] * len(texts)
-    tasks = []
+    1. 第一阶段：只用大类编码表（几个到几十个大类）分类全部文本
+    2. 第二阶段：按第一阶段的大类分组，每组只用该大类的小类编码表分类，各大类并发；
+       只有一个小类的大类（含没有 parent 的小类）在第一阶段即确定
     
-    for batch_start in range(0, len(texts), batch_size):
-        batch_end = min(batch_start + batch_size, len(texts))
-        batch_texts = texts[batch_start:batch_end]
-        batch_row_ids = row_ids[batch_start:batch_end]
-        tasks.append(classify_batch(batch_texts, batch_row_ids, batch_start))
+    结果的 code 为小类，parent_code 为大类，method 为决定小类的那次分类的方法；
+    第一阶段失败的行 parent_code 为 None，code 为编码表第一个小类（method 为 ai_error）。
     
-    # 并发执行所有批次
-    all_batch_results = await asyncio.gather(*tasks)
+    Args:
+        texts: 待分类的文本列表
+        codes: 小类编码列表（带 parent 字段）
+        parent_codes: 大类编码列表（可选，提供大类说明）
+        classify: 扁平编码表的批量分类函数 (文本列表, 编码表) → 结果列表
+                  （如 batch_classify_with_ai_bulk_prompt 或模型级联）
+        hierarchy_stats: 可选的统计输出字典，写入各阶段的行数、失败数与耗时
     
-    # 合并结果
-    for batch_results in all_batch_results:
-        for index, result in batch_results:
-            all_results[index] = result
+    Returns:
+        分类结果列表，顺序与输入 texts 一致
+    """
+    if not texts:
+        return []
     
-    return all_results
+    parents = parent_codebook(codes, parent_codes)
+    children = children_by_parent(codes)
+    fallback_code = codes[0]['code'] if codes else "错误"
+    results: List[Optional[Dict[str, Any]]] = [None] * len(texts)
+    
+    # ============ 第一阶段：大类 ============
+    started = time.perf_counter()
+    parent_results = await classify(texts, parents)
+    parent_seconds = time.perf_counter() - started
+    
+    rows_by_parent: Dict[str, List[int]] = {}
+    parent_errors = direct_rows = 0
+    for i, result in enumerate(parent_results):
+        if result["method"] == "ai_error":
+            parent_errors += 1
+            results[i] = {**result, "code": fallback_code, "parent_code": None}
+            continue
+        group = children[result["code"]]
+        if len(group) == 1:
+            direct_rows += 1
+            results[i] = {**result, "code": group[0]['code'], "parent_code": result["code"]}
+        else:
+            rows_by_parent.setdefault(result["code"], []).append(i)
+    
+    # ============ 第二阶段：按大类分组，只带该大类的小类 ============
+    async def classify_children(parent: str, indexes: List[int]) -> None:
+        child_results = await classify([texts[i] for i in indexes], children[parent])
+        for i, child in zip(indexes, child_results):
+            results[i] = {
+                **child,
+                "row_id": parent_results[i]["row_id"],
+                "parent_code": parent,
+                "confidence": _joint_confidence(parent_results[i]["confidence"], child["confidence"])
+            }
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(classify_children(parent, indexes) for parent, indexes in rows_by_parent.items()))
+    child_seconds = time.perf_counter() - started
+    
+    child_rows = sum(len(indexes) for indexes in rows_by_parent.values())
+    child_errors = sum(
+        1 for indexes in rows_by_parent.values() for i in indexes if results[i]["method"] == "ai_error"
+    )
+    print(f"[Hierarchy] {len(texts)} texts: {len(parents)} parent codes, {child_rows} texts re-classified "
+          f"in {len(rows_by_parent)} parent groups, {direct_rows} decided by parent, {parent_errors} parent errors "
+          f"(parent: {parent_seconds:.1f}s, child: {child_seconds:.1f}s)")
+    
+    if hierarchy_stats is not None:
+        hierarchy_stats.update({
+            "parents": len(parents),
+            "leaves": len(codes),
+            "rows": len(texts),
+            "parent_errors": parent_errors,
+            "direct_rows": direct_rows,
+            "child_rows": child_rows,
+            "child_groups": len(rows_by_parent),
+            "child_errors": child_errors,
+            "parent_seconds": round(parent_seconds, 3),
+            "child_seconds": round(child_seconds, 3),
+        })
+    
+    return results
 
 
 async def classify_with_mode(
@@ -580,59 +1179,23 @@ async def classify_with_mode(
     Returns:
         分类结果 {code, confidence, method}
     
-    固定编码模式（mode=fixed）的两种策略：
-    - fixed_then_ai: 先确定性匹配，未匹配的用 AI 分类
-    - fixed_then_default: 先确定性匹配，未匹配的归入默认编码
-    
-    开放编码模式（mode=open）：
-    - ai_only: 全部使用 AI 分类
+    各模式的匹配阶段与兜底策略见 app.core.classification_plan：
+    - fixed_then_ai / open_then_ai / ai_only: 先确定性匹配，未匹配的用 AI 分类
+    - fixed_then_default / open_then_default: 先确定性匹配，未匹配的归入默认编码
+    - 旧模式（fixed_mapping_only、mapping_then_ai 等）保持原有阶段顺序
     """
+    plan = compile_plan(classification_mode, codes, mapping_dict, default_code)
     
-    # ============ 固定编码模式的策略 ============
-    if classification_mode == "fixed_then_ai":
-        # 策略1：先确定性匹配，未匹配的用 AI
-        result = try_deterministic_match(text, codes, mapping_dict)
-        if result:
-            return result
-        # 未匹配，使用 AI
-        ai_result = await classify_text_with_codes(text, codes, use_keywords=False)
+    result = plan.match(text)
+    if result:
+        return result
+    
+    if plan.uses_ai:
+        ai_result = await classify_text_with_codes(text, codes, use_keywords=plan.ai_use_keywords)
         ai_result["method"] = "ai_classification"
         return ai_result
     
-    elif classification_mode == "fixed_then_default":
-        # 策略2：先确定性匹配，未匹配的归入默认编码
-        result = try_deterministic_match(text, codes, mapping_dict)
-        if result:
-            return result
-        # 未匹配，归入默认编码
-        return {
-            "code": default_code or "其他",
-            "confidence": 0.5,
-            "method": "default_fallback"
-        }
-    
-    # ============ 开放编码模式 ============
-    elif classification_mode == "ai_only":
-        result = await classify_text_with_codes(text, codes, use_keywords=False)
-        result["method"] = "ai_classification"
-        return result
-    
-    # ============ 向后兼容旧模式 ============
-    elif classification_mode == "fixed_mapping_only":
-        return await _classify_fixed_mapping_only(text, codes, mapping_dict)
-    elif classification_mode == "mapping_then_ai":
-        return await _classify_mapping_then_ai(text, codes, mapping_dict)
-    elif classification_mode == "mapping_then_default":
-        return await _classify_mapping_then_default(text, mapping_dict, default_code)
-    elif classification_mode == "fixed_mapping_then_default":
-        return await _classify_fixed_mapping_then_default(text, codes, mapping_dict, default_code)
-    elif classification_mode == "fixed_mapping_then_ai":
-        return await _classify_fixed_mapping_then_ai(text, codes, mapping_dict)
-    else:
-        # 默认使用 ai_only
-        result = await classify_text_with_codes(text, codes, use_keywords=False)
-        result["method"] = "ai_classification"
-        return result
+    return plan.fallback_result()
 
 
 async def classify_column_batch(
@@ -642,25 +1205,36 @@ async def classify_column_batch(
     mapping_dict: Dict[str, str],
     default_code: str,
     row_ids: List[str] = None,
-    batch_size: int = 50,
-    max_concurrent: int = 3
+    batch_size: Optional[int] = None,
+    max_concurrent: Optional[int] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    answer_memory: Optional[Callable[[List[str]], Dict[str, Dict[str, Any]]]] = None,
+    cascade: Optional[bool] = None,
+    local_model: Optional[bool] = None,
+    self_training: Optional[bool] = None,
+    parent_codes: Optional[List[Dict[str, str]]] = None
 ) -> List[Dict[str, Any]]:
     """
     批量分类整列数据（统一处理开放编码和固定编码）
     支持限流：每分钟最多100次 API 调用
     
     统一工作流程：
-    1. 先对所有文本执行确定性匹配（编码库 + 映射字典）
-    2. 收集未匹配的文本
-    3. 根据策略处理未匹配文本：
+    1. 按规范化取值去重，每个不同取值只分类一次
+    2. 对所有不同取值执行确定性匹配（编码库 + 映射字典）
+    3. 收集未匹配的取值；AI 兜底的模式开启自训练时，用已匹配的取值训练字符 n-gram 分类器，
+       置信度达标的未匹配取值直接本地分类（method 为 self_trained，不需要网络）
+    4. 根据策略处理剩余的未匹配取值：
        - *_then_default: 未匹配归入默认编码
-       - *_then_ai: 未匹配用 AI 批量分类
-    4. 合并结果
+       - *_then_ai: 先查跨任务答案记忆（memory_match），仍未命中的用 AI 批量分类
+         （开启模型级联时便宜模型先分类，没把握的行再交给强模型，见 batch_classify_with_cascade；
+          开启本地模型时 LLM 只标注样本和不确定的行，其余本地分类，见 batch_classify_with_local_model；
+          分层编码表先分大类再分小类，见 batch_classify_hierarchical）
+    5. 将结果回填到所有对应行（分层编码表的结果额外包含大类 parent_code）
     
     Args:
         texts: 待分类的文本列表
         codes: 编码列表（固定编码或 AI 生成的编码）
-        classification_mode: 分类策略
+        classification_mode: 分类策略（各模式的阶段见 app.core.classification_plan）
             - open_then_default: 开放编码 → 未匹配归入默认
             - open_then_ai: 开放编码 → 未匹配用 AI 分类
             - fixed_then_default: 固定编码 → 未匹配归入默认
@@ -668,8 +1242,18 @@ async def classify_column_batch(
         mapping_dict: 映射字典
         default_code: 默认编码
         row_ids: 每条文本对应的唯一ID列表（题目/ID列的值，用于横向分析）
-        batch_size: AI 批量处理的文本数量
-        max_concurrent: AI 最大并发数
+        batch_size: 每个 AI 请求最多处理的文本数量（默认按 token 预算打包，上限 LLM_BATCH_MAX_ROWS）
+        max_concurrent: AI 最大并发数（默认由 AIGCService 的自适应并发窗口控制）
+        stats: 可选的统计输出字典，写入去重信息（dedup）、规则命中率画像（profile）、
+               AI 请求重试计数（ai_retries）、模型级联各级行数（ai_cascade）
+               本地模型分类行数（ai_local_model）、自训练分类行数（self_training）
+               和分层编码表两阶段分类的行数（hierarchy）
+        answer_memory: 可选的答案记忆查找函数（去重键列表 → {去重键: 分类结果}），
+                       仅在 AI 兜底前调用
+        cascade: 是否使用模型级联（默认 LLM_CASCADE_ENABLED）
+        local_model: 是否使用本地分类模型（默认 LOCAL_MODEL_ENABLED）
+        self_training: 是否使用自训练分类（默认 SELF_TRAIN_ENABLED）
+        parent_codes: 分层编码表的大类列表（可选，codes 中小类的 parent 字段指向大类编码）
     
     Returns:
         分类结果列表，顺序与输入一致，每个结果包含 row_id
@@ -678,287 +1262,231 @@ async def classify_column_batch(
     if row_ids is None:
         row_ids = [str(i) for i in range(len(texts))]
     
-    results = [None] * len(texts)
-    unmatched_indices = []
-    unmatched_texts = []
-    unmatched_row_ids = []
+    # 整列共用一个编译好的分类计划（按配置哈希缓存，跨任务复用）
+    plan = compile_plan(classification_mode, codes, mapping_dict, default_code)
+    
+    # ============ 去重：相同取值只分类一次 ============
+    # row_value[i] 为第 i 行对应的去重值序号，values 为所有不同取值
+    row_value, values, representatives = await _run_off_loop(_factorize_dedup_keys, texts)
+    distinct_results: List[Optional[Dict[str, Any]]] = [None] * len(values)
+    unmatched_values = []
+    unmatched_positions = []
     
-    # ============ 第一阶段：确定性匹配（统一流程） ============
+    # ============ 第一阶段：确定性匹配（统一流程，整列向量化） ============
     # 无论是开放编码还是固定编码，都先尝试确定性匹配
-    for i, text in enumerate(texts):
-        row_id = row_ids[i]
-        
-        if not text or text.strip() == '':
-            results[i] = {
-                "row_id": row_id,
+    # CPU 密集的匹配在事件循环之外执行（线程或进程池分片）
+    column_match = await match_many_async(
+        plan,
+        representatives,
+        workers=settings.DETERMINISTIC_MATCH_WORKERS,
+        shard_size=settings.DETERMINISTIC_MATCH_SHARD_SIZE,
+        offload=settings.DETERMINISTIC_MATCH_OFFLOAD
+    )
+    for pos, value in enumerate(values):
+        if value == '':
+            distinct_results[pos] = {
                 "code": "N/A",
                 "confidence": 1.0,
                 "method": "empty_text"
             }
             continue
         
-        # 尝试确定性匹配（编码库关键词 + 映射字典）
-        match_result = try_deterministic_match(text, codes, mapping_dict)
+        match_result = column_match.result(pos)
         if match_result:
-            match_result["row_id"] = row_id
-            results[i] = match_result
+            distinct_results[pos] = match_result
         else:
-            unmatched_indices.append(i)
-            unmatched_texts.append(text)
-            unmatched_row_ids.append(row_id)
+            unmatched_positions.append(pos)
+            unmatched_values.append(representatives[pos])
     
     # ============ 第二阶段：处理未匹配文本（统一策略） ============
-    if unmatched_texts:
-        # 判断是否使用 AI 分类
-        use_ai = classification_mode in ("fixed_then_ai", "open_then_ai", "ai_only")
-        
-        if use_ai:
-            # 策略：批量 AI 分类
-            print(f"[Batch AI] Processing {len(unmatched_texts)} unmatched texts...")
-            ai_results = await batch_classify_with_ai_bulk_prompt(
-                unmatched_texts, 
-                codes,
-                row_ids=unmatched_row_ids,
-                batch_size=batch_size,
-                max_concurrent=max_concurrent
-            )
-            for idx, ai_result in zip(unmatched_indices, ai_results):
-                results[idx] = ai_result
-        else:
-            # 策略：全部归入默认编码
-            for i, idx in enumerate(unmatched_indices):
-                results[idx] = {
-                    "row_id": unmatched_row_ids[i],
-                    "code": default_code or "其他",
-                    "confidence": 0.5,
-                    "method": "default_fallback"
-                }
+    value_counts = np.bincount(row_value, minlength=len(values))
+    use_ai = plan.uses_ai
     
-    return results
-
-
-async def _classify_fixed_mapping_only(
-    text: str,
-    codes: List[Dict[str, str]],
-    mapping_dict: Dict[str, str]
-) -> Dict[str, Any]:
-    """
-    模式1：仅固定编码+映射字典
-    工作流程：映射字典匹配 → 固定编码关键词匹配 → 失败抛出错误
-    """
-    # 1. 精确匹配映射字典
-    if text in mapping_dict:
-        return {
-            "code": mapping_dict[text],
-            "confidence": 1.0,
-            "method": "exact_mapping"
-        }
+    # 跨任务答案记忆：历史任务中已分类过的取值直接复用，不再发送给 AI
+    memory_rows = 0
+    memory_values = 0
+    if use_ai and answer_memory is not None and unmatched_positions:
+        remembered = answer_memory([values[pos] for pos in unmatched_positions])
+        if remembered:
+            still_positions = []
+            still_values = []
+            for pos, value in zip(unmatched_positions, unmatched_values):
+                memory_result = remembered.get(values[pos])
+                if memory_result:
+                    distinct_results[pos] = dict(memory_result)
+                    memory_rows += int(value_counts[pos])
+                    memory_values += 1
+                else:
+                    still_positions.append(pos)
+                    still_values.append(value)
+            unmatched_positions, unmatched_values = still_positions, still_values
     
-    # 2. 部分匹配映射字典（包含关系）
-    for key, value in mapping_dict.items():
-        if key in text or text in key:
-            return {
-                "code": value,
-                "confidence": 0.9,
-                "method": "partial_mapping"
+    # 自训练分类：同列已确定的取值（确定性匹配、答案记忆）作为训练数据，完全离线
+    if self_training is None:
+        self_training = settings.SELF_TRAIN_ENABLED
+    self_train_predictions: Dict[int, Tuple[str, float]] = {}
+    self_train_stats: Dict[str, Any] = {}
+    # 只在 AI 兜底的模式中使用：*_then_default 等模式的未匹配取值按配置归入默认编码，不能被预测结果替换
+    if use_ai and self_training and unmatched_positions:
+        labeled_positions = [
+            pos for pos, result in enumerate(distinct_results)
+            if result is not None and result["method"] != "empty_text"
+        ]
+        if len(labeled_positions) >= settings.SELF_TRAIN_MIN_LABELS:
+            self_train_started = time.perf_counter()
+            pseudo_labels = 0
+            try:
+                self_train_predictions, pseudo_labels = await asyncio.to_thread(
+                    _self_train_predictions,
+                    values,
+                    labeled_positions,
+                    [distinct_results[pos]["code"] for pos in labeled_positions],
+                    unmatched_positions
+                )
+            except ValueError as e:
+                print(f"[Self Train] Skipped: {e}")
+            self_train_rows = 0
+            still_positions = []
+            still_values = []
+            for pos, value in zip(unmatched_positions, unmatched_values):
+                prediction = self_train_predictions.get(pos)
+                if prediction and prediction[1] >= settings.SELF_TRAIN_MIN_CONFIDENCE:
+                    distinct_results[pos] = {
+                        "code": prediction[0],
+                        "confidence": prediction[1],
+                        "method": "self_trained"
+                    }
+                    self_train_rows += int(value_counts[pos])
+                else:
+                    still_positions.append(pos)
+                    still_values.append(value)
+            print(f"[Self Train] Trained on {len(labeled_positions)} values (+{pseudo_labels} pseudo labels), "
+                  f"classified {len(unmatched_positions) - len(still_positions)}/{len(unmatched_positions)} "
+                  f"unmatched values ({self_train_rows} rows)")
+            self_train_stats = {
+                "labels": len(labeled_positions),
+                "pseudo_labels": pseudo_labels,
+                "classified_values": len(unmatched_positions) - len(still_positions),
+                "classified_rows": self_train_rows,
+                "rescued_values": 0,
+                "seconds": round(time.perf_counter() - self_train_started, 3),
             }
+            unmatched_positions, unmatched_values = still_positions, still_values
     
-    # 3. 固定编码关键词匹配
-    for code_info in codes:
-        code = code_info['code']
-        # 检查编码名称
-        if code in text:
-            return {
-                "code": code,
-                "confidence": 0.8,
-                "method": "fixed_code_match"
-            }
-        # 检查关键词
-        if 'keywords' in code_info:
-            for keyword in code_info.get('keywords', []):
-                if keyword and keyword.lower() in text.lower():
-                    return {
-                        "code": code,
-                        "confidence": 0.7,
-                        "method": "keyword_match"
-                    }
+    unmatched_rows = int(value_counts[unmatched_positions].sum()) if unmatched_positions else 0
     
-    # 4. 无匹配，返回错误标记
-    return {
-        "code": "未匹配",
-        "confidence": 0.0,
-        "method": "no_match"
-    }
-
-
-async def _classify_mapping_then_ai(
-    text: str,
-    codes: List[Dict[str, str]],
-    mapping_dict: Dict[str, str]
-) -> Dict[str, Any]:
-    """
-    模式3：映射字典 → 剩余AI编码
-    工作流程：先映射字典匹配，未匹配的交给AI
-    """
-    # 1. 精确匹配映射字典
-    if text in mapping_dict:
-        return {
-            "code": mapping_dict[text],
-            "confidence": 1.0,
-            "method": "exact_mapping"
-        }
+    ai_stats: Dict[str, Any] = {}
+    cascade_stats: Dict[str, Any] = {}
+    local_stats: Dict[str, Any] = {}
+    if cascade is None:
+        cascade = settings.LLM_CASCADE_ENABLED
+    if local_model is None:
+        local_model = settings.LOCAL_MODEL_ENABLED
     
-    # 2. 部分匹配映射字典
-    for key, value in mapping_dict.items():
-        if key in text or text in key:
-            return {
-                "code": value,
-                "confidence": 0.9,
-                "method": "partial_mapping"
-            }
+    hierarchy_stats: Dict[str, Any] = {}
+    hierarchical = is_hierarchical(codes)
     
-    # 3. 未匹配，使用AI分类
-    result = await classify_text_with_codes(text, codes, use_keywords=True)
-    result["method"] = "ai_classification"
-    return result
-
-
-async def _classify_mapping_then_default(
-    text: str,
-    mapping_dict: Dict[str, str],
-    default_code: str
-) -> Dict[str, Any]:
-    """
-    模式4：映射字典 → 剩余归入默认编码
-    工作流程：先映射字典匹配，未匹配的全部归入默认编码
-    """
-    # 1. 精确匹配映射字典
-    if text in mapping_dict:
-        return {
-            "code": mapping_dict[text],
-            "confidence": 1.0,
-            "method": "exact_mapping"
-        }
+    async def classify_with_llm(ai_texts: List[str], ai_codes: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+        """LLM 分类（按配置使用模型级联），多次调用的统计累加到 ai_stats / cascade_stats"""
+        call_stats: Dict[str, Any] = {}
+        if cascade:
+            # 模型级联：便宜模型先分类，没把握的行交给强模型
+            call_cascade_stats: Dict[str, Any] = {}
+            llm_results = await batch_classify_with_cascade(
+                ai_texts,
+                ai_codes,
+                batch_size=batch_size,
+                max_concurrent=max_concurrent,
+                stats=call_stats,
+                cascade_stats=call_cascade_stats
+            )
+            _merge_counts(cascade_stats, call_cascade_stats)
+        else:
+            llm_results = await batch_classify_with_ai_bulk_prompt(
+                ai_texts,
+                ai_codes,
+                batch_size=batch_size,
+                max_concurrent=max_concurrent,
+                stats=call_stats
+            )
+        _merge_counts(ai_stats, call_stats)
+        return llm_results
     
-    # 2. 部分匹配映射字典
-    for key, value in mapping_dict.items():
-        if key in text or text in key:
-            return {
-                "code": value,
-                "confidence": 0.9,
-                "method": "partial_mapping"
-            }
+    async def classify_unmatched(ai_texts: List[str]) -> List[Dict[str, Any]]:
+        """AI 分类未匹配的取值：分层编码表两阶段分类，否则直接用完整编码表"""
+        if not hierarchical:
+            return await classify_with_llm(ai_texts, codes)
+        call_hierarchy_stats: Dict[str, Any] = {}
+        hierarchy_results = await batch_classify_hierarchical(
+            ai_texts, codes, parent_codes, classify_with_llm, call_hierarchy_stats
+        )
+        _merge_counts(hierarchy_stats, call_hierarchy_stats)
+        return hierarchy_results
     
-    # 3. 未匹配，归入默认编码
-    return {
-        "code": default_code,
-        "confidence": 0.5,
-        "method": "default_fallback"
-    }
-
-
-async def _classify_fixed_mapping_then_default(
-    text: str,
-    codes: List[Dict[str, str]],
-    mapping_dict: Dict[str, str],
-    default_code: str
-) -> Dict[str, Any]:
-    """
-    模式5：固定编码+映射 → 剩余归入默认
-    工作流程：映射字典 → 固定编码关键词匹配 → 默认编码
-    """
-    # 1. 精确匹配映射字典
-    if text in mapping_dict:
-        return {
-            "code": mapping_dict[text],
-            "confidence": 1.0,
-            "method": "exact_mapping"
-        }
+    fallback_started = time.perf_counter()
+    if unmatched_values:
+        if use_ai:
+            # 策略：批量 AI 分类（每个不同取值只发送一次）
+            print(f"[Batch AI] Processing {len(unmatched_values)} distinct unmatched values "
+                  f"({unmatched_rows} rows)...")
+            if local_model:
+                # 本地模型：LLM 只标注样本和不确定的行
+                ai_results = await batch_classify_with_local_model(
+                    unmatched_values, codes, classify_unmatched, local_stats
+                )
+            else:
+                ai_results = await classify_unmatched(unmatched_values)
+            for pos, ai_result in zip(unmatched_positions, ai_results):
+                if (ai_result["method"] == "ai_error" and settings.SELF_TRAIN_RESCUE_AI_ERRORS
+                        and pos in self_train_predictions):
+                    # AI 分类失败（如服务不可用）：改用自训练模型的预测，任务仍可完成
+                    code, confidence = self_train_predictions[pos]
+                    ai_result = {"code": code, "confidence": confidence, "method": "self_trained"}
+                    self_train_stats["rescued_values"] += 1
+                distinct_results[pos] = ai_result
+        else:
+            # 策略：全部归入默认编码（fixed_mapping_only 模式标记为未匹配）
+            fallback_result = plan.fallback_result()
+            for pos in unmatched_positions:
+                distinct_results[pos] = dict(fallback_result)
     
-    # 2. 部分匹配映射字典
-    for key, value in mapping_dict.items():
-        if key in text or text in key:
-            return {
-                "code": value,
-                "confidence": 0.9,
-                "method": "partial_mapping"
-            }
+    fallback_seconds = time.perf_counter() - fallback_started
     
-    # 3. 固定编码关键词匹配
-    for code_info in codes:
-        code = code_info['code']
-        # 检查编码名称
-        if code in text:
-            return {
-                "code": code,
-                "confidence": 0.8,
-                "method": "fixed_code_match"
-            }
-        # 检查关键词
-        if 'keywords' in code_info:
-            for keyword in code_info.get('keywords', []):
-                if keyword and keyword.lower() in text.lower():
-                    return {
-                        "code": code,
-                        "confidence": 0.7,
-                        "method": "keyword_match"
-                    }
+    if hierarchical:
+        # 分层编码表：所有结果补充大类（确定性匹配、答案记忆等只给出小类）
+        parents = parent_map(codes)
+        for result in distinct_results:
+            if "parent_code" not in result:
+                result["parent_code"] = parents.get(result["code"])
     
-    # 4. 未匹配，归入默认编码
-    return {
-        "code": default_code,
-        "confidence": 0.5,
-        "method": "default_fallback"
-    }
-
+    # ============ 第三阶段：将结果回填到每一行 ============
+    results = await _run_off_loop(_fan_out_results, distinct_results, row_value, row_ids)
+    
+    if stats is not None:
+        # 规则命中率画像：各规则 / 各阶段命中、落空行数与耗时
+        profile = MatchProfile(plan.matcher)
+        profile.add_column(column_match, value_counts, np.asarray([value != '' for value in values], dtype=bool))
+        profile.set_fallback(plan.fallback, unmatched_rows, len(unmatched_values), fallback_seconds)
+        stats["profile"] = profile.to_dict()
 
-async def _classify_fixed_mapping_then_ai(
-    text: str,
-    codes: List[Dict[str, str]],
-    mapping_dict: Dict[str, str]
-) -> Dict[str, Any]:
-    """
-    模式6：固定编码+映射 → 剩余AI编码
-    工作流程：映射字典 → 固定编码关键词匹配 → AI分类
-    """
-    # 1. 精确匹配映射字典
-    if text in mapping_dict:
-        return {
-            "code": mapping_dict[text],
-            "confidence": 1.0,
-            "method": "exact_mapping"
+        stats["dedup"] = {
+            "total_rows": len(texts),
+            "distinct_values": len(values),
+            "dedup_ratio": round(len(texts) / len(values), 2) if len(values) else 1.0,
+            "ai_rows": unmatched_rows if use_ai else 0,
+            "ai_distinct_values": len(unmatched_values) if use_ai else 0,
+            "memory_rows": memory_rows,
+            "memory_distinct_values": memory_values
         }
+        if ai_stats:
+            stats["ai_retries"] = ai_stats
+        if cascade_stats:
+            stats["ai_cascade"] = cascade_stats
+        if local_stats:
+            stats["ai_local_model"] = local_stats
+        if self_train_stats:
+            stats["self_training"] = self_train_stats
+        if hierarchy_stats:
+            stats["hierarchy"] = hierarchy_stats
     
-    # 2. 部分匹配映射字典
-    for key, value in mapping_dict.items():
-        if key in text or text in key:
-            return {
-                "code": value,
-                "confidence": 0.9,
-                "method": "partial_mapping"
-            }
-    
-    # 3. 固定编码关键词匹配
-    for code_info in codes:
-        code = code_info['code']
-        # 检查编码名称
-        if code in text:
-            return {
-                "code": code,
-                "confidence": 0.8,
-                "method": "fixed_code_match"
-            }
-        # 检查关键词
-        if 'keywords' in code_info:
-            for keyword in code_info.get('keywords', []):
-                if keyword and keyword.lower() in text.lower():
-                    return {
-                        "code": code,
-                        "confidence": 0.7,
-                        "method": "keyword_match"
-                    }
-    
-    # 4. 未匹配，使用AI分类
-    result = await classify_text_with_codes(text, codes, use_keywords=True)
-    result["method"] = "ai_classification"
-    return result
+    return results
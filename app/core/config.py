@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Optional, Dict, List, Any
 
 
 class Settings(BaseSettings):
@@ -23,6 +23,101 @@ class Settings(BaseSettings):
     OPENAI_BASE_URL: Optional[str] = "https://api.token-ai.cn/v1"  # 可选，用于自定义 API 端点（如 Azure、代理）
     OPENAI_DEFAULT_MODEL: str = "gpt-4o-mini"  # 默认模型
     OPENAI_RATE_LIMIT_PER_MINUTE: int = 100  # API 限流：每分钟最大请求数
+    OPENAI_TOKENS_PER_MINUTE: int = 0  # API 限流：每分钟最大 token 数（0 表示不限，直到响应头给出实际上限；retry-after 始终生效）
+    OPENAI_TPM_DEFAULT_COMPLETION_TOKENS: int = 512  # 未指定 max_tokens 时为输出预留的 token 数（响应后按实际用量校正）
+    # 多端点 / 多 Key 池：[{"name", "base_url", "api_key", "model", "weight", "rpm", "tpm", "models"}, ...]
+    # 为空时只使用上面的单个端点；端点中未填写的字段回退到上面的全局配置
+    # models：除默认模型外该端点可使用的模型（不填表示不限制）；指定模型的请求只发往可使用该模型的端点
+    OPENAI_ENDPOINTS: List[Dict[str, Any]] = []
+    
+    # LLM 自适应并发（AIMD）与熔断
+    LLM_CONCURRENCY_INITIAL: int = 4  # 初始并发窗口
+    LLM_CONCURRENCY_MIN: int = 1
+    LLM_CONCURRENCY_MAX: int = 32
+    LLM_CONCURRENCY_LATENCY_TOLERANCE: float = 2.0  # 延迟超过基线的倍数时停止增长窗口
+    LLM_CIRCUIT_FAILURE_THRESHOLD: int = 5  # 连续服务端故障次数达到后熔断（0 表示不熔断）
+    LLM_CIRCUIT_RESET_SECONDS: float = 30.0  # 熔断后多久放行试探请求
+    LLM_CIRCUIT_MAX_PAUSE_SECONDS: float = 600.0  # 批量分类因熔断暂停的最长时间，超过后标记为 ai_error
+    
+    # LLM 对冲请求（降低长尾延迟，会增加少量额外请求）
+    LLM_HEDGE_ENABLED: bool = False
+    LLM_HEDGE_PERCENTILE: float = 95.0  # 主请求超过近期延迟的该分位数时发送对冲请求
+    LLM_HEDGE_MIN_DELAY_SECONDS: float = 2.0  # 对冲触发延迟下限
+    LLM_HEDGE_BUDGET_RATIO: float = 0.05  # 对冲请求数占主请求数的上限
+    LLM_HEDGE_MIN_SAMPLES: int = 20  # 延迟样本不足时不对冲
+    LLM_HEDGE_LATENCY_WINDOW: int = 500  # 延迟分位数统计的滑动窗口大小
+    
+    # LLM Response Cache（本地 SQLite 响应缓存）
+    LLM_CACHE_ENABLED: bool = True  # 是否启用 LLM 响应缓存
+    LLM_CACHE_PATH: str = "./llm_cache.db"  # 缓存文件路径
+    LLM_CACHE_MAX_ENTRIES: int = 100000  # 最大条目数，超出后按 LRU 淘汰
+    LLM_CACHE_TTL_SECONDS: int = 7 * 24 * 3600  # 条目有效期
+    LLM_CACHE_MAX_TEMPERATURE: float = 0.3  # 温度高于该值的请求不缓存（结果不够确定）
+    
+    # LLM Batching（批量分类按 token 预算打包）
+    LLM_BATCH_MAX_INPUT_TOKENS: int = 8000  # 单请求输入 token 预算（提示词 + 文本）
+    LLM_BATCH_MAX_OUTPUT_TOKENS: int = 4000  # 单请求预期输出 token 预算
+    LLM_BATCH_MAX_ROWS: int = 200  # 单请求最多文本条数（避免序号错位）
+    LLM_MODEL_TOKEN_BUDGETS: Dict[str, Dict[str, int]] = {}  # 按模型覆盖预算，如 {"gpt-4o-mini": {"input": 12000, "output": 8000}}
+    LLM_BATCH_MAX_RETRIES: int = 3  # 单条文本请求失败后的最大重试次数（批量请求失败时先二分）
+    LLM_BATCH_RETRY_BASE_DELAY: float = 1.0  # 重试退避基数（秒），按失败次数指数增长
+    LLM_BATCH_RETRY_MAX_DELAY: float = 30.0  # 重试退避上限（秒）
+    # legacy：逐行回显编码名称；compact：返回编码编号数组（输出 token 更少，建议先用
+    # scripts/benchmark_bulk_protocol.py --live 确认所用模型的解析成功率后再切换）
+    LLM_BATCH_RESPONSE_PROTOCOL: str = "legacy"
+    LLM_BATCH_JSON_SCHEMA: bool = False  # compact 协议使用 JSON Schema 结构化输出（需模型 / 网关支持）
+    
+    # 大编码表的候选编码检索（按句向量为每条文本检索候选编码，每个批量请求只带组内候选编码）
+    LLM_CANDIDATE_RETRIEVAL_ENABLED: bool = False
+    LLM_CANDIDATE_MIN_CODES: int = 60  # 编码数达到该值才启用
+    LLM_CANDIDATE_TOP_K: int = 5  # 每条文本的候选编码数（都会出现在该文本所在请求的编码表中）
+    LLM_CANDIDATE_MAX_CODES: int = 40  # 每组编码表的编码数上限（不小于 LLM_CANDIDATE_TOP_K）
+    LLM_CANDIDATE_GROUP_ROWS: int = 200  # 按句向量聚类时每组的目标文本数
+    
+    # LLM 模型级联（便宜模型先分类全部文本，只把低置信度 / 两次采样不一致的行交给强模型）
+    LLM_CASCADE_ENABLED: bool = False
+    LLM_CASCADE_CHEAP_MODEL: Optional[str] = None  # 为空时使用默认模型（主端点的模型）
+    LLM_CASCADE_STRONG_MODEL: str = "gpt-4o"
+    LLM_CASCADE_CONFIDENCE_SOURCE: str = "logprobs"  # logprobs：编码 token 的联合概率；self_report：模型自报 0-100 的把握
+    LLM_CASCADE_CONFIDENCE_THRESHOLD: float = 0.8  # 便宜模型置信度低于该值的行升级到强模型
+    LLM_CASCADE_AGREEMENT_CHECK: bool = True  # 置信度达标的行再用便宜模型采样一次，结果不一致的也升级
+    LLM_CASCADE_SAMPLE_TEMPERATURE: float = 0.7  # 一致性检查第二次采样的温度
+    
+    # 本地分类模型（LLM 标注分层样本 → 句向量 + 轻量分类器 → 本地分类，不确定的行回退到 LLM）
+    LOCAL_MODEL_ENABLED: bool = False
+    LOCAL_MODEL_EMBEDDING_MODEL: str = "BAAI/bge-small-zh-v1.5"
+    LOCAL_MODEL_EMBEDDING_BATCH_SIZE: int = 256
+    LOCAL_MODEL_ALGORITHM: str = "logistic"  # logistic：逻辑回归；knn：k 近邻
+    LOCAL_MODEL_LOGISTIC_C: float = 10.0  # 逻辑回归正则化强度的倒数
+    LOCAL_MODEL_KNN_NEIGHBORS: int = 15
+    LOCAL_MODEL_MIN_ROWS: int = 2000  # 待 AI 分类的不同取值少于该数时直接全部交给 LLM
+    LOCAL_MODEL_SEED_RATIO: float = 0.02  # 初始 LLM 标注样本占比（受下面上下限约束）
+    LOCAL_MODEL_SEED_MIN: int = 300
+    LOCAL_MODEL_SEED_MAX: int = 3000
+    LOCAL_MODEL_STRATA: int = 50  # 分层抽样的聚类数
+    LOCAL_MODEL_MARGIN_THRESHOLD: float = 0.2  # 前两名概率差低于该值的行视为不确定
+    LOCAL_MODEL_ACTIVE_ROUNDS: int = 2  # 不确定性采样轮数（每轮 LLM 标注最不确定的行后重新训练）
+    LOCAL_MODEL_QUERY_SIZE: int = 500  # 每轮交给 LLM 标注的不确定行数
+    
+    # 自训练分类（用同列确定性匹配的结果训练字符 n-gram 分类器，离线分类未匹配的取值）
+    SELF_TRAIN_ENABLED: bool = False
+    SELF_TRAIN_MIN_LABELS: int = 50  # 确定性匹配的不同取值少于该数时不训练
+    SELF_TRAIN_MIN_CONFIDENCE: float = 0.9  # 预测概率达到该值才采用（也是伪标注的门槛）
+    SELF_TRAIN_ROUNDS: int = 2  # 伪标注重新训练的最大轮数（0 表示只用确定性匹配的结果训练一次）
+    SELF_TRAIN_NGRAM_MAX: int = 3  # 字符 n-gram 的最大长度
+    SELF_TRAIN_MAX_FEATURES: int = 200000
+    SELF_TRAIN_RESCUE_AI_ERRORS: bool = True  # AI 分类失败（如服务不可用）的取值改用自训练模型的预测（不论置信度）
+    
+    # Deterministic Matching Configuration
+    DETERMINISTIC_MATCH_WORKERS: int = 0  # 确定性匹配进程池大小，0/1 表示不启用多进程分片
+    DETERMINISTIC_MATCH_SHARD_SIZE: int = 20000  # 每个分片的取值数量
+    DETERMINISTIC_MATCH_OFFLOAD: bool = True  # 是否在事件循环之外（线程中）执行确定性匹配
+    
+    # Answer Memory Configuration（跨任务答案记忆）
+    ANSWER_MEMORY_ENABLED: bool = True  # 是否在 AI 分类前查询历史答案记忆
+    ANSWER_MEMORY_MIN_CONFIDENCE: float = 0.8  # AI 结果写入记忆的最低置信度
+    ANSWER_MEMORY_MAX_CODEBOOKS: int = 5  # 每个作用域保留的编码表版本数，更早版本的记忆被淘汰
+    ANSWER_MEMORY_TTL_DAYS: int = 365  # 超过该天数未被使用（或更新）的记忆被淘汰
 
     class Config:
         case_sensitive = True
@@ -0,0 +1,100 @@
+"""
+按 token 预算打包 LLM 批量请求
+
+批量分类时每个请求 = 固定提示词（编码表 + 说明） + 若干行文本 + 预期输出。
+按估算的 token 数贪心打包：在不超过单请求输入 / 输出预算的前提下尽量多放行，
+单行超出预算时独占一个请求（不再截断原文）。
+
+请求失败时的重试采用指数退避（retry_delay）。
+"""
+import math
+import random
+from typing import List, Dict, Sequence, Tuple
+
+from app.core.config import settings
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算 token 数（不依赖分词器）
+
+    CJK 字符按约 1 token / 字，其余字符按约 4 字符 / token 估算，偏保守。
+    """
+    if not text:
+        return 0
+    cjk = 0
+    for ch in text:
+        if ch >= '⺀':
+            cjk += 1
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def get_token_budget(model: str) -> Tuple[int, int]:
+    """
+    单请求的 (输入, 输出) token 预算
+
+    LLM_MODEL_TOKEN_BUDGETS 中配置了该模型时优先使用，否则使用全局默认值。
+    """
+    budget: Dict[str, int] = settings.LLM_MODEL_TOKEN_BUDGETS.get(model, {})
+    return (
+        budget.get("input", settings.LLM_BATCH_MAX_INPUT_TOKENS),
+        budget.get("output", settings.LLM_BATCH_MAX_OUTPUT_TOKENS),
+    )
+
+
+def pack_batches(
+    row_tokens: Sequence[int],
+    base_tokens: int,
+    row_output_tokens: int,
+    max_input_tokens: int,
+    max_output_tokens: int,
+    max_rows: int
+) -> List[Tuple[int, int]]:
+    """
+    按顺序贪心打包
+
+    Args:
+        row_tokens: 每行文本（含序号前缀）的估算 token 数
+        base_tokens: 每个请求的固定提示词 token 数
+        row_output_tokens: 每行预期的输出 token 数
+        max_input_tokens: 单请求输入预算
+        max_output_tokens: 单请求输出预算
+        max_rows: 单请求最多行数
+
+    Returns:
+        [(start, end), ...] 左闭右开区间，覆盖全部行且保持原顺序
+    """
+    batches: List[Tuple[int, int]] = []
+    start = 0
+    input_tokens = base_tokens
+    output_tokens = 0
+    for i, tokens in enumerate(row_tokens):
+        rows = i - start
+        if rows and (
+            rows >= max_rows
+            or input_tokens + tokens > max_input_tokens
+            or output_tokens + row_output_tokens > max_output_tokens
+        ):
+            batches.append((start, i))
+            start = i
+            input_tokens = base_tokens
+            output_tokens = 0
+        # 单行超出预算时也放入（独占一个请求）
+        input_tokens += tokens
+        output_tokens += row_output_tokens
+    if start < len(row_tokens):
+        batches.append((start, len(row_tokens)))
+    return batches
+
+
+def retry_delay(failures: int) -> float:
+    """
+    第 failures 次连续失败后的退避时间（秒）
+
+    base * 2^(failures-1)，不超过上限，并乘以 [0.5, 1) 的随机抖动，避免并发批次同时重试。
+    """
+    delay = min(
+        settings.LLM_BATCH_RETRY_MAX_DELAY,
+        settings.LLM_BATCH_RETRY_BASE_DELAY * (2 ** max(failures - 1, 0))
+    )
+    return delay * random.uniform(0.5, 1.0)
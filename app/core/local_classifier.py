@@ -0,0 +1,180 @@
+"""
+本地分类模型（用 LLM 标注训练，主动学习）
+
+大规模任务中逐条交给 LLM 分类是主要的成本和耗时。本地模型流程：
+1. 用句向量模型（LOCAL_MODEL_EMBEDDING_MODEL，默认 bge-small-zh）编码所有待 AI 分类的文本；
+2. 按句向量聚类分层抽样，交给 LLM 标注（覆盖各类表述，而不是只取最常见的）；
+3. 用 LLM 标注训练轻量分类器（逻辑回归 / kNN），对其余文本本地分类；
+4. 前两名概率差（margin）低于阈值的文本视为不确定：每轮取最不确定的一批交给 LLM 标注后
+   重新训练（不确定性采样），最后仍不确定的文本全部回退到 LLM。
+
+流程编排见 app.core.coding_extraction.batch_classify_with_local_model。
+
+自训练（self_train）：不需要 LLM 和预训练模型，用同列确定性匹配的结果训练字符 n-gram
+TF-IDF + 逻辑回归，把置信度达标的预测作为伪标注重新训练，完全离线运行。
+"""
+import logging
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.neighbors import KNeighborsClassifier
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+ALGORITHM_LOGISTIC = "logistic"
+ALGORITHM_KNN = "knn"
+
+_embedding_model: Optional[SentenceTransformer] = None
+_embedding_lock = threading.Lock()
+
+
+def get_embedding_model() -> SentenceTransformer:
+    """句向量模型单例（首次使用时加载）"""
+    global _embedding_model
+    with _embedding_lock:
+        if _embedding_model is None:
+            logger.info(f"加载句向量模型: {settings.LOCAL_MODEL_EMBEDDING_MODEL}")
+            _embedding_model = SentenceTransformer(settings.LOCAL_MODEL_EMBEDDING_MODEL)
+    return _embedding_model
+
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """编码文本为单位长度的句向量（余弦相似度即点积）"""
+    return get_embedding_model().encode(
+        texts,
+        batch_size=settings.LOCAL_MODEL_EMBEDDING_BATCH_SIZE,
+        normalize_embeddings=True,
+        show_progress_bar=False,
+        convert_to_numpy=True
+    )
+
+
+def stratified_sample(features, size: int, strata: int, seed: int = 0) -> np.ndarray:
+    """
+    分层抽样：按特征聚类为 strata 层，每层按规模比例抽取（每层至少 1 条）
+
+    Returns:
+        抽中的行序号（升序）
+    """
+    n_rows = features.shape[0]
+    if size >= n_rows:
+        return np.arange(n_rows)
+    rng = np.random.default_rng(seed)
+    n_clusters = max(1, min(strata, size, n_rows))
+    labels = MiniBatchKMeans(n_clusters=n_clusters, random_state=seed, n_init=3).fit_predict(features)
+
+    picked = []
+    for cluster in range(n_clusters):
+        members = np.flatnonzero(labels == cluster)
+        if len(members) == 0:
+            continue
+        quota = max(1, int(round(size * len(members) / n_rows)))
+        picked.append(rng.choice(members, size=min(quota, len(members)), replace=False))
+    picked = np.concatenate(picked)
+    if len(picked) > size:
+        picked = rng.choice(picked, size=size, replace=False)
+    return np.sort(picked)
+
+
+def char_ngram_features(texts: List[str]):
+    """字符 n-gram TF-IDF 特征（稀疏矩阵），对错别字、简写和语序变化有一定容忍度"""
+    vectorizer = TfidfVectorizer(
+        analyzer="char_wb",
+        ngram_range=(1, settings.SELF_TRAIN_NGRAM_MAX),
+        sublinear_tf=True,
+        max_features=settings.SELF_TRAIN_MAX_FEATURES
+    )
+    return vectorizer.fit_transform(texts)
+
+
+class LocalClassifier:
+    """在句向量（或其他特征）上训练的轻量分类器，输出校准后的概率与前两名概率差"""
+
+    def __init__(self, algorithm: str = ALGORITHM_LOGISTIC):
+        self.algorithm = algorithm
+        self.model = None
+        self.classes: List[str] = []
+
+    def fit(self, features, labels: List[str]) -> "LocalClassifier":
+        """
+        训练分类器
+
+        Raises:
+            ValueError: 标注中少于 2 个不同编码（无法训练判别模型）
+        """
+        if len(set(labels)) < 2:
+            raise ValueError("LocalClassifier requires at least two distinct labels")
+        if self.algorithm == ALGORITHM_KNN:
+            self.model = KNeighborsClassifier(
+                n_neighbors=min(settings.LOCAL_MODEL_KNN_NEIGHBORS, len(labels)),
+                weights="distance"
+            )
+        else:
+            self.model = LogisticRegression(C=settings.LOCAL_MODEL_LOGISTIC_C, max_iter=1000)
+        self.model.fit(features, labels)
+        self.classes = [str(c) for c in self.model.classes_]
+        return self
+
+    def predict(self, features) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """
+        预测编码
+
+        Returns:
+            (编码列表, 最高概率, 前两名概率差)
+        """
+        if features.shape[0] == 0:
+            return [], np.zeros(0), np.zeros(0)
+        probabilities = self.model.predict_proba(features)
+        top2 = np.sort(probabilities, axis=1)[:, -2:]
+        best = probabilities.argmax(axis=1)
+        return [self.classes[i] for i in best.tolist()], top2[:, 1], top2[:, 1] - top2[:, 0]
+
+
+def self_train(
+    features,
+    labeled: np.ndarray,
+    labels: List[str],
+    unlabeled: np.ndarray,
+    min_confidence: float,
+    rounds: int
+) -> Tuple[List[str], np.ndarray, int]:
+    """
+    自训练：用已标注行训练，把未标注行中概率达到 min_confidence 的预测作为伪标注，
+    与已标注行一起重新训练，最多 rounds 轮（伪标注不再增加时提前结束）
+
+    Args:
+        features: 所有行的特征矩阵
+        labeled: 已标注行的序号
+        labels: 已标注行的编码
+        unlabeled: 待预测行的序号
+        min_confidence: 伪标注的概率门槛
+        rounds: 伪标注重新训练的最大轮数
+
+    Returns:
+        (待预测行的编码, 预测概率, 最后一轮使用的伪标注数)
+
+    Raises:
+        ValueError: 已标注行中少于 2 个不同编码
+    """
+    classifier = LocalClassifier(ALGORITHM_LOGISTIC)
+    classifier.fit(features[labeled], labels)
+    predicted, confidence, _ = classifier.predict(features[unlabeled])
+    pseudo = 0
+    for _ in range(rounds):
+        confident = np.flatnonzero(confidence >= min_confidence)
+        if len(confident) <= pseudo:
+            break
+        pseudo = len(confident)
+        classifier.fit(
+            features[np.concatenate([labeled, unlabeled[confident]])],
+            list(labels) + [predicted[i] for i in confident.tolist()]
+        )
+        predicted, confidence, _ = classifier.predict(features[unlabeled])
+    return predicted, confidence, pseudo
@@ -0,0 +1,132 @@
+"""
+确定性匹配命中率画像
+
+按任务、按列记录：每条规则（映射键 / 编码名称 / 关键词）的命中次数、
+各匹配阶段的命中与落空（fall-through）数量、各环节耗时，以及最终交给
+兜底策略（AI / 默认编码）的行数。结果存入 Task.statistics["_meta"][列名]["profile"]，
+用于裁剪从不命中的规则、定位 LLM 调用量的来源。
+"""
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from app.core.matching import MATCH_METHODS, ColumnMatch, DeterministicMatcher
+
+# 规则明细最多列出的条数（巨型映射字典时避免统计 JSON 过大）
+MAX_LISTED_RULES = 1000
+
+
+class MatchProfile:
+    """
+    单列匹配画像累加器
+
+    整列匹配通过 add_column 一次性累加（按去重值 + 每个值对应的行数加权），
+    单条匹配（try_deterministic_match）通过 record 逐条累加。
+    """
+
+    def __init__(self, matcher: DeterministicMatcher):
+        self.matcher = matcher
+        self.rule_rows = np.zeros(matcher.n_rules, dtype=np.int64)
+        self.rule_values = np.zeros(matcher.n_rules, dtype=np.int64)
+        self.stage_rows = np.zeros(len(MATCH_METHODS), dtype=np.int64)
+        self.stage_values = np.zeros(len(MATCH_METHODS), dtype=np.int64)
+        self.total_rows = 0
+        self.total_values = 0
+        self.empty_rows = 0
+        self.timings: Dict[str, float] = {}
+        self.fallback: Dict[str, Any] = {"strategy": None, "rows": 0, "values": 0}
+
+    def add_timings(self, timings: Dict[str, float]) -> None:
+        for phase, seconds in timings.items():
+            self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    def add_column(self, column_match: ColumnMatch, value_counts: np.ndarray, active: np.ndarray) -> None:
+        """
+        累加整列匹配结果
+
+        Args:
+            column_match: 去重值上的匹配结果
+            value_counts: 每个去重值对应的行数
+            active: 参与匹配的去重值（非空文本）
+        """
+        value_counts = np.asarray(value_counts, dtype=np.int64)
+        self.total_rows += int(value_counts[active].sum())
+        self.total_values += int(np.count_nonzero(active))
+        self.empty_rows += int(value_counts[~active].sum())
+
+        matched = active & (column_match.method_index >= 0)
+        methods = column_match.method_index[matched].astype(np.int64)
+        rules = column_match.rule_index[matched]
+        weights = value_counts[matched]
+        self.stage_rows += np.bincount(methods, weights=weights, minlength=len(MATCH_METHODS)).astype(np.int64)
+        self.stage_values += np.bincount(methods, minlength=len(MATCH_METHODS))
+        if self.matcher.n_rules:
+            self.rule_rows += np.bincount(rules, weights=weights, minlength=self.matcher.n_rules).astype(np.int64)
+            self.rule_values += np.bincount(rules, minlength=self.matcher.n_rules)
+        self.add_timings(column_match.timings)
+
+    def record(self, hit: Tuple[int, int, int], seconds: float = 0.0) -> None:
+        """累加单条匹配结果 (label 位置, 阶段, 规则序号)"""
+        _, method, rule = hit
+        self.total_rows += 1
+        self.total_values += 1
+        if method >= 0:
+            self.stage_rows[method] += 1
+            self.stage_values[method] += 1
+            self.rule_rows[rule] += 1
+            self.rule_values[rule] += 1
+        self.add_timings({"match": seconds})
+
+    def set_fallback(self, strategy: str, rows: int, values: int, seconds: float = 0.0) -> None:
+        """记录落入兜底策略（ai / default / no_match）的行数与耗时"""
+        self.fallback = {"strategy": strategy, "rows": int(rows), "values": int(values)}
+        self.add_timings({"fallback_" + strategy: seconds})
+
+    def _describe(self, rules: np.ndarray, with_hits: bool) -> List[Dict[str, Any]]:
+        listed = []
+        for rule in rules[:MAX_LISTED_RULES].tolist():
+            item = self.matcher.describe_rule(rule)
+            if with_hits:
+                item["hit_rows"] = int(self.rule_rows[rule])
+                item["hit_values"] = int(self.rule_values[rule])
+            listed.append(item)
+        return listed
+
+    def to_dict(self) -> Dict[str, Any]:
+        """导出为可 JSON 序列化的画像"""
+        stages = []
+        remaining_rows = self.total_rows
+        remaining_values = self.total_values
+        for method, name in enumerate(MATCH_METHODS):
+            input_rows = remaining_rows
+            remaining_rows -= int(self.stage_rows[method])
+            remaining_values -= int(self.stage_values[method])
+            stages.append({
+                "stage": name,
+                "input_rows": input_rows,
+                "hit_rows": int(self.stage_rows[method]),
+                "hit_values": int(self.stage_values[method]),
+                "fall_through_rows": remaining_rows,
+                "fall_through_values": remaining_values
+            })
+
+        used = np.flatnonzero(self.rule_values > 0)
+        used = used[np.argsort(-self.rule_rows[used], kind="stable")]
+        unused = np.flatnonzero(self.rule_values == 0)
+
+        return {
+            "total_rows": self.total_rows,
+            "distinct_values": self.total_values,
+            "empty_rows": self.empty_rows,
+            "stages": stages,
+            "fallback": self.fallback,
+            "timings_ms": {phase: round(seconds * 1000, 2) for phase, seconds in self.timings.items()},
+            "rules": {
+                "total": int(self.matcher.n_rules),
+                "used": int(len(used)),
+                "unused": int(len(unused)),
+                "truncated": bool(len(used) > MAX_LISTED_RULES or len(unused) > MAX_LISTED_RULES)
+            },
+            "rule_hits": self._describe(used, with_hits=True),
+            "unused_rules": self._describe(unused, with_hits=False)
+        }
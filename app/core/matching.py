@@ -0,0 +1,809 @@
+"""
+确定性匹配引擎
+
+将映射字典、固定编码名称和关键词预编译为多模式匹配自动机（Aho-Corasick），
+每列配置只编译一次，之后每条规范化文本只需单次扫描即可得到最高优先级的命中规则。
+"""
+import re
+import json
+import time
+import asyncio
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict, deque
+from typing import List, Dict, Any, Optional, Iterable, Tuple, Sequence
+
+import numpy as np
+import pandas as pd
+
+from app.core.normalization import normalize_text, normalize_many
+
+# 未命中时的 rank（比任何真实 rank 都大，便于直接取 min）
+_NO_MATCH = 1 << 62
+
+# 确定性匹配阶段（按优先级排列）及其置信度
+MATCH_METHODS = ("exact_mapping", "partial_mapping", "fixed_code_match", "keyword_match")
+MATCH_CONFIDENCES = (1.0, 0.9, 0.8, 0.7)
+_EXACT, _PARTIAL, _CODE, _KEYWORD = range(len(MATCH_METHODS))
+# 未命中时阶段接口的返回值：(label 位置, 阶段, 规则序号)
+_MISS = (-1, -1, -1)
+
+
+class AhoCorasick:
+    """
+    多模式字符串匹配自动机
+
+    每个模式携带一个优先级 rank（越小越优先）。构建时沿失配链把 rank
+    取最小值下推到每个节点，因此扫描文本时只需一次遍历即可得到
+    文本中出现的所有模式里 rank 最小的那个。
+    """
+
+    __slots__ = ("_goto", "_fail", "_best")
+
+    def __init__(self, patterns: Iterable[Tuple[str, int]]):
+        goto: List[Dict[str, int]] = [{}]
+        best: List[int] = [_NO_MATCH]
+
+        # 1. 构建 Trie
+        for pattern, rank in patterns:
+            node = 0
+            for ch in pattern:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    best.append(_NO_MATCH)
+                node = nxt
+            if rank < best[node]:
+                best[node] = rank
+
+        # 2. BFS 构建失配指针，同时下推最小 rank
+        fail = [0] * len(goto)
+        queue = deque()
+        for child in goto[0].values():
+            if best[0] < best[child]:
+                best[child] = best[0]
+            queue.append(child)
+
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                f = fail[node]
+                while True:
+                    nxt = goto[f].get(ch)
+                    if nxt is not None:
+                        fail[child] = nxt
+                        break
+                    if f == 0:
+                        break
+                    f = fail[f]
+                if best[fail[child]] < best[child]:
+                    best[child] = best[fail[child]]
+                queue.append(child)
+
+        self._goto = goto
+        self._fail = fail
+        self._best = best
+
+    def scan(self, text: str) -> int:
+        """扫描文本，返回命中模式中最小的 rank；未命中返回 _NO_MATCH"""
+        goto = self._goto
+        fail = self._fail
+        best = self._best
+        node = 0
+        result = best[0]
+        for ch in text:
+            while True:
+                nxt = goto[node].get(ch)
+                if nxt is not None:
+                    node = nxt
+                    break
+                if node == 0:
+                    break
+                node = fail[node]
+            if best[node] < result:
+                result = best[node]
+        return result
+
+
+# 整列扫描：窗口哈希最多覆盖的字符数（更长的模式按前缀哈希预筛，再逐字比对全文）
+_SCAN_HASH_CHARS = 16
+# 整列扫描：每块拼接文本的最大字符数（限制窗口哈希数组的内存）
+_SCAN_CHUNK_CHARS = 1 << 22
+_HASH_BASE = 0x9E3779B97F4A7C15
+_HASH_MASK = (1 << 64) - 1
+# 整列扫描：按哈希低位预筛的位图大小（大多数窗口在这里排除，只有少数进入二分查找）
+_HASH_FILTER_BITS = 20
+
+
+def _concat_ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """拼接 [starts[i], starts[i] + counts[i]) 各区间的整数"""
+    offsets = np.arange(int(counts.sum()), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + offsets
+
+
+class MultiPatternScanner:
+    """
+    多模式全量命中扫描
+
+    单条文本（find_all）：所有模式编译为一个 trie 正则并包在零宽先行断言里，在每个
+    可能的起始位置取最长命中；同一位置上更短的命中必然是它的前缀，构建时预先展开，
+    因此无需重叠匹配即可得到文本中出现的全部模式（空模式忽略）。
+
+    整列（scan_many）：文本以 \\0 分隔拼接为一个码点数组，按长度逐级计算滑动窗口哈希
+    （每级一次向量运算），在排序后的模式哈希中查找，命中后逐字比对码点确认，
+    结果与逐条 find_all 相同。
+    """
+
+    __slots__ = (
+        "_regex", "_prefix_ids", "_vectorized", "_hash_groups", "_hash_chars",
+        "_hash_filter", "_lengths", "_codes", "_id_starts", "_id_counts", "_ids"
+    )
+
+    def __init__(self, patterns: Sequence[str]):
+        pattern_ids: Dict[str, List[int]] = {}
+        for i, pattern in enumerate(patterns):
+            if pattern:
+                pattern_ids.setdefault(pattern, []).append(i)
+
+        # 每个模式 → 所有是它前缀的模式序号（含自身）
+        self._prefix_ids: Dict[str, Tuple[int, ...]] = {
+            pattern: tuple(
+                i
+                for k in range(1, len(pattern) + 1)
+                for i in pattern_ids.get(pattern[:k], ())
+            )
+            for pattern in pattern_ids
+        }
+
+        # 先用首字符集合做 O(1) 的位置预筛，再在先行断言里取最长命中
+        alternation = compile_alternation(pattern_ids)
+        self._regex = None
+        if alternation is not None:
+            first_chars = "".join(sorted({re.escape(pattern[0]) for pattern in pattern_ids}))
+            self._regex = re.compile("(?=[" + first_chars + "])(?=(" + alternation.pattern + "))")
+
+        # 整列扫描的索引（按去重后的模式编号）；含 \0 的模式会跨越拼接分隔符，改为逐条扫描
+        distinct = list(pattern_ids)
+        self._vectorized = bool(distinct) and all("\0" not in pattern for pattern in distinct)
+        self._lengths = np.array([len(pattern) for pattern in distinct], dtype=np.int64)
+        self._hash_chars = int(min(self._lengths.max(), _SCAN_HASH_CHARS)) if distinct else 0
+        self._codes = np.zeros((len(distinct), int(self._lengths.max()) if distinct else 0), dtype=np.uint32)
+        hashes: Dict[int, List[Tuple[int, int]]] = {}
+        for j, pattern in enumerate(distinct):
+            self._codes[j, :len(pattern)] = [ord(ch) for ch in pattern]
+            key = 0
+            for ch in pattern[:_SCAN_HASH_CHARS]:
+                key = (key * _HASH_BASE + ord(ch)) & _HASH_MASK
+            hashes.setdefault(min(len(pattern), _SCAN_HASH_CHARS), []).append((key, j))
+        # {窗口长度: (排序后的模式前缀哈希, 对应的去重模式编号)}
+        self._hash_groups: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        self._hash_filter = np.zeros(1 << _HASH_FILTER_BITS, dtype=bool)
+        for entries in hashes.values():
+            self._hash_filter[[key & ((1 << _HASH_FILTER_BITS) - 1) for key, _ in entries]] = True
+        for length, entries in hashes.items():
+            entries.sort()
+            self._hash_groups[length] = (
+                np.array([key for key, _ in entries], dtype=np.uint64),
+                np.array([j for _, j in entries], dtype=np.int64)
+            )
+        # 去重模式编号 → 原始模式序号（同一模式出现多次时对应多个序号）
+        self._id_counts = np.array([len(pattern_ids[pattern]) for pattern in distinct], dtype=np.int64)
+        self._id_starts = np.cumsum(self._id_counts) - self._id_counts
+        self._ids = np.array([i for pattern in distinct for i in pattern_ids[pattern]], dtype=np.int64)
+
+    def find_all(self, text: str) -> set:
+        """扫描单条文本，返回出现过的模式序号集合"""
+        hits = set()
+        if self._regex is not None:
+            prefix_ids = self._prefix_ids
+            for longest in set(self._regex.findall(text)):
+                hits.update(prefix_ids[longest])
+        return hits
+
+    def scan_many(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        整列扫描
+
+        Returns:
+            (文本序号, 模式序号) 两个等长数组，每个 (文本, 模式) 命中对只出现一次
+        """
+        if self._regex is None or not len(texts):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        if not self._vectorized:
+            return self._scan_each(texts)
+
+        texts = list(texts)
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        ends = np.cumsum(lengths + 1)
+        rows_parts, distinct_parts = [], []
+        first = 0
+        while first < len(texts):
+            offset = int(ends[first - 1]) if first else 0
+            last = max(int(np.searchsorted(ends, offset + _SCAN_CHUNK_CHARS, side="right")), first + 1)
+            rows, distinct = self._scan_chunk(texts[first:last], lengths[first:last])
+            rows_parts.append(rows + first)
+            distinct_parts.append(distinct)
+            first = last
+        rows = np.concatenate(rows_parts)
+        distinct = np.concatenate(distinct_parts)
+
+        counts = self._id_counts[distinct]
+        return np.repeat(rows, counts), self._ids[_concat_ranges(self._id_starts[distinct], counts)]
+
+    def _scan_chunk(self, texts: List[str], lengths: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """扫描一块文本，返回去重的 (块内文本序号, 去重模式编号)"""
+        codes = np.frombuffer("\0".join(texts).encode("utf-32-le"), dtype=np.uint32)
+        starts = np.cumsum(lengths + 1) - lengths - 1
+        size = len(codes)
+        base = np.uint64(_HASH_BASE)
+        filter_mask = np.uint64((1 << _HASH_FILTER_BITS) - 1)
+
+        positions, candidates = [], []
+        window = np.zeros(size, dtype=np.uint64)
+        for length in range(1, min(self._hash_chars, size) + 1):
+            # window[i]：从 i 开始、长度为 length 的子串哈希（与构建时的模式哈希同一递推）
+            window = window[:size - length + 1] * base + codes[length - 1:]
+            group = self._hash_groups.get(length)
+            if group is None:
+                continue
+            keys, key_ids = group
+            pos = np.flatnonzero(self._hash_filter[window & filter_mask])
+            hashed = window[pos]
+            low = np.searchsorted(keys, hashed)
+            found = keys[np.minimum(low, len(keys) - 1)] == hashed
+            pos, hashed, low = pos[found], hashed[found], low[found]
+            if not len(pos):
+                continue
+            counts = np.searchsorted(keys, hashed, side="right") - low
+            positions.append(np.repeat(pos, counts))
+            candidates.append(key_ids[_concat_ranges(low, counts)])
+        if not positions:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        positions = np.concatenate(positions)
+        candidates = np.concatenate(candidates)
+
+        # 哈希可能碰撞，且长模式只哈希了前缀：逐字比对确认
+        confirmed = np.zeros(len(positions), dtype=bool)
+        candidate_lengths = self._lengths[candidates]
+        for length in np.unique(candidate_lengths).tolist():
+            sel = np.flatnonzero((candidate_lengths == length) & (positions + length <= size))
+            if len(sel):
+                windows = codes[positions[sel, None] + np.arange(length)]
+                confirmed[sel] = (windows == self._codes[candidates[sel], :length]).all(axis=1)
+
+        rows = np.searchsorted(starts, positions[confirmed], side="right") - 1
+        pairs = np.unique(rows * len(self._lengths) + candidates[confirmed])
+        return pairs // len(self._lengths), pairs % len(self._lengths)
+
+    def _scan_each(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """逐条 find_all 扫描"""
+        rows: List[int] = []
+        pattern_ids: List[int] = []
+        for row, text in enumerate(texts):
+            ids = self.find_all(text)
+            if ids:
+                rows.extend([row] * len(ids))
+                pattern_ids.extend(ids)
+        return np.asarray(rows, dtype=np.int64), np.asarray(pattern_ids, dtype=np.int64)
+
+
+class ContainmentIndex:
+    """
+    反向包含索引（广义后缀自动机）
+
+    对一组键构建广义后缀自动机，每个状态记录包含该子串的最小键序号。
+    查询“text 是哪些键的子串”时只需沿转移走 len(text) 步，
+    与键的数量无关，并保持按键顺序取第一个命中的语义。
+    """
+
+    __slots__ = ("_next", "_link", "_len", "_first")
+
+    def __init__(self, keys: Iterable[str]):
+        self._next: List[Dict[str, int]] = [{}]
+        self._link: List[int] = [-1]
+        self._len: List[int] = [0]
+        first: List[int] = [_NO_MATCH]
+        self._first = first
+
+        has_keys = False
+        for i, key in enumerate(keys):
+            has_keys = True
+            last = 0
+            for ch in key:
+                last = self._extend(last, ch)
+                if i < first[last]:
+                    first[last] = i
+        # 空串是任何键的子串
+        if has_keys:
+            first[0] = 0
+
+        # 沿后缀链接自底向上传播最小键序号
+        order = sorted(range(1, len(self._len)), key=self._len.__getitem__, reverse=True)
+        link = self._link
+        for state in order:
+            parent = link[state]
+            if first[state] < first[parent]:
+                first[parent] = first[state]
+
+    def _new_state(self, length: int, link: int, transitions: Dict[str, int]) -> int:
+        self._next.append(transitions)
+        self._link.append(link)
+        self._len.append(length)
+        self._first.append(_NO_MATCH)
+        return len(self._len) - 1
+
+    def _clone(self, p: int, q: int, ch: str) -> int:
+        clone = self._new_state(self._len[p] + 1, self._link[q], dict(self._next[q]))
+        while p != -1 and self._next[p].get(ch) == q:
+            self._next[p][ch] = clone
+            p = self._link[p]
+        self._link[q] = clone
+        return clone
+
+    def _extend(self, last: int, ch: str) -> int:
+        nxt = self._next
+        length = self._len
+
+        # 转移已存在（其他键共享该前缀）
+        q = nxt[last].get(ch)
+        if q is not None:
+            if length[last] + 1 == length[q]:
+                return q
+            return self._clone(last, q, ch)
+
+        cur = self._new_state(length[last] + 1, 0, {})
+        p = last
+        while p != -1 and ch not in nxt[p]:
+            nxt[p][ch] = cur
+            p = self._link[p]
+        if p != -1:
+            q = nxt[p][ch]
+            if length[p] + 1 == length[q]:
+                self._link[cur] = q
+            else:
+                self._link[cur] = self._clone(p, q, ch)
+        return cur
+
+    def first_containing(self, text: str) -> int:
+        """返回第一个包含 text 的键序号；不存在返回 _NO_MATCH"""
+        nxt = self._next
+        state = 0
+        for ch in text:
+            state = nxt[state].get(ch)
+            if state is None:
+                return _NO_MATCH
+        return self._first[state]
+
+
+def compile_alternation(patterns: Iterable[str]) -> Optional["re.Pattern"]:
+    """
+    将一组字面量编译为按前缀合并的交替正则（trie regex）
+
+    用于 pandas 的 str.contains 向量化预筛：公共前缀只匹配一次，
+    避免朴素 a|b|c 交替在每个位置逐一尝试所有模式。
+    没有模式时返回 None；含空模式时正则可匹配任意文本。
+    """
+    trie: Dict[str, Any] = {}
+    has_pattern = False
+    for pattern in patterns:
+        has_pattern = True
+        node = trie
+        for ch in pattern:
+            node = node.setdefault(ch, {})
+        node[""] = True
+    if not has_pattern:
+        return None
+
+    def render(node: Dict[str, Any]) -> str:
+        branches = [re.escape(ch) + render(child) for ch, child in node.items() if ch != ""]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            return "(?:" + body + ")?"
+        return body
+
+    return re.compile(render(trie))
+
+
+class ColumnMatch:
+    """
+    整列（向量化）确定性匹配结果
+
+    - code_index: 命中编码在 labels 中的位置，-1 表示未匹配
+    - method_index: 命中阶段在 MATCH_METHODS 中的位置，-1 表示未匹配
+    - rule_index: 命中规则的序号（见 DeterministicMatcher.describe_rule），-1 表示未匹配
+    - confidence: 置信度，未匹配为 NaN
+    - timings: 各匹配环节耗时（秒），用于命中率画像
+    """
+
+    def __init__(
+        self,
+        labels: List[str],
+        code_index: np.ndarray,
+        method_index: np.ndarray,
+        rule_index: Optional[np.ndarray] = None,
+        timings: Optional[Dict[str, float]] = None
+    ):
+        self.labels = labels
+        self.code_index = code_index
+        self.method_index = method_index
+        self.rule_index = rule_index if rule_index is not None else np.full(len(code_index), -1, dtype=np.int64)
+        self.timings = timings or {}
+        self.confidence = np.where(
+            method_index >= 0,
+            np.asarray(MATCH_CONFIDENCES)[np.maximum(method_index, 0)],
+            np.nan
+        )
+
+    def __len__(self) -> int:
+        return len(self.code_index)
+
+    @property
+    def matched(self) -> np.ndarray:
+        return self.method_index >= 0
+
+    def result(self, i: int) -> Optional[Dict[str, Any]]:
+        """第 i 个值的匹配结果（与 DeterministicMatcher.match 的返回格式一致）"""
+        method = int(self.method_index[i])
+        if method < 0:
+            return None
+        return {
+            "code": self.labels[int(self.code_index[i])],
+            "confidence": MATCH_CONFIDENCES[method],
+            "method": MATCH_METHODS[method]
+        }
+
+
+class DeterministicMatcher:
+    """
+    编译后的确定性匹配器
+
+    匹配优先级与 try_deterministic_match 保持一致：
+    1. 映射字典精确匹配
+    2. 映射字典部分匹配（包含关系，按字典顺序取第一个命中的键）
+    3. 固定编码名称匹配（按编码顺序）
+    4. 固定编码关键词匹配（按编码顺序）
+
+    文本和所有模式都先经过 normalize_text 规范化（全角/半角、大小写、
+    空白和标点差异不影响匹配）。映射键、编码名称和关键词按上述优先级
+    分配 rank 后编译进同一个自动机，每条文本只扫描一次；部分匹配中
+    “text in key”的一半由映射键上的反向包含索引完成。规范化后为空的
+    模式不参与匹配。
+
+    结果中的编码统一用 labels（映射值 + 编码名称）中的位置表示，
+    单条匹配（match）与整列向量化匹配（match_many）共用同一套规则。
+    每次命中同时给出规则序号：[0, n_keys) 映射键，[n_keys, n_keys + n_codes)
+    编码名称，之后为各关键词（与自动机的 rank 一致）。
+    """
+
+    def __init__(self, codes: List[Dict[str, Any]], mapping_dict: Dict[str, str]):
+        self.codes = list(codes or [])
+        self.mapping_dict = dict(mapping_dict or {})
+
+        self._raw_keys = list(self.mapping_dict.keys())
+        self._keys = normalize_many(self._raw_keys)
+        self._values = list(self.mapping_dict.values())
+        self._n_keys = len(self._keys)
+        self._code_names = [c['code'] for c in self.codes]
+        self._n_codes = len(self._code_names)
+        # 映射键 i 的编码为 labels[i]，编码 j 的名称为 labels[n_keys + j]
+        self.labels = self._values + self._code_names
+
+        # 规范化后相同的映射键，精确匹配取字典中靠前的那个
+        self._key_positions: Dict[str, int] = {}
+        for i, key in enumerate(self._keys):
+            if key:
+                self._key_positions.setdefault(key, i)
+
+        # rank 区间：[0, n_keys) 映射键，[n_keys, n_keys + n_codes) 编码名称，之后为关键词
+        self._code_name_patterns = [
+            (normalize_text(name), j) for j, name in enumerate(self._code_names)
+        ]
+        self._raw_keywords = [
+            (keyword, j)
+            for j, code_info in enumerate(self.codes)
+            for keyword in code_info.get('keywords') or []
+            if keyword
+        ]
+        self._keyword_patterns = [(normalize_text(keyword), j) for keyword, j in self._raw_keywords]
+        self._keyword_base = self._n_keys + self._n_codes
+        self.n_rules = self._keyword_base + len(self._keyword_patterns)
+        # 关键词按编码顺序逐个分配 rank：编码优先级不变，同一编码内取列表中靠前的关键词
+        patterns = [(key, i) for i, key in enumerate(self._keys)]
+        patterns += [(name, self._n_keys + j) for name, j in self._code_name_patterns]
+        patterns += [
+            (keyword, self._keyword_base + k) for k, (keyword, _) in enumerate(self._keyword_patterns)
+        ]
+        patterns = [(pattern, rank) for pattern, rank in patterns if pattern]
+
+        self._automaton = AhoCorasick(patterns)
+        self._containment_index = ContainmentIndex(self._keys)
+        # 向量化路径使用的正则预筛
+        self._pattern_regex = compile_alternation(pattern for pattern, _ in patterns)
+        # 旧模式使用的“逐个编码检查名称与关键词”自动机，按需构建
+        self._interleaved_automaton: Optional[AhoCorasick] = None
+        self._interleaved_rules: List[int] = []
+
+    def _result(self, label_index: int, method: int) -> Dict[str, Any]:
+        return {
+            "code": self.labels[label_index],
+            "confidence": MATCH_CONFIDENCES[method],
+            "method": MATCH_METHODS[method]
+        }
+
+    def _rule_hit(self, rule: int) -> Tuple[int, int, int]:
+        """编码名称 / 关键词规则 → (label 位置, 阶段, 规则序号)"""
+        if rule < self._keyword_base:
+            return rule, _CODE, rule
+        return self._n_keys + self._keyword_patterns[rule - self._keyword_base][1], _KEYWORD, rule
+
+    def describe_rule(self, rule: int) -> Dict[str, Any]:
+        """规则序号 → 可读描述（原始键 / 编码名称 / 关键词及其目标编码）"""
+        if rule < self._n_keys:
+            return {"type": "mapping", "rule": self._raw_keys[rule], "code": self._values[rule]}
+        if rule < self._keyword_base:
+            return {"type": "code_name", "rule": self._code_names[rule - self._n_keys],
+                    "code": self._code_names[rule - self._n_keys]}
+        keyword, j = self._raw_keywords[rule - self._keyword_base]
+        return {"type": "keyword", "rule": keyword, "code": self._code_names[j]}
+
+    def _first_key_rank(self, text: str, rank: int) -> int:
+        """部分匹配：正向（key in text）与反向（text in key）中最靠前的键"""
+        forward = rank if rank < self._n_keys else _NO_MATCH
+        if not self._n_keys:
+            return forward
+        return min(forward, self._containment_index.first_containing(text))
+
+    def _resolve(self, text: str, rank: int) -> Tuple[int, int, int]:
+        """
+        根据规范化文本和自动机扫描结果确定命中，返回 (label 位置, 阶段, 规则序号)；
+        未命中返回 (-1, -1, -1)
+        """
+        key_rank = self._key_positions.get(text)
+        if key_rank is not None:
+            return key_rank, _EXACT, key_rank
+        key_rank = self._first_key_rank(text, rank)
+        if key_rank < self._n_keys:
+            return key_rank, _PARTIAL, key_rank
+        if rank != _NO_MATCH:
+            return self._rule_hit(rank)
+        return _MISS
+
+    # ---------- 阶段接口：输入为规范化文本，返回 (label 位置, 阶段, 规则序号)，未命中为 (-1, -1, -1) ----------
+
+    def resolve(self, text: str) -> Tuple[int, int, int]:
+        """完整的四级匹配"""
+        if not text:
+            return _MISS
+        return self._resolve(text, self._automaton.scan(text))
+
+    def resolve_mapping(self, text: str) -> Tuple[int, int, int]:
+        """仅映射字典匹配（精确 + 部分）"""
+        if not text:
+            return _MISS
+        key_rank = self._key_positions.get(text)
+        if key_rank is not None:
+            return key_rank, _EXACT, key_rank
+        key_rank = self._first_key_rank(text, self._automaton.scan(text))
+        if key_rank < self._n_keys:
+            return key_rank, _PARTIAL, key_rank
+        return _MISS
+
+    def resolve_code_or_keyword(self, text: str) -> Tuple[int, int, int]:
+        """旧模式的编码匹配：按编码顺序逐个检查，同一编码先查名称再查关键词"""
+        if not text:
+            return _MISS
+        if self._interleaved_automaton is None:
+            # 逐个编码依次排列：名称在前，关键词按列表顺序在后
+            keywords_by_code: Dict[int, List[int]] = {}
+            for k, (_, j) in enumerate(self._keyword_patterns):
+                keywords_by_code.setdefault(j, []).append(k)
+            rules: List[int] = []
+            patterns: List[Tuple[str, int]] = []
+            for name, j in self._code_name_patterns:
+                for pattern, rule in [(name, self._n_keys + j)] + [
+                    (self._keyword_patterns[k][0], self._keyword_base + k)
+                    for k in keywords_by_code.get(j, [])
+                ]:
+                    if pattern:
+                        patterns.append((pattern, len(rules)))
+                        rules.append(rule)
+            self._interleaved_rules = rules
+            self._interleaved_automaton = AhoCorasick(patterns)
+        rank = self._interleaved_automaton.scan(text)
+        if rank == _NO_MATCH:
+            return _MISS
+        return self._rule_hit(self._interleaved_rules[rank])
+
+    def result(self, label_index: int, method: int, rule_index: int = -1) -> Optional[Dict[str, Any]]:
+        """将 (label 位置, 阶段) 转换为结果字典，未命中返回 None"""
+        if method < 0:
+            return None
+        return self._result(label_index, method)
+
+    # ---------- 单条文本接口（自动规范化） ----------
+
+    def match_mapping(self, text: str) -> Optional[Dict[str, Any]]:
+        """仅执行映射字典匹配（精确 + 部分）"""
+        return self.result(*self.resolve_mapping(normalize_text(text)))
+
+    def match_code_or_keyword(self, text: str) -> Optional[Dict[str, Any]]:
+        """按编码顺序逐个检查名称与关键词"""
+        return self.result(*self.resolve_code_or_keyword(normalize_text(text)))
+
+    def match(self, text: str) -> Optional[Dict[str, Any]]:
+        """对单条文本执行确定性匹配，返回 None 表示未匹配成功"""
+        return self.result(*self.resolve(normalize_text(text)))
+
+    def match_many(self, values: Sequence[str]) -> ColumnMatch:
+        """
+        整列向量化匹配
+
+        精确匹配通过 Series.map 做哈希连接；包含类匹配先用交替正则
+        str.contains 向量化预筛，只有命中预筛的值才交给自动机确定优先级。
+        调用方应先对整列去重，这里的 Python 循环只作用于候选值。
+        """
+        timings: Dict[str, float] = {}
+        started = time.perf_counter()
+        series = pd.Series(normalize_many(values), dtype=object)
+        n = len(series)
+        code_index = np.full(n, -1, dtype=np.int64)
+        method_index = np.full(n, -1, dtype=np.int8)
+        rule_index = np.full(n, -1, dtype=np.int64)
+        timings["normalize"] = time.perf_counter() - started
+        if n == 0:
+            return ColumnMatch(self.labels, code_index, method_index, rule_index, timings)
+
+        # 1. 映射字典精确匹配：哈希连接
+        started = time.perf_counter()
+        exact = series.map(self._key_positions).to_numpy(dtype=float)
+        hit = ~np.isnan(exact)
+        code_index[hit] = exact[hit].astype(np.int64)
+        method_index[hit] = _EXACT
+        rule_index[hit] = code_index[hit]
+        timings["exact_mapping"] = time.perf_counter() - started
+
+        # 2-4. 部分匹配 / 编码名称 / 关键词：正则预筛 + 自动机定序
+        pending = np.flatnonzero(~hit & (series != "").to_numpy())
+        if pending.size:
+            started = time.perf_counter()
+            pending_values = series.iloc[pending]
+            if self._pattern_regex is None:
+                candidates = np.zeros(len(pending_values), dtype=bool)
+            else:
+                candidates = pending_values.str.contains(
+                    self._pattern_regex, regex=True
+                ).to_numpy(dtype=bool)
+            timings["prefilter"] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            check_reverse = self._n_keys > 0
+            for pos, text, is_candidate in zip(pending, pending_values, candidates):
+                if not is_candidate and not check_reverse:
+                    continue
+                rank = self._automaton.scan(text) if is_candidate else _NO_MATCH
+                label_index, method, rule = self._resolve(text, rank)
+                if method >= 0:
+                    code_index[pos] = label_index
+                    method_index[pos] = method
+                    rule_index[pos] = rule
+            timings["scan"] = time.perf_counter() - started
+
+        return ColumnMatch(self.labels, code_index, method_index, rule_index, timings)
+
+
+def matcher_config_hash(codes: List[Dict[str, Any]], mapping_dict: Dict[str, str]) -> str:
+    """计算匹配配置的哈希（保留顺序，顺序决定匹配优先级）"""
+    payload = json.dumps(
+        [codes or [], list((mapping_dict or {}).items())],
+        ensure_ascii=False,
+        default=str
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+_MATCHER_CACHE: "OrderedDict[str, DeterministicMatcher]" = OrderedDict()
+_MATCHER_CACHE_SIZE = 32
+
+
+def get_deterministic_matcher(
+    codes: List[Dict[str, Any]],
+    mapping_dict: Dict[str, str]
+) -> DeterministicMatcher:
+    """获取（或编译并缓存）指定配置的确定性匹配器"""
+    key = matcher_config_hash(codes, mapping_dict)
+    matcher = _MATCHER_CACHE.get(key)
+    if matcher is not None:
+        _MATCHER_CACHE.move_to_end(key)
+        return matcher
+
+    matcher = DeterministicMatcher(codes, mapping_dict)
+    _MATCHER_CACHE[key] = matcher
+    if len(_MATCHER_CACHE) > _MATCHER_CACHE_SIZE:
+        _MATCHER_CACHE.popitem(last=False)
+    return matcher
+
+
+# ============================================================
+# 离线执行：线程卸载 / 多进程分片
+# ============================================================
+
+# 工作进程内的匹配器（由进程池 initializer 设置，每个进程只反序列化一次）
+_worker_matcher = None
+
+# 常驻进程池：进程数 → (匹配器, 进程池)；同一匹配器的多次调用复用进程，匹配器变化时才重建
+_match_pools: Dict[int, Tuple[Any, ProcessPoolExecutor]] = {}
+
+
+def _init_match_worker(matcher) -> None:
+    global _worker_matcher
+    _worker_matcher = matcher
+
+
+def _match_shard(values: List[str]) -> ColumnMatch:
+    return _worker_matcher.match_many(values)
+
+
+def _get_match_pool(matcher, workers: int) -> ProcessPoolExecutor:
+    """
+    获取载入了 matcher 的常驻进程池
+
+    不含 await：取到进程池后立即提交分片，不会被其他调用在中途替换；
+    替换下来的旧进程池在后台线程中关闭（已提交的分片先完成），不在事件循环中等待进程退出。
+    """
+    entry = _match_pools.get(workers)
+    if entry is not None and entry[0] is matcher:
+        return entry[1]
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_match_worker, initargs=(matcher,))
+    _match_pools[workers] = (matcher, pool)
+    if entry is not None:
+        asyncio.get_running_loop().run_in_executor(None, entry[1].shutdown)
+    return pool
+
+
+async def match_many_async(
+    matcher,
+    values: List[str],
+    workers: int = 0,
+    shard_size: int = 20000,
+    offload: bool = True
+) -> ColumnMatch:
+    """
+    在事件循环之外执行整列匹配
+
+    Args:
+        matcher: 提供 match_many 与 labels 的已编译对象（DeterministicMatcher 或分类计划）
+        values: 待匹配的取值（通常已去重）
+        workers: 进程池大小；大于 1 且取值数量超过 shard_size 时按区间分片并行
+                 （进程池常驻复用，匹配器变化时重建）
+        shard_size: 每个分片的取值数量
+        offload: 不使用进程池时是否放到线程中执行（避免阻塞事件循环）
+
+    Returns:
+        与 matcher.match_many(values) 相同的结果，分片结果按原顺序合并
+    """
+    if workers > 1 and len(values) > shard_size:
+        loop = asyncio.get_running_loop()
+        shards = [values[i:i + shard_size] for i in range(0, len(values), shard_size)]
+        pool = _get_match_pool(matcher, workers)
+        parts = await asyncio.gather(*[
+            loop.run_in_executor(pool, _match_shard, shard) for shard in shards
+        ])
+        timings: Dict[str, float] = {}
+        for part in parts:
+            for phase, seconds in part.timings.items():
+                timings[phase] = timings.get(phase, 0.0) + seconds
+        return ColumnMatch(
+            matcher.labels,
+            np.concatenate([part.code_index for part in parts]),
+            np.concatenate([part.method_index for part in parts]),
+            np.concatenate([part.rule_index for part in parts]),
+            timings
+        )
+
+    if offload:
+        return await asyncio.to_thread(matcher.match_many, values)
+    return matcher.match_many(values)
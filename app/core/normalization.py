@@ -0,0 +1,44 @@
+"""
+文本规范化
+
+所有确定性匹配、去重键和防作弊比对共用的规范形式：
+NFKC 全角/半角折叠 → casefold → 去除空白、标点和控制字符。
+规范化结果按取值缓存，同一个取值在整个进程内只计算一次。
+"""
+import unicodedata
+from functools import lru_cache
+from typing import Iterable, List
+
+# 需要去除的 Unicode 类别前缀：P 标点、Z 分隔符（空白）、C 控制/格式字符
+_STRIP_CATEGORY_PREFIXES = frozenset("PZC")
+
+
+class _StripTable(dict):
+    """str.translate 用的惰性字符表：首次遇到某字符时查询类别并缓存（None 表示删除）"""
+
+    def __missing__(self, codepoint: int):
+        keep = unicodedata.category(chr(codepoint))[0] not in _STRIP_CATEGORY_PREFIXES
+        value = codepoint if keep else None
+        self[codepoint] = value
+        return value
+
+
+_STRIP_TABLE = _StripTable()
+
+
+@lru_cache(maxsize=262144)
+def normalize_text(text: str) -> str:
+    """
+    返回文本的规范形式
+
+    例如 "  很好！ " / "很好!" / "很　好" 都规范化为 "很好"，
+    "ＯＫ" / "ok" / "Ok." 都规范化为 "ok"。
+    """
+    if not text:
+        return ""
+    return unicodedata.normalize("NFKC", text).casefold().translate(_STRIP_TABLE)
+
+
+def normalize_many(texts: Iterable[str]) -> List[str]:
+    """批量规范化（逐值走缓存，调用方应尽量先去重）"""
+    return [normalize_text(text) for text in texts]
@@ -0,0 +1,64 @@
+"""
+分类提示词模板
+
+提示词分为两段：
+- 静态前缀（system 消息）：任务说明 + 编码表 + 输出格式，同一编码表下逐字节相同；
+- 可变部分（user 消息）：待分类文本，始终放在最后。
+
+服务商的前缀缓存（prompt caching）和本地缓存都要求请求开头完全一致，
+因此任何与行相关的内容（文本、条数）都不能出现在前缀中。
+前缀哈希（prefix_hash）写入统计和 AIGCService 指标，用于确认前缀是否稳定复用。
+"""
+import hashlib
+from typing import List, Dict
+
+
+def render_codebook(codes: List[Dict[str, str]], numbered: bool = False) -> str:
+    """
+    确定性渲染编码表：保持编码顺序（compact 协议按顺序编号），
+    描述缺失时使用编码名称，去掉首尾空白避免同一编码表渲染结果不同
+    """
+    lines = []
+    for i, c in enumerate(codes):
+        code = str(c['code']).strip()
+        description = str(c.get('description') or code).strip()
+        prefix = f"{i+1}. " if numbered else "- "
+        lines.append(f"{prefix}{code}: {description}")
+    return "\n".join(lines)
+
+
+def prefix_hash(prefix: str) -> str:
+    """前缀哈希（前 16 位十六进制）"""
+    return hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16]
+
+
+def numbered_texts(texts: List[str]) -> str:
+    return "\n".join(f"{i+1}. {t}" for i, t in enumerate(texts))
+
+
+class PromptTemplate:
+    """静态前缀 + 可变文本的提示词模板"""
+
+    def __init__(self, instructions: str, codebook_title: str, codebook_text: str, output_format: str):
+        self.prefix = f"{instructions}\n\n{codebook_title}\n{codebook_text}\n\n{output_format}"
+        self.prefix_hash = prefix_hash(self.prefix)
+
+    def messages(self, variable: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": self.prefix},
+            {"role": "user", "content": variable}
+        ]
+
+
+def single_text_template(codes: List[Dict[str, str]]) -> PromptTemplate:
+    """单条文本分类（classify_text_with_codes）"""
+    return PromptTemplate(
+        instructions="你是文本分类专家。请将用户给出的文本分类到最合适的类别中。",
+        codebook_title="类别：",
+        codebook_text=render_codebook(codes),
+        output_format="只输出类别名称，不要其他内容。"
+    )
+
+
+def single_text_input(text: str) -> str:
+    return f"文本：\"{text}\""
@@ -3,3 +3,4 @@ from .result import AnalysisResult
 from .code_library import CodeLibrary
 from .project import Project
 from .test_result import TestResult
+from .answer_memory import AnswerMemory
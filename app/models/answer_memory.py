@@ -0,0 +1,28 @@
+from sqlalchemy import Column, Integer, String, Float, DateTime, UniqueConstraint
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+class AnswerMemory(Base):
+    """
+    跨任务答案记忆：(作用域, 编码表哈希, 规范化文本) → 编码
+
+    作用域通常为项目（project:<id>），编码表变化后哈希不同，旧记忆自然失效，
+    并由 answer_memory_service 按代数 / 过期时间淘汰。
+    """
+    __tablename__ = "answer_memory"
+    __table_args__ = (
+        # 联合唯一索引：查找与 upsert 均走索引，百万级条目仍为对数时间
+        UniqueConstraint("scope", "codebook_hash", "text_key", name="uq_answer_memory_key"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    scope = Column(String, nullable=False)
+    codebook_hash = Column(String(40), nullable=False)
+    text_key = Column(String, nullable=False)  # normalize_text 后的文本
+    code = Column(String, nullable=False)
+    confidence = Column(Float, default=1.0)
+    source = Column(String, default="ai")  # ai / manual（人工修正优先，不会被 AI 结果覆盖）
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    last_used_at = Column(DateTime(timezone=True), nullable=True)
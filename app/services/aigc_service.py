@@ -4,16 +4,23 @@ AIGC Service - 统一管理 AI 生成服务
 集中管理 OpenAI 及其他 AI 提供商的配置和调用
 """
 import json
+import time
 import asyncio
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from functools import lru_cache
+from collections import OrderedDict
 from aiolimiter import AsyncLimiter
 
 import openai
 from openai import OpenAI, AsyncOpenAI
 
 from app.core.config import settings
+from app.core.prompts import prefix_hash
+from app.core.llm_batching import estimate_tokens
+from app.services.llm_cache import LLMResponseCache, make_cache_key
+from app.services.concurrency import CircuitBreaker, LatencyTracker, OUTCOME_ERROR, classify_outcome
+from app.services.provider_pool import ProviderEndpoint, ProviderPool
 
 logger = logging.getLogger(__name__)
 
@@ -23,15 +30,20 @@ class AIGCService:
     AI 生成内容服务
     
     功能：
-    - 统一管理 AI 配置（API Key、Base URL、模型）
-    - 提供同步和异步客户端
-    - 内置限流控制
+    - 统一管理 AI 配置（多个端点：API Key、Base URL、模型，见 provider_pool）
+    - 提供同步和异步客户端（每个端点独立）
+    - 内置限流控制（每个端点的每分钟请求数 + 每分钟 token 数，按响应头自适应）
+    - 自适应并发窗口（AIMD）与熔断（不健康的端点暂时剔除，全部不可用时快速失败）
+    - 可选的对冲请求（慢请求超过延迟分位数时向其他端点发送副本，降低长尾延迟）
+    - 本地响应缓存（相同请求直接返回，不占用限流配额）
+    - 相同请求单飞合并（并发的重复请求只发送一次）
+    - 按提示词前缀（system 消息）统计 token 用量与服务商前缀缓存命中
     - 统一的错误处理和重试机制
     """
     
     _instance: Optional["AIGCService"] = None
-    _sync_client: Optional[OpenAI] = None
-    _async_client: Optional[AsyncOpenAI] = None
+    
+    MAX_TRACKED_PREFIXES = 100
     
     def __new__(cls):
         """单例模式"""
@@ -46,50 +58,66 @@ class AIGCService:
             
         self._initialized = True
         
-        # 从配置读取
-        self.api_key = settings.OPENAI_API_KEY
-        self.base_url = settings.OPENAI_BASE_URL
-        self.default_model = settings.OPENAI_DEFAULT_MODEL
+        # 端点池：每个端点独立的客户端、限流器、并发窗口和熔断器
+        self.pool = ProviderPool.from_settings()
+        primary = self.pool.primary
+        # 主端点的配置（向后兼容；缓存键按实际处理请求的端点模型计算）
+        self.api_key = primary.api_key
+        self.base_url = primary.base_url
+        self.default_model = primary.model
         
         # 输出配置信息（调试用）
         logger.info("=" * 60)
         logger.info("AIGC Service 配置信息:")
-        logger.info(f"  API Key: {self.api_key[:10]}...{self.api_key[-8:] if self.api_key else 'None'}")
-        logger.info(f"  Base URL: {self.base_url or 'None (使用默认 api.openai.com)'}")
-        logger.info(f"  Default Model: {self.default_model}")
-        logger.info(f"  Rate Limit: {settings.OPENAI_RATE_LIMIT_PER_MINUTE}/min")
+        for endpoint in self.pool.endpoints:
+            api_key = endpoint.api_key
+            logger.info(f"  [{endpoint.name}] API Key: {api_key[:10]}...{api_key[-8:] if api_key else 'None'}")
+            logger.info(f"  [{endpoint.name}] Base URL: {endpoint.base_url or 'None (使用默认 api.openai.com)'}")
+            logger.info(f"  [{endpoint.name}] Model: {endpoint.model}, Weight: {endpoint.weight}")
+            logger.info(f"  [{endpoint.name}] Rate Limit: {endpoint.rpm}/min, Token Limit: {endpoint.tpm or 'None'} tokens/min")
         logger.info("=" * 60)
         
-        # 限流器：每分钟最大请求数
-        self.rate_limiter = AsyncLimiter(
-            settings.OPENAI_RATE_LIMIT_PER_MINUTE, 
-            60
-        )
+        # 对冲请求：按近期成功请求的延迟分布决定何时发送对冲
+        self.latency_tracker = LatencyTracker(settings.LLM_HEDGE_LATENCY_WINDOW)
+        self.hedge_stats = {"requests": 0, "hedged": 0, "hedge_wins": 0, "budget_exhausted": 0, "no_capacity": 0}
         
         # 默认参数
         self.default_temperature = 0.3
         self.default_max_tokens = 4096
+        
+        # 进行中的请求（单飞合并）：请求键 → 共享的 Task
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.coalesced_calls = 0
+        
+        # 提示词前缀统计：前缀哈希 → 请求数 / token 用量（只保留最近的 MAX_TRACKED_PREFIXES 个）
+        self.prefix_usage: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+        
+        # 响应缓存：按请求内容寻址，重跑任务 / 重复批次直接命中
+        self.response_cache: Optional[LLMResponseCache] = None
+        if settings.LLM_CACHE_ENABLED:
+            try:
+                self.response_cache = LLMResponseCache(
+                    settings.LLM_CACHE_PATH,
+                    settings.LLM_CACHE_MAX_ENTRIES,
+                    settings.LLM_CACHE_TTL_SECONDS
+                )
+            except Exception as e:
+                logger.warning(f"LLM 响应缓存初始化失败，已禁用: {e}")
     
     @property
     def sync_client(self) -> OpenAI:
-        """获取同步客户端（惰性初始化）"""
-        if self._sync_client is None:
-            client_kwargs = {"api_key": self.api_key}
-            if self.base_url:
-                client_kwargs["base_url"] = self.base_url
-            self._sync_client = OpenAI(**client_kwargs)
-        return self._sync_client
+        """主端点的同步客户端"""
+        return self.pool.primary.sync_client
     
     @property
     def async_client(self) -> AsyncOpenAI:
-        """获取异步客户端（惰性初始化）"""
-        if self._async_client is None:
-            client_kwargs = {"api_key": self.api_key}
-            if self.base_url:
-                client_kwargs["base_url"] = self.base_url
-            logger.info(f"初始化 AsyncOpenAI 客户端: base_url={client_kwargs.get('base_url', 'default')}")
-            self._async_client = AsyncOpenAI(**client_kwargs)
-        return self._async_client
+        """主端点的异步客户端"""
+        return self.pool.primary.async_client
+    
+    @property
+    def rate_limiter(self) -> AsyncLimiter:
+        """主端点的 RPM 限流器（向后兼容）"""
+        return self.pool.primary.rate_limiter
     
     async def chat_completion(
         self,
@@ -98,7 +126,9 @@ class AIGCService:
         temperature: Optional[float] = None,
         max_tokens: Optional[int] = None,
         response_format: Optional[Dict[str, str]] = None,
-        use_rate_limit: bool = True
+        use_rate_limit: bool = True,
+        use_cache: bool = True,
+        logprobs: bool = False
     ) -> str:
         """
         异步聊天补全
@@ -110,31 +140,164 @@ class AIGCService:
             max_tokens: 最大token数
             response_format: 响应格式，如 {"type": "json_object"}
             use_rate_limit: 是否使用限流
+            use_cache: 是否使用响应缓存（False 时强制请求并刷新缓存）
+            logprobs: 同时返回输出 token 的对数概率，响应为 JSON 包装 {"content", "logprobs"}
+                      （一般通过 chat_completion_json_with_logprobs 调用）
             
         Returns:
             AI 响应文本
         """
+        # 未指定模型时请求可能由池中任一模型处理，任一模型的缓存结果都可复用
+        if use_cache:
+            for cache_key in self._cache_keys(messages, model, temperature, max_tokens, response_format, logprobs):
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    return cached
+        
+        # 单飞合并：相同请求正在进行时直接等待同一个结果（异常同样传递给所有等待者）；
+        # 强制刷新（use_cache=False，如重试）只与其他强制刷新的请求合并，不会取回要绕过的响应
+        flight_key = make_cache_key(
+            "|".join(self.request_models(model)),
+            messages,
+            temperature if temperature is not None else self.default_temperature,
+            max_tokens,
+            response_format,
+            logprobs
+        ) + ("" if use_cache else ":refresh")
+        inflight = self._inflight.get(flight_key)
+        if inflight is not None and not inflight.done():
+            self.coalesced_calls += 1
+            return await asyncio.shield(inflight)
+        
+        task = asyncio.ensure_future(self._request(
+            messages, model, temperature, max_tokens, response_format, use_rate_limit, logprobs
+        ))
+        self._inflight[flight_key] = task
+        task.add_done_callback(lambda done: self._finish_flight(flight_key, done))
+        # shield：某个调用方被取消时不影响共享请求和其他等待者
+        return await asyncio.shield(task)
+    
+    async def _request(
+        self,
+        messages: List[Dict[str, str]],
+        model: Optional[str],
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        response_format: Optional[Dict[str, str]],
+        use_rate_limit: bool,
+        logprobs: bool = False
+    ) -> str:
+        """选择端点（熔断检查）+ 并发窗口 + 限流 + 请求 + 写入缓存（按该端点实际使用的模型）"""
+        endpoint = self.pool.select(model=model)
         if use_rate_limit:
-            async with self.rate_limiter:
-                return await self._do_chat_completion(
-                    messages, model, temperature, max_tokens, response_format
-                )
+            await endpoint.concurrency.acquire()
+            while endpoint.circuit_breaker.state == CircuitBreaker.OPEN:
+                # 排队期间该端点被熔断：归还名额，改选其他端点
+                endpoint.concurrency.release(0.0, OUTCOME_ERROR)
+                endpoint = self.pool.select(model=model)
+                await endpoint.concurrency.acquire()
+            started = time.perf_counter()
+            error: Optional[BaseException] = None
+            try:
+                reserved = await endpoint.token_limiter.acquire(self._estimate_request_tokens(messages, max_tokens))
+                async with endpoint.rate_limiter:
+                    started = time.perf_counter()
+                    content = await self._complete_with_hedge(
+                        endpoint, messages, model, temperature, max_tokens, response_format, reserved, logprobs
+                    )
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                endpoint.concurrency.release(time.perf_counter() - started, classify_outcome(error))
+                if not isinstance(error, asyncio.CancelledError):
+                    endpoint.circuit_breaker.record(error)
         else:
-            return await self._do_chat_completion(
-                messages, model, temperature, max_tokens, response_format
-            )
+            try:
+                content = await self._do_chat_completion(
+                    endpoint, messages, model, temperature, max_tokens, response_format, logprobs=logprobs
+                )
+            except Exception as e:
+                endpoint.circuit_breaker.record(e)
+                raise
+            endpoint.circuit_breaker.record(None)
+        
+        cache_key = self._cache_key(messages, model or endpoint.model, temperature, max_tokens, response_format, logprobs)
+        if cache_key and content is not None:
+            self.response_cache.set(cache_key, content)
+        return content
+    
+    def _finish_flight(self, flight_key: str, task: asyncio.Future) -> None:
+        """请求结束后移出进行中列表"""
+        if self._inflight.get(flight_key) is task:
+            del self._inflight[flight_key]
+        # 所有等待者都已取消时，避免 "exception was never retrieved" 警告
+        if not task.cancelled():
+            task.exception()
+    
+    def request_models(self, model: Optional[str] = None) -> List[str]:
+        """请求可能使用的模型：指定了 model 时为该模型，否则为池中各端点的默认模型"""
+        return [model] if model else self.pool.models
+    
+    def _cache_key(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        response_format: Optional[Dict[str, str]],
+        logprobs: bool = False
+    ) -> Optional[str]:
+        """计算缓存键（model 为实际使用的模型）；缓存未启用或温度过高（结果不确定）时返回 None"""
+        if self.response_cache is None:
+            return None
+        temperature = temperature if temperature is not None else self.default_temperature
+        if temperature > settings.LLM_CACHE_MAX_TEMPERATURE:
+            return None
+        return make_cache_key(model, messages, temperature, max_tokens, response_format, logprobs)
+    
+    def _cache_keys(
+        self,
+        messages: List[Dict[str, str]],
+        model: Optional[str],
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        response_format: Optional[Dict[str, str]],
+        logprobs: bool = False
+    ) -> List[str]:
+        """请求可能命中的缓存键（每个可能使用的模型一个）"""
+        keys = [
+            self._cache_key(messages, request_model, temperature, max_tokens, response_format, logprobs)
+            for request_model in self.request_models(model)
+        ]
+        return [key for key in keys if key]
+    
+    def _invalidate(
+        self,
+        messages: List[Dict[str, str]],
+        model: Optional[str],
+        temperature: Optional[float],
+        response_format: Optional[Dict[str, str]],
+        logprobs: bool = False
+    ) -> None:
+        """删除无法解析的缓存响应（不确定由哪个模型处理时删除所有可能的键）"""
+        for cache_key in self._cache_keys(messages, model, temperature, None, response_format, logprobs):
+            self.response_cache.delete(cache_key)
     
     async def _do_chat_completion(
         self,
+        endpoint: ProviderEndpoint,
         messages: List[Dict[str, str]],
         model: Optional[str],
         temperature: Optional[float],
         max_tokens: Optional[int],
-        response_format: Optional[Dict[str, str]]
+        response_format: Optional[Dict[str, str]],
+        reserved_tokens: int = 0,
+        logprobs: bool = False
     ) -> str:
-        """执行聊天补全请求"""
+        """在指定端点执行聊天补全请求（读取响应头用于 TPM 限流校正）"""
         kwargs = {
-            "model": model or self.default_model,
+            "model": model or endpoint.model,
             "messages": messages,
             "temperature": temperature if temperature is not None else self.default_temperature,
         }
@@ -145,8 +308,195 @@ class AIGCService:
         if response_format:
             kwargs["response_format"] = response_format
         
-        response = await self.async_client.chat.completions.create(**kwargs)
-        return response.choices[0].message.content
+        if logprobs:
+            kwargs["logprobs"] = True
+        
+        limiter = endpoint.token_limiter
+        started = time.perf_counter()
+        try:
+            raw = await endpoint.async_client.chat.completions.with_raw_response.create(**kwargs)
+        except openai.RateLimitError as e:
+            limiter.reconcile(reserved_tokens, None)
+            limiter.observe_headers(getattr(e.response, "headers", None), throttled=True)
+            raise
+        except BaseException:
+            # 请求未完成（失败或对冲落败被取消），按预留值计入（服务商可能已计算输入 token）
+            limiter.reconcile(reserved_tokens, None)
+            raise
+        
+        response = await raw.parse()
+        self.latency_tracker.add(time.perf_counter() - started)
+        usage = getattr(response, "usage", None)
+        # 未预留的请求（不限流调用）按实际用量补扣
+        limiter.reconcile(reserved_tokens, getattr(usage, "total_tokens", None))
+        limiter.observe_headers(raw.headers)
+        self._record_usage(messages, usage)
+        choice = response.choices[0]
+        if logprobs:
+            # 不支持 logprobs 的服务商 / 模型返回 None，由调用方改用其他置信度来源
+            token_logprobs = getattr(getattr(choice, "logprobs", None), "content", None)
+            return json.dumps({
+                "content": choice.message.content,
+                "logprobs": [[t.token, t.logprob] for t in token_logprobs] if token_logprobs else None
+            }, ensure_ascii=False)
+        return choice.message.content
+    
+    async def _complete_with_hedge(
+        self,
+        endpoint: ProviderEndpoint,
+        messages: List[Dict[str, str]],
+        model: Optional[str],
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        response_format: Optional[Dict[str, str]],
+        reserved_tokens: int = 0,
+        logprobs: bool = False
+    ) -> str:
+        """
+        对冲请求：主请求超过近期延迟的 LLM_HEDGE_PERCENTILE 分位数仍未返回时，
+        再发送一个相同请求（优先发往其他端点），取先成功的响应并取消另一个。
+        对冲请求数不超过主请求数的 LLM_HEDGE_BUDGET_RATIO；对冲请求同样占用其端点的
+        并发名额和 RPM / TPM 额度，端点没有余量时不对冲（不排队等待）。
+        """
+        self.hedge_stats["requests"] += 1
+        threshold = self._hedge_threshold()
+        if threshold is None:
+            return await self._do_chat_completion(
+                endpoint, messages, model, temperature, max_tokens, response_format, reserved_tokens, logprobs
+            )
+        
+        primary = asyncio.ensure_future(self._do_chat_completion(
+            endpoint, messages, model, temperature, max_tokens, response_format, reserved_tokens, logprobs
+        ))
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=threshold)
+            if done:
+                return primary.result()
+            if self.hedge_stats["hedged"] >= self.hedge_stats["requests"] * settings.LLM_HEDGE_BUDGET_RATIO:
+                self.hedge_stats["budget_exhausted"] += 1
+                return await primary
+            
+            # 对冲请求与主请求使用同一模型（未指定模型时为主请求端点的默认模型，响应按该模型缓存）
+            hedge_model = model or endpoint.model
+            hedge_endpoint = self.pool.select(exclude=endpoint, model=hedge_model) or endpoint
+            hedge_reserved = self._reserve_now(hedge_endpoint, messages, max_tokens)
+            if hedge_reserved is None:
+                self.hedge_stats["no_capacity"] += 1
+                return await primary
+            
+            self.hedge_stats["hedged"] += 1
+            hedge = asyncio.ensure_future(self._hedge_request(
+                hedge_endpoint, hedge_reserved, hedge_endpoint is not endpoint,
+                messages, hedge_model, temperature, max_tokens, response_format, logprobs
+            ))
+            pending = {primary, hedge}
+            try:
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            if task is hedge:
+                                self.hedge_stats["hedge_wins"] += 1
+                            return task.result()
+                # 两个请求都失败：抛出主请求的异常
+                return primary.result()
+            finally:
+                self._discard(hedge)
+        finally:
+            self._discard(primary)
+    
+    def _reserve_now(
+        self,
+        endpoint: ProviderEndpoint,
+        messages: List[Dict[str, str]],
+        max_tokens: Optional[int]
+    ) -> Optional[int]:
+        """
+        不等待地占用端点的并发名额和 RPM / TPM 额度（用于对冲请求）
+
+        Returns:
+            预留的 TPM 额度；任一项没有余量时返回 None（不占用任何额度）
+        """
+        if not endpoint.rate_limiter.has_capacity():
+            return None
+        reserved = endpoint.token_limiter.try_acquire(self._estimate_request_tokens(messages, max_tokens))
+        if reserved is None:
+            return None
+        if not endpoint.concurrency.try_acquire():
+            endpoint.token_limiter.reconcile(reserved, 0)
+            return None
+        return reserved
+    
+    async def _hedge_request(
+        self,
+        endpoint: ProviderEndpoint,
+        reserved_tokens: int,
+        record_circuit: bool,
+        messages: List[Dict[str, str]],
+        model: Optional[str],
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        response_format: Optional[Dict[str, str]],
+        logprobs: bool
+    ) -> str:
+        """发送对冲请求（_reserve_now 已占用并发名额和 TPM 额度），结束后归还名额"""
+        started = time.perf_counter()
+        error: Optional[BaseException] = None
+        try:
+            async with endpoint.rate_limiter:
+                return await self._do_chat_completion(
+                    endpoint, messages, model, temperature, max_tokens, response_format, reserved_tokens, logprobs
+                )
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            endpoint.concurrency.release(time.perf_counter() - started, classify_outcome(error))
+            # 对冲到其他端点时结果计入该端点的熔断器（被取消的不计）
+            if record_circuit and not isinstance(error, asyncio.CancelledError):
+                endpoint.circuit_breaker.record(error)
+    
+    @staticmethod
+    def _discard(task: asyncio.Future) -> None:
+        """取消未完成的请求；已完成的读取异常，避免 "exception was never retrieved" 警告"""
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled():
+            task.exception()
+    
+    def _hedge_threshold(self) -> Optional[float]:
+        """对冲触发延迟（秒）；未启用或延迟样本不足时返回 None"""
+        if not settings.LLM_HEDGE_ENABLED or self.latency_tracker.count < settings.LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return max(self.latency_tracker.percentile(settings.LLM_HEDGE_PERCENTILE), settings.LLM_HEDGE_MIN_DELAY_SECONDS)
+    
+    def _estimate_request_tokens(self, messages: List[Dict[str, str]], max_tokens: Optional[int]) -> int:
+        """预估单个请求的 token 数：各消息内容 + 每条消息的格式开销 + 预期输出"""
+        prompt_tokens = sum(estimate_tokens(m.get("content") or "") + 4 for m in messages)
+        return prompt_tokens + (max_tokens or settings.OPENAI_TPM_DEFAULT_COMPLETION_TOKENS)
+    
+    def _record_usage(self, messages: List[Dict[str, str]], usage: Any) -> None:
+        """
+        按提示词前缀累计 token 用量
+
+        cached_tokens 为服务商前缀缓存命中的输入 token（usage.prompt_tokens_details，
+        不支持的服务商为 0），用于确认静态前缀是否被复用。
+        """
+        if not messages or messages[0].get("role") != "system":
+            return
+        key = prefix_hash(messages[0].get("content", ""))
+        entry = self.prefix_usage.pop(key, None) or {
+            "requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0
+        }
+        entry["requests"] += 1
+        if usage is not None:
+            details = getattr(usage, "prompt_tokens_details", None)
+            entry["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+            entry["cached_tokens"] += (getattr(details, "cached_tokens", 0) or 0) if details else 0
+            entry["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+        self.prefix_usage[key] = entry
+        while len(self.prefix_usage) > self.MAX_TRACKED_PREFIXES:
+            self.prefix_usage.popitem(last=False)
     
     def chat_completion_sync(
         self,
@@ -161,8 +511,9 @@ class AIGCService:
         
         注意：同步调用不使用限流器
         """
+        endpoint = self.pool.select(model=model)
         kwargs = {
-            "model": model or self.default_model,
+            "model": model or endpoint.model,
             "messages": messages,
             "temperature": temperature if temperature is not None else self.default_temperature,
         }
@@ -173,7 +524,13 @@ class AIGCService:
         if response_format:
             kwargs["response_format"] = response_format
         
-        response = self.sync_client.chat.completions.create(**kwargs)
+        try:
+            response = endpoint.sync_client.chat.completions.create(**kwargs)
+        except Exception as e:
+            endpoint.circuit_breaker.record(e)
+            raise
+        endpoint.circuit_breaker.record(None)
+        self._record_usage(messages, getattr(response, "usage", None))
         return response.choices[0].message.content
     
     async def chat_completion_json(
@@ -181,29 +538,73 @@ class AIGCService:
         messages: List[Dict[str, str]],
         model: Optional[str] = None,
         temperature: Optional[float] = None,
-        use_rate_limit: bool = True
+        use_rate_limit: bool = True,
+        use_cache: bool = True,
+        response_format: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
         """
         异步聊天补全，返回 JSON 对象
         
-        自动设置 response_format 为 json_object，并解析返回内容
+        默认 response_format 为 json_object（可传入 json_schema 结构化输出），并解析返回内容
         """
+        response_format = response_format or {"type": "json_object"}
         content = await self.chat_completion(
             messages=messages,
             model=model,
             temperature=temperature,
-            response_format={"type": "json_object"},
-            use_rate_limit=use_rate_limit
+            response_format=response_format,
+            use_rate_limit=use_rate_limit,
+            use_cache=use_cache
+        )
+        try:
+            return json.loads(content)
+        except (TypeError, json.JSONDecodeError):
+            # 无法解析的响应不保留在缓存中，下次重新请求
+            self._invalidate(messages, model, temperature, response_format)
+            raise
+    
+    async def chat_completion_json_with_logprobs(
+        self,
+        messages: List[Dict[str, str]],
+        model: Optional[str] = None,
+        temperature: Optional[float] = None,
+        use_cache: bool = True,
+        response_format: Optional[Dict[str, Any]] = None
+    ) -> Tuple[Dict[str, Any], str, Optional[List[List[Any]]]]:
+        """
+        异步聊天补全，返回 (JSON 对象, 原始响应文本, 输出 token 的 [[token, 对数概率], ...])
+        
+        服务商不支持 logprobs 时第三项为 None
+        """
+        response_format = response_format or {"type": "json_object"}
+        envelope = await self.chat_completion(
+            messages=messages,
+            model=model,
+            temperature=temperature,
+            response_format=response_format,
+            use_cache=use_cache,
+            logprobs=True
         )
-        return json.loads(content)
+        try:
+            payload = json.loads(envelope)
+            content = payload["content"]
+            return json.loads(content), content, payload.get("logprobs")
+        except (TypeError, KeyError, json.JSONDecodeError):
+            self._invalidate(messages, model, temperature, response_format, logprobs=True)
+            raise
+    
+    async def wait_for_circuit(self, deadline: float) -> bool:
+        """所有端点熔断期间暂停到允许试探请求；超过 deadline（time.monotonic()）仍熔断时返回 False"""
+        return await self.pool.wait_until_available(deadline)
     
     async def batch_chat_completion(
         self,
         messages_list: List[List[Dict[str, str]]],
         model: Optional[str] = None,
         temperature: Optional[float] = None,
-        max_concurrent: int = 5,
-        response_format: Optional[Dict[str, str]] = None
+        max_concurrent: Optional[int] = None,
+        response_format: Optional[Dict[str, str]] = None,
+        use_cache: bool = True
     ) -> List[str]:
         """
         批量异步聊天补全
@@ -212,13 +613,14 @@ class AIGCService:
             messages_list: 多组消息列表
             model: 模型名称
             temperature: 温度参数
-            max_concurrent: 最大并发数
+            max_concurrent: 最大并发数（默认不额外限制，由自适应并发窗口控制）
             response_format: 响应格式
+            use_cache: 是否使用响应缓存
             
         Returns:
             响应列表，顺序与输入一致
         """
-        semaphore = asyncio.Semaphore(max_concurrent)
+        semaphore = asyncio.Semaphore(max_concurrent or settings.LLM_CONCURRENCY_MAX)
         
         async def process_single(idx: int, messages: List[Dict[str, str]]):
             async with semaphore:
@@ -227,7 +629,8 @@ class AIGCService:
                         messages=messages,
                         model=model,
                         temperature=temperature,
-                        response_format=response_format
+                        response_format=response_format,
+                        use_cache=use_cache
                     )
                     return (idx, result, None)
                 except Exception as e:
@@ -247,8 +650,57 @@ class AIGCService:
             "api_key_preview": f"{self.api_key[:8]}...{self.api_key[-4:]}" if self.api_key else None,
             "base_url": self.base_url or "default (api.openai.com)",
             "default_model": self.default_model,
-            "rate_limit_per_minute": settings.OPENAI_RATE_LIMIT_PER_MINUTE,
+            "rate_limit_per_minute": sum(endpoint.rpm for endpoint in self.pool.endpoints),
+            "tokens_per_minute": sum(endpoint.tpm for endpoint in self.pool.endpoints),
+            "endpoints": [
+                {
+                    "name": endpoint.name,
+                    "api_key_preview": f"{endpoint.api_key[:8]}...{endpoint.api_key[-4:]}" if endpoint.api_key else None,
+                    "base_url": endpoint.base_url or "default (api.openai.com)",
+                    "model": endpoint.model,
+                    "weight": endpoint.weight,
+                    "rpm": endpoint.rpm,
+                    "tpm": endpoint.tpm,
+                }
+                for endpoint in self.pool.endpoints
+            ],
+            "response_cache_enabled": self.response_cache is not None,
+        }
+    
+    def get_metrics(self) -> Dict[str, Any]:
+        """运行时指标（缓存命中率、合并请求数、各提示词前缀的 token 用量等）"""
+        hedge_threshold = self._hedge_threshold()
+        return {
+            "cache": self.response_cache.get_stats() if self.response_cache else None,
+            "concurrency": {
+                "total_window": round(sum(endpoint.concurrency.window for endpoint in self.pool.endpoints), 2),
+                "inflight": sum(endpoint.concurrency.inflight for endpoint in self.pool.endpoints),
+            },
+            "endpoints": self.pool.get_stats(),
+            "hedging": {
+                "enabled": settings.LLM_HEDGE_ENABLED,
+                "threshold_seconds": round(hedge_threshold, 3) if hedge_threshold is not None else None,
+                "latency": self.latency_tracker.get_stats(),
+                **self.hedge_stats,
+            },
+            "coalescing": {
+                "coalesced_calls": self.coalesced_calls,
+                "inflight": len(self._inflight),
+            },
+            "prompt_prefixes": [
+                {
+                    "prefix_hash": key,
+                    **entry,
+                    "cached_ratio": round(entry["cached_tokens"] / entry["prompt_tokens"], 4)
+                    if entry["prompt_tokens"] else 0.0,
+                }
+                for key, entry in reversed(self.prefix_usage.items())
+            ],
         }
+    
+    def clear_cache(self) -> int:
+        """清空响应缓存，返回删除的条目数"""
+        return self.response_cache.clear() if self.response_cache else 0
 
 
 # 全局单例实例
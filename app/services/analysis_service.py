@@ -1,5 +1,7 @@
 import os
 import uuid
+from functools import partial
+from typing import Dict
 import pandas as pd
 from datetime import datetime
 from sqlalchemy.orm import Session
@@ -7,6 +9,14 @@ from app.models.task import Task
 from app.models.result import AnalysisResult
 from app.models.code_library import CodeLibrary
 from app.models.project import Project
+from app.core.config import settings
+from app.core.code_hierarchy import is_hierarchical
+from app.services.answer_memory_service import (
+    codebook_hash,
+    memory_scope,
+    lookup_answers,
+    remember_task_results
+)
 from app.core.coding_extraction import (
     extract_codes_with_llm, 
     extract_codes_with_bertopic, 
@@ -23,6 +33,13 @@ class TaskStatus:
     COMPLETED = "completed"
     FAILED = "failed"
 
+def _column_texts(series: pd.Series) -> list:
+    """将一列原始取值转换为待分类文本列表"""
+    texts = series.astype(str).where(series.notna(), "")
+    empty = (texts.str.lower() == 'nan') | (texts.str.strip() == '')
+    return texts.mask(empty, "").tolist()
+
+
 async def process_analysis_task(task_id: str, db: Session):
     """Background task to process classification with per-column independent configuration"""
     task = db.query(Task).filter(Task.id == task_id).first()
@@ -111,6 +128,10 @@ async def process_analysis_task(task_id: str, db: Session):
             
         # Initialize stats counters
         all_statistics = {col: {} for col in columns_to_process}
+        # 处理过程统计（去重率等），存放在 statistics["_meta"] 下，不影响各列编码计数
+        processing_stats = {}
+        # 分层编码表各列的大类计数
+        parent_statistics = {}
         
         # ============ 按列批量分类（优化） ============
         column_results = {}  # {col_name: [result1, result2, ...]}
@@ -123,18 +144,19 @@ async def process_analysis_task(task_id: str, db: Session):
             task.progress = 10 + int((col_idx / len(columns_to_process)) * 80)
             db.commit()
             
-            # 提取该列所有文本
-            col_texts = []
-            for i, row in enumerate(df.to_dict('records')):
-                val = row.get(col_name)
-                text = str(val) if pd.notna(val) else ""
-                if pd.isna(val) or text.lower() == 'nan' or text.strip() == '':
-                    text = ""
-                col_texts.append(text)
+            # 提取该列所有文本（整列向量化处理，空值 / 'nan' / 纯空白统一为空串）
+            col_texts = _column_texts(df[col_name])
             
             # 使用批量分类函数，传入 row_ids 用于横向分析
             print(f"[Analysis] Column '{col_name}' - Mode: {classification_mode}, Total: {len(col_texts)}")
             
+            # 跨任务答案记忆：同项目、同编码表的历史分类结果在 AI 之前复用（未归属项目的任务不使用）
+            answer_memory = None
+            scope = memory_scope(task.project_id)
+            if settings.ANSWER_MEMORY_ENABLED and scope is not None:
+                answer_memory = partial(lookup_answers, db, scope, codebook_hash(col_config.get("codes", [])))
+            
+            column_stats = {}
             col_classification_results = await classify_column_batch(
                 texts=col_texts,
                 codes=col_config.get("codes", []),
@@ -142,11 +164,16 @@ async def process_analysis_task(task_id: str, db: Session):
                 mapping_dict=col_config.get("mapping_dict", {}),
                 default_code=col_config.get("default_code", ""),
                 row_ids=ids,  # 传入唯一ID列表（题目/ID列的值）
-                batch_size=50,
-                max_concurrent=3
+                stats=column_stats,
+                answer_memory=answer_memory,
+                parent_codes=col_config.get("parent_codes") or None
             )
             
             column_results[col_name] = col_classification_results
+            processing_stats[col_name] = column_stats
+            dedup = column_stats.get("dedup", {})
+            print(f"[Analysis] Column '{col_name}' - Distinct: {dedup.get('distinct_values')}, "
+                  f"Dedup ratio: {dedup.get('dedup_ratio')}x")
             
             # 统计该列结果
             for result in col_classification_results:
@@ -154,6 +181,13 @@ async def process_analysis_task(task_id: str, db: Session):
                 if code not in all_statistics[col_name]:
                     all_statistics[col_name][code] = 0
                 all_statistics[col_name][code] += 1
+            
+            # 分层编码表：按大类汇总（存放在 statistics["_parent_codes"][列名] 下）
+            if is_hierarchical(col_config.get("codes", [])):
+                parent_counts = parent_statistics.setdefault(col_name, {})
+                for result in col_classification_results:
+                    parent_code = result.get("parent_code") or "N/A"
+                    parent_counts[parent_code] = parent_counts.get(parent_code, 0) + 1
         
         # ============ 组装并存储结果 ============
         task.current_message = "正在存储分析结果..."
@@ -180,6 +214,8 @@ async def process_analysis_task(task_id: str, db: Session):
                     "method": classification.get("method"),
                     "original_text": text
                 }
+                if "parent_code" in classification:
+                    row_data_map[col_name]["parent_code"] = classification["parent_code"]
             
             db_obj = AnalysisResult(
                 task_id=task_id,
@@ -201,11 +237,33 @@ async def process_analysis_task(task_id: str, db: Session):
         # Mark as completed
         task.status = TaskStatus.COMPLETED
         task.progress = 100
+        all_statistics["_meta"] = processing_stats
+        if parent_statistics:
+            all_statistics["_parent_codes"] = parent_statistics
+        # 任务级统计汇总：AI 请求重试、模型级联、本地模型、自训练、分层分类（各列明细见 _meta[列名][统计名]）
+        for stats_key in ("ai_retries", "ai_cascade", "ai_local_model", "self_training", "hierarchy"):
+            totals: Dict[str, int] = {}
+            for column_stats in processing_stats.values():
+                for key, value in column_stats.get(stats_key, {}).items():
+                    if isinstance(value, int):
+                        totals[key] = totals.get(key, 0) + value
+            if totals:
+                all_statistics[f"_{stats_key}"] = totals
+                print(f"[Analysis] Task {task_id} {stats_key}: {totals}")
         task.statistics = all_statistics
         task.completed_at = datetime.now()
         task.current_message = "分析完成"
         db.commit()
         
+        # 本次 AI 分类结果写入答案记忆（失败不影响任务结果）
+        if settings.ANSWER_MEMORY_ENABLED:
+            try:
+                remembered = remember_task_results(db, task)
+                print(f"[Answer Memory] Task {task_id}: remembered {remembered} answers")
+            except Exception as e:
+                db.rollback()
+                print(f"[Answer Memory] Failed to update memory for task {task_id}: {e}")
+        
     except Exception as e:
         import traceback
         error_detail = f"{str(e)}\n{traceback.format_exc()}"
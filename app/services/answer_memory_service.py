@@ -0,0 +1,245 @@
+"""
+跨任务答案记忆服务
+
+同一项目的多轮问卷中，常见回答会反复出现。已完成任务中 AI 给出的高置信度分类
+和人工修正会写入答案记忆，之后的任务在调用 LLM 之前先按
+(作用域, 编码表哈希, 规范化文本) 查找，命中即作为 memory_match 结果。
+
+淘汰 / 失效策略：
+- 编码表（编码名称 + 描述）变化后哈希不同，旧记忆不再命中；
+- 每个作用域只保留最近使用的 ANSWER_MEMORY_MAX_CODEBOOKS 个编码表版本；
+- 超过 ANSWER_MEMORY_TTL_DAYS 天未被使用的记忆被删除；
+- 人工修正优先于 AI 结果，AI 结果不会覆盖人工修正。
+"""
+import json
+import hashlib
+from typing import List, Dict, Any, Iterable, Tuple, Optional
+
+from sqlalchemy import func, or_
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.normalization import normalize_text
+from app.models.answer_memory import AnswerMemory
+from app.models.result import AnalysisResult
+from app.models.task import Task
+
+# 单条 SQL 中 IN / VALUES 的最大条数（SQLite 变量数限制）
+_CHUNK_SIZE = 500
+
+SOURCE_AI = "ai"
+SOURCE_MANUAL = "manual"
+
+# 可写入记忆的 AI 分类方法（ai_error 等失败结果不写入）
+_MEMORABLE_METHODS = frozenset({
+    "ai_classification", "ai_batch_classification", "ai_cascade_cheap", "ai_cascade_strong"
+})
+# 只有带置信度时才写入记忆的方法：模型级联没有置信度信号的行未经校验，不能跳过后续任务的 LLM
+# （ai_cascade_unverified：一致性检查也未完成的行，任何情况下都不写入）
+_CONFIDENCE_REQUIRED_METHODS = frozenset({"ai_cascade_cheap", "ai_cascade_strong"})
+
+
+def codebook_hash(codes: List[Dict[str, Any]]) -> str:
+    """编码表哈希：只取编码名称和描述（关键词变化不影响已分类答案的有效性）"""
+    entries = sorted(
+        (str(c.get('code', '')), str(c.get('description', '') or '')) for c in codes or []
+    )
+    return hashlib.sha1(json.dumps(entries, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def memory_scope(project_id: Any) -> Optional[str]:
+    """记忆作用域：按项目隔离；未归属项目的任务没有作用域（不读写记忆，避免不同任务互相污染）"""
+    if project_id is None or str(project_id).strip() == "":
+        return None
+    return f"project:{project_id}"
+
+
+def answer_key(text: str) -> str:
+    """记忆键：与 classify_column_batch 的去重键一致"""
+    if not text:
+        return ""
+    return normalize_text(text) or text.strip()
+
+
+def _chunks(items: List[Any]) -> Iterable[List[Any]]:
+    for start in range(0, len(items), _CHUNK_SIZE):
+        yield items[start:start + _CHUNK_SIZE]
+
+
+def lookup_answers(db: Session, scope: str, codebook: str, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    批量查找答案记忆
+
+    Args:
+        keys: 记忆键（规范化文本）列表
+
+    Returns:
+        {记忆键: {code, confidence, method: "memory_match"}}，只包含命中的键
+    """
+    found: Dict[str, Dict[str, Any]] = {}
+    hit_ids: List[int] = []
+    for chunk in _chunks([key for key in keys if key]):
+        rows = db.query(
+            AnswerMemory.id, AnswerMemory.text_key, AnswerMemory.code, AnswerMemory.confidence
+        ).filter(
+            AnswerMemory.scope == scope,
+            AnswerMemory.codebook_hash == codebook,
+            AnswerMemory.text_key.in_(chunk)
+        ).all()
+        for row_id, text_key, code, confidence in rows:
+            found[text_key] = {
+                "code": code,
+                "confidence": confidence if confidence is not None else 1.0,
+                "method": "memory_match"
+            }
+            hit_ids.append(row_id)
+
+    if hit_ids:
+        for chunk in _chunks(hit_ids):
+            db.query(AnswerMemory).filter(AnswerMemory.id.in_(chunk)).update(
+                {AnswerMemory.hits: AnswerMemory.hits + 1, AnswerMemory.last_used_at: func.now()},
+                synchronize_session=False
+            )
+        db.commit()
+    return found
+
+
+def remember_answers(
+    db: Session,
+    scope: str,
+    codebook: str,
+    entries: Iterable[Tuple[str, str, float]],
+    source: str = SOURCE_AI
+) -> int:
+    """
+    写入（upsert）答案记忆
+
+    Args:
+        entries: (原文, 编码, 置信度) 列表，同一记忆键以最后一条为准
+        source: ai / manual；AI 结果不会覆盖已有的人工修正
+
+    Returns:
+        写入的记忆键数量
+    """
+    rows: Dict[str, Dict[str, Any]] = {}
+    for text, code, confidence in entries:
+        key = answer_key(text)
+        if key and code:
+            rows[key] = {
+                "scope": scope,
+                "codebook_hash": codebook,
+                "text_key": key,
+                "code": code,
+                "confidence": confidence,
+                "source": source,
+                "hits": 0
+            }
+    if not rows:
+        return 0
+
+    for chunk in _chunks(list(rows.values())):
+        stmt = insert(AnswerMemory).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["scope", "codebook_hash", "text_key"],
+            set_={
+                "code": stmt.excluded.code,
+                "confidence": stmt.excluded.confidence,
+                "source": stmt.excluded.source,
+                "updated_at": func.now()
+            },
+            where=or_(AnswerMemory.source != SOURCE_MANUAL, stmt.excluded.source == SOURCE_MANUAL)
+        )
+        db.execute(stmt)
+    db.commit()
+
+    evict_answer_memory(db, scope)
+    return len(rows)
+
+
+def remember_task_results(db: Session, task: Task) -> int:
+    """
+    从已完成任务的 AnalysisResult 中提取 AI 分类结果写入记忆
+
+    带置信度的结果需达到 ANSWER_MEMORY_MIN_CONFIDENCE；批量分类不返回置信度，按 1.0 记录；
+    模型级联的结果没有置信度时不写入
+
+    Returns:
+        写入的记忆键数量（所有列合计）；任务未归属项目时为 0
+    """
+    scope = memory_scope(task.project_id)
+    if scope is None:
+        return 0
+    column_configs = task.column_configs or {}
+    entries: Dict[str, List[Tuple[str, str, float]]] = {col_name: [] for col_name in column_configs}
+
+    for (data,) in db.query(AnalysisResult.data).filter(AnalysisResult.task_id == task.id).yield_per(1000):
+        for col_name, value in (data or {}).items():
+            if col_name not in entries or not isinstance(value, dict):
+                continue
+            if value.get("method") not in _MEMORABLE_METHODS:
+                continue
+            confidence = value.get("confidence")
+            if confidence is None:
+                if value.get("method") in _CONFIDENCE_REQUIRED_METHODS:
+                    continue
+                confidence = 1.0
+            elif confidence < settings.ANSWER_MEMORY_MIN_CONFIDENCE:
+                continue
+            entries[col_name].append((value.get("original_text") or "", value.get("code"), confidence))
+
+    total = 0
+    for col_name, col_entries in entries.items():
+        if col_entries:
+            codes = column_configs[col_name].get("codes", [])
+            total += remember_answers(db, scope, codebook_hash(codes), col_entries)
+    return total
+
+
+def record_correction(db: Session, scope: str, codes: List[Dict[str, Any]], text: str, code: str) -> None:
+    """记录人工修正（置信度 1.0，优先于 AI 结果）"""
+    remember_answers(db, scope, codebook_hash(codes), [(text, code, 1.0)], source=SOURCE_MANUAL)
+
+
+def evict_answer_memory(db: Session, scope: str) -> int:
+    """
+    淘汰过期记忆：超出保留代数的旧编码表版本，以及长期未使用的条目
+
+    Returns:
+        删除的条目数
+    """
+    generations = db.query(
+        AnswerMemory.codebook_hash,
+        func.max(func.coalesce(AnswerMemory.last_used_at, AnswerMemory.updated_at))
+    ).filter(
+        AnswerMemory.scope == scope
+    ).group_by(AnswerMemory.codebook_hash).order_by(
+        func.max(func.coalesce(AnswerMemory.last_used_at, AnswerMemory.updated_at)).desc(),
+        func.max(AnswerMemory.id).desc()  # 同一秒内写入时，后写入的版本更新
+    ).all()
+    stale = [hash_ for hash_, _ in generations[settings.ANSWER_MEMORY_MAX_CODEBOOKS:]]
+
+    deleted = 0
+    if stale:
+        deleted += db.query(AnswerMemory).filter(
+            AnswerMemory.scope == scope,
+            AnswerMemory.codebook_hash.in_(stale)
+        ).delete(synchronize_session=False)
+
+    deleted += db.query(AnswerMemory).filter(
+        AnswerMemory.scope == scope,
+        func.coalesce(AnswerMemory.last_used_at, AnswerMemory.updated_at)
+        < func.datetime("now", f"-{settings.ANSWER_MEMORY_TTL_DAYS} days")
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+def invalidate_answer_memory(db: Session, scope: str, codebook: Optional[str] = None) -> int:
+    """清除某个作用域（可选：某个编码表版本）的全部记忆"""
+    query = db.query(AnswerMemory).filter(AnswerMemory.scope == scope)
+    if codebook:
+        query = query.filter(AnswerMemory.codebook_hash == codebook)
+    deleted = query.delete(synchronize_session=False)
+    db.commit()
+    return deleted
@@ -2,6 +2,7 @@ import pandas as pd
 import difflib
 from sqlalchemy.orm import Session
 from app.models.anti_cheating import CheatingTask, CheatingResult
+from app.core.normalization import normalize_text
 
 class AntiCheatingService:
     def analyze_file(self, db: Session, task_id: int, file_path: str, threshold: float = 0.8):
@@ -39,6 +40,8 @@ class AntiCheatingService:
             for question_id, group in grouped:
                 records = group.to_dict('records')
                 n = len(records)
+                # 每条回答只规范化一次，比对使用规范形式（忽略全角/半角、大小写、空白和标点）
+                normalized = [normalize_text(str(rec['answer'])) for rec in records]
                 
                 for i in range(n):
                     for j in range(i + 1, n):
@@ -47,13 +50,15 @@ class AntiCheatingService:
                         
                         ans1 = str(rec1['answer'])
                         ans2 = str(rec2['answer'])
+                        norm1 = normalized[i]
+                        norm2 = normalized[j]
                         
                         # Skip empty answers or very short ones
-                        if len(ans1) < 5 or len(ans2) < 5:
+                        if len(norm1) < 5 or len(norm2) < 5:
                             continue
                             
                         # Calculate similarity
-                        similarity = difflib.SequenceMatcher(None, ans1, ans2).ratio()
+                        similarity = difflib.SequenceMatcher(None, norm1, norm2).ratio()
                         
                         if similarity >= threshold:
                             result = CheatingResult(
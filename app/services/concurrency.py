@@ -0,0 +1,235 @@
+"""
+LLM 调用的自适应并发控制与熔断
+
+AdaptiveConcurrencyLimiter（AIMD）：
+- 请求成功且延迟不超过基线（EWMA）的 LLM_CONCURRENCY_LATENCY_TOLERANCE 倍时，
+  窗口按 1/窗口 加性增长（约每一轮请求 +1）；
+- 遇到 429 / 5xx / 超时 / 连接错误时窗口乘性减半，同一轮延迟内只减一次，
+  避免一次突发失败把窗口直接压到最小。
+
+CircuitBreaker：
+- 连续 LLM_CIRCUIT_FAILURE_THRESHOLD 次服务端故障（5xx / 超时 / 连接错误）后熔断，
+  熔断期间请求直接抛出 CircuitOpenError，不再发送；
+- LLM_CIRCUIT_RESET_SECONDS 后进入半开状态，只放行一个试探请求，成功即恢复。
+
+LatencyTracker：最近成功请求的延迟滑动窗口，提供分位数（用于对冲请求的触发阈值）。
+"""
+import time
+import asyncio
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+import numpy as np
+import openai
+
+OUTCOME_SUCCESS = "success"
+OUTCOME_OVERLOAD = "overload"
+OUTCOME_ERROR = "error"
+
+
+def is_outage_error(error: BaseException) -> bool:
+    """服务端故障：5xx、超时、连接失败（429 不算，属于限流）"""
+    if isinstance(error, (openai.APIConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return False
+
+
+def classify_outcome(error: Optional[BaseException]) -> str:
+    """请求结果分类：成功 / 过载（429 及服务端故障）/ 其他错误（如 400，不调整窗口）"""
+    if error is None:
+        return OUTCOME_SUCCESS
+    if isinstance(error, openai.RateLimitError) or is_outage_error(error):
+        return OUTCOME_OVERLOAD
+    return OUTCOME_ERROR
+
+
+class CircuitOpenError(Exception):
+    """熔断中，请求未发送"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLM provider circuit open, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD 并发窗口"""
+
+    def __init__(self, initial: int, minimum: int, maximum: int, latency_tolerance: float = 2.0, decrease_factor: float = 0.5):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.window = float(min(max(initial, self.minimum), self.maximum))
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self.inflight = 0
+        self.latency_baseline: Optional[float] = None
+        self.increases = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def limit(self) -> int:
+        return int(self.window)
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        while self.inflight >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                else:
+                    # 已被唤醒但随即取消：把名额让给下一个等待者
+                    self._wake()
+                raise
+        self.inflight += 1
+
+    def try_acquire(self) -> bool:
+        """不等待地占用名额：窗口已满或有等待者时返回 False"""
+        if self.inflight >= self.limit or self._waiters:
+            return False
+        self.inflight += 1
+        return True
+
+    def release(self, latency: float, outcome: str) -> None:
+        """请求结束：按结果调整窗口并唤醒等待者"""
+        self.inflight -= 1
+        now = time.monotonic()
+        if outcome == OUTCOME_OVERLOAD:
+            # 同一轮（约一个基线延迟）内的多次失败只减一次
+            if now - self._last_decrease >= (self.latency_baseline or 1.0):
+                self.window = max(self.minimum, self.window * self.decrease_factor)
+                self.decreases += 1
+                self._last_decrease = now
+        elif outcome == OUTCOME_SUCCESS:
+            healthy = self.latency_baseline is None or latency <= self.latency_baseline * self.latency_tolerance
+            self.latency_baseline = latency if self.latency_baseline is None else 0.9 * self.latency_baseline + 0.1 * latency
+            if healthy and self.window < self.maximum:
+                self.window = min(self.maximum, self.window + 1 / self.window)
+                self.increases += 1
+        self._wake()
+
+    def _wake(self) -> None:
+        free = self.limit - self.inflight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "window": round(self.window, 2),
+            "limit": self.limit,
+            "inflight": self.inflight,
+            "waiting": self.waiting,
+            "min": self.minimum,
+            "max": self.maximum,
+            "latency_baseline_seconds": round(self.latency_baseline, 3) if self.latency_baseline is not None else None,
+            "increases": self.increases,
+            "decreases": self.decreases,
+        }
+
+
+class CircuitBreaker:
+    """连续故障熔断（closed → open → half_open → closed）"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_count = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+
+    def retry_after(self) -> float:
+        """距离允许下一次（试探）请求的秒数"""
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            return max(self._opened_at + self.reset_seconds - now, 0.0)
+        if self.state == self.HALF_OPEN and self._probe_started is not None:
+            return max(self._probe_started + self.reset_seconds - now, 0.0)
+        return 0.0
+
+    def before_request(self) -> None:
+        """请求前检查，熔断中抛出 CircuitOpenError"""
+        if self.state == self.CLOSED or self.failure_threshold <= 0:
+            return
+        now = time.monotonic()
+        if self.state == self.OPEN and now - self._opened_at >= self.reset_seconds:
+            self.state = self.HALF_OPEN
+            self._probe_started = None
+        if self.state == self.HALF_OPEN:
+            # 只放行一个试探请求；试探请求长时间未返回时允许再试探
+            if self._probe_started is None or now - self._probe_started >= self.reset_seconds:
+                self._probe_started = now
+                return
+        self.rejected += 1
+        raise CircuitOpenError(self.retry_after() or 1.0)
+
+    def record(self, error: Optional[BaseException]) -> None:
+        """记录请求结果：只有服务端故障计入失败，其他结果（含 429、400）说明服务可达"""
+        if error is not None and is_outage_error(error):
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.failure_threshold > 0 and self.consecutive_failures >= self.failure_threshold
+            ):
+                if self.state != self.OPEN:
+                    self.opened_count += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_started = None
+            return
+        self.consecutive_failures = 0
+        self.state = self.CLOSED
+        self._probe_started = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_seconds": self.reset_seconds,
+            "retry_after_seconds": round(self.retry_after(), 2),
+            "opened_count": self.opened_count,
+            "rejected": self.rejected,
+        }
+
+
+class LatencyTracker:
+    """最近 window 个成功请求的延迟（秒）"""
+
+    def __init__(self, window: int):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    @property
+    def count(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        return float(np.percentile(self._samples, q)) if self._samples else 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "samples": self.count,
+            "p50_seconds": round(self.percentile(50), 3),
+            "p95_seconds": round(self.percentile(95), 3),
+            "max_seconds": round(max(self._samples), 3) if self._samples else 0.0,
+        }
@@ -0,0 +1,144 @@
+"""
+LLM 响应缓存
+
+按请求内容寻址（model、messages、temperature、max_tokens、response_format 的哈希），
+存放在本地 SQLite 文件中，进程重启后仍然有效。
+- 容量上限：超出后按最近访问时间淘汰（LRU）
+- TTL：超过有效期的条目视为未命中并删除
+- 命中 / 未命中 / 写入 / 淘汰计数，用于观察缓存效果
+"""
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(
+    model: str,
+    messages: List[Dict[str, str]],
+    temperature: float,
+    max_tokens: Optional[int],
+    response_format: Optional[Dict[str, Any]],
+    logprobs: bool = False
+) -> str:
+    """请求内容哈希（字段顺序无关；logprobs 只在启用时计入，不影响已有缓存键）"""
+    request = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "response_format": response_format,
+    }
+    if logprobs:
+        request["logprobs"] = True
+    payload = json.dumps(
+        request,
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    基于 SQLite 的 LRU + TTL 响应缓存（线程安全）
+
+    读写都是单条主键操作，耗时在亚毫秒级，可以直接在事件循环中调用。
+    """
+
+    def __init__(self, path: str, max_entries: int, ttl_seconds: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_last_access ON llm_cache (last_access)")
+        self._size = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，过期或不存在返回 None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            response, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._size -= 1
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return response
+
+    def set(self, key: str, response: str) -> None:
+        """写入缓存，超出容量时淘汰最久未访问的条目"""
+        now = time.time()
+        with self._lock:
+            existed = self._conn.execute("SELECT 1 FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, now, now)
+            )
+            if not existed:
+                self._size += 1
+            self.writes += 1
+
+            overflow = self._size - self.max_entries
+            if self.max_entries and overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN "
+                    "(SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,)
+                )
+                self._size -= overflow
+                self.evictions += overflow
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,)).rowcount
+            self._size -= deleted
+
+    def clear(self) -> int:
+        """清空缓存，返回删除的条目数"""
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM llm_cache").rowcount
+            self._size = 0
+            return deleted
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "size": self._size,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
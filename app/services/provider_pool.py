@@ -0,0 +1,248 @@
+"""
+LLM 服务端点池
+
+每个端点（base_url + api_key + 默认模型）有独立的客户端、RPM / TPM 限流器、
+自适应并发窗口和熔断器，吞吐随端点（Key）数量近似线性增长。
+
+路由：选择 (进行中 + 排队请求数 + 1) / (并发窗口 × 权重) 最小的端点（最空闲，
+权重越大分到越多请求），负载相同时轮询；被熔断（连续故障）或被服务商要求
+暂停（retry-after）的端点暂时剔除，恢复后自动重新参与路由。
+
+指定模型的请求只发往声明了该模型（默认模型或 models 中包含）的端点；没有端点
+声明该模型时，发往未限制 models 的端点（如 OpenAI 官方接口可使用任意模型）。
+"""
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from aiolimiter import AsyncLimiter
+from openai import OpenAI, AsyncOpenAI
+
+from app.core.config import settings
+from app.services.rate_limiter import TokenBucketLimiter
+from app.services.concurrency import AdaptiveConcurrencyLimiter, CircuitBreaker, CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderEndpoint:
+    """单个服务端点及其限流 / 并发 / 熔断状态"""
+
+    def __init__(
+        self,
+        name: str,
+        api_key: str,
+        base_url: Optional[str],
+        model: str,
+        weight: float = 1.0,
+        rpm: Optional[int] = None,
+        tpm: Optional[int] = None,
+        models: Optional[List[str]] = None
+    ):
+        self.name = name
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        # 除默认模型外可使用的模型；None 表示不限制
+        self.models = list(models) if models is not None else None
+        self.weight = max(float(weight), 0.01)
+        self.rpm = rpm or settings.OPENAI_RATE_LIMIT_PER_MINUTE
+        self.tpm = settings.OPENAI_TOKENS_PER_MINUTE if tpm is None else tpm
+
+        # 限流器：每分钟最大请求数
+        self.rate_limiter = AsyncLimiter(self.rpm, 60)
+        # 限流器：每分钟最大 token 数（发送前按估算预留，响应后按 usage 校正）；
+        # tpm 为 0 时不限 token，但仍按响应头暂停（retry-after）并学习服务商的实际上限
+        self.token_limiter = TokenBucketLimiter(max(self.tpm, 0))
+        # 并发窗口：健康时加性增长，429 / 5xx / 超时时乘性减小
+        self.concurrency = AdaptiveConcurrencyLimiter(
+            settings.LLM_CONCURRENCY_INITIAL,
+            settings.LLM_CONCURRENCY_MIN,
+            settings.LLM_CONCURRENCY_MAX,
+            settings.LLM_CONCURRENCY_LATENCY_TOLERANCE
+        )
+        # 熔断：连续故障时暂时剔除该端点
+        self.circuit_breaker = CircuitBreaker(
+            settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+            settings.LLM_CIRCUIT_RESET_SECONDS
+        )
+        self.selected = 0  # 被路由选中的次数（含排队期间被熔断而改选的）
+        self._sync_client: Optional[OpenAI] = None
+        self._async_client: Optional[AsyncOpenAI] = None
+
+    def _client_kwargs(self) -> Dict[str, Any]:
+        client_kwargs = {"api_key": self.api_key}
+        if self.base_url:
+            client_kwargs["base_url"] = self.base_url
+        return client_kwargs
+
+    @property
+    def sync_client(self) -> OpenAI:
+        """获取同步客户端（惰性初始化）"""
+        if self._sync_client is None:
+            self._sync_client = OpenAI(**self._client_kwargs())
+        return self._sync_client
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """获取异步客户端（惰性初始化）"""
+        if self._async_client is None:
+            logger.info(f"初始化 AsyncOpenAI 客户端 [{self.name}]: base_url={self.base_url or 'default'}")
+            self._async_client = AsyncOpenAI(**self._client_kwargs())
+        return self._async_client
+
+    def declares(self, model: str) -> bool:
+        """是否声明了 model（默认模型或在 models 中）"""
+        return model == self.model or model in (self.models or ())
+
+    def retry_after(self) -> float:
+        """距离该端点可以再次接收请求的秒数（熔断或服务商要求暂停）"""
+        return max(self.circuit_breaker.retry_after(), self.token_limiter.blocked_seconds())
+
+    def load(self) -> float:
+        """按并发窗口和权重归一化的负载"""
+        busy = self.concurrency.inflight + self.concurrency.waiting + 1
+        return busy / (self.concurrency.limit * self.weight)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "base_url": self.base_url or "default (api.openai.com)",
+            "model": self.model,
+            "models": self.models,
+            "weight": self.weight,
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "selected": self.selected,
+            "load": round(self.load(), 3),
+            "concurrency": self.concurrency.get_stats(),
+            "circuit_breaker": self.circuit_breaker.get_stats(),
+            "token_limiter": self.token_limiter.get_stats(),
+        }
+
+
+class ProviderPool:
+    """端点池：最空闲 / 加权路由，剔除不健康端点"""
+
+    def __init__(self, endpoints: List[ProviderEndpoint]):
+        if not endpoints:
+            raise ValueError("ProviderPool requires at least one endpoint")
+        self.endpoints = endpoints
+        self._cursor = 0
+
+    @classmethod
+    def from_settings(cls) -> "ProviderPool":
+        """
+        从配置创建端点池
+
+        OPENAI_ENDPOINTS 为空时使用单个端点（OPENAI_API_KEY / OPENAI_BASE_URL / OPENAI_DEFAULT_MODEL）；
+        端点中未填写的字段同样回退到这些全局配置。
+        """
+        configs = settings.OPENAI_ENDPOINTS or [{}]
+        endpoints = []
+        for i, config in enumerate(configs):
+            endpoints.append(ProviderEndpoint(
+                name=config.get("name") or f"endpoint-{i}",
+                api_key=config.get("api_key") or settings.OPENAI_API_KEY,
+                base_url=config.get("base_url", settings.OPENAI_BASE_URL),
+                model=config.get("model") or settings.OPENAI_DEFAULT_MODEL,
+                weight=config.get("weight", 1.0),
+                rpm=config.get("rpm"),
+                tpm=config.get("tpm"),
+                models=config.get("models")
+            ))
+        return cls(endpoints)
+
+    @property
+    def primary(self) -> ProviderEndpoint:
+        return self.endpoints[0]
+
+    @property
+    def models(self) -> List[str]:
+        """各端点的默认模型（去重，按端点顺序）"""
+        return list(dict.fromkeys(endpoint.model for endpoint in self.endpoints))
+
+    def serving(self, model: Optional[str]) -> List[ProviderEndpoint]:
+        """
+        可使用 model 的端点（model 为 None 时为所有端点）
+
+        Raises:
+            ValueError: 没有端点可使用 model（所有端点都限制了 models 且不包含它）
+        """
+        if model is None:
+            return self.endpoints
+        endpoints = [endpoint for endpoint in self.endpoints if endpoint.declares(model)]
+        if not endpoints:
+            endpoints = [endpoint for endpoint in self.endpoints if endpoint.models is None]
+        if not endpoints:
+            declared = sorted({m for e in self.endpoints for m in [e.model, *e.models]})
+            raise ValueError(f"No provider endpoint serves model '{model}' (configured models: {declared})")
+        return endpoints
+
+    def select(
+        self,
+        exclude: Optional[ProviderEndpoint] = None,
+        model: Optional[str] = None
+    ) -> Optional[ProviderEndpoint]:
+        """
+        选择一个可用端点（并占用熔断器的半开试探名额）
+
+        Args:
+            exclude: 不参与选择的端点
+            model: 只选择可使用 model 的端点（见 serving）
+
+        Returns:
+            选中的端点；指定 exclude 且没有其他可用端点时返回 None
+
+        Raises:
+            CircuitOpenError: 所有端点都不可用（未指定 exclude 时）
+            ValueError: 没有端点可使用 model
+        """
+        endpoints = self.serving(model)
+        count = len(endpoints)
+        start = self._cursor % count
+        self._cursor += 1
+        # 从轮询位置开始排列，负载相同时依次轮换
+        rotated = endpoints[start:] + endpoints[:start]
+        candidates = sorted(
+            (endpoint for endpoint in rotated if endpoint is not exclude and endpoint.retry_after() <= 0),
+            key=lambda endpoint: endpoint.load()
+        )
+        for endpoint in candidates:
+            try:
+                endpoint.circuit_breaker.before_request()
+            except CircuitOpenError:
+                continue
+            endpoint.selected += 1
+            return endpoint
+
+        if exclude is not None:
+            return None
+        raise CircuitOpenError(self.retry_after() or 1.0)
+
+    def retry_after(self) -> float:
+        """距离任一端点恢复可用的秒数"""
+        return min(endpoint.retry_after() for endpoint in self.endpoints)
+
+    async def wait_until_available(self, deadline: float) -> bool:
+        """
+        所有端点都不可用时暂停，直到任一端点恢复（允许试探请求）
+
+        Args:
+            deadline: time.monotonic() 时间点，超过后不再等待
+
+        Returns:
+            False 表示在 deadline 前仍没有可用端点
+        """
+        while True:
+            delay = self.retry_after()
+            if delay <= 0:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            # 分段等待：试探请求成功恢复后尽快继续
+            await asyncio.sleep(min(delay, 1.0, max(deadline - time.monotonic(), 0.0)))
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        return [endpoint.get_stats() for endpoint in self.endpoints]
@@ -0,0 +1,208 @@
+"""
+按 token 计量的限流器（TPM）
+
+服务商同时限制每分钟请求数（RPM，由 AsyncLimiter 控制）和每分钟 token 数（TPM）。
+TokenBucketLimiter 在发送前按估算的 输入 + 输出 token 预留额度，响应返回后按
+usage 的实际用量多退少补；响应头中的 x-ratelimit-* / retry-after 用于校正
+本地估计（额度上限、剩余额度、需要暂停的时间），避免 429 连锁失败。
+"""
+import re
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """解析 x-ratelimit-reset-* 的时长（如 "1s"、"6m0s"、"20ms"、"0.5"），返回秒"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def _header_int(headers: Any, name: str) -> Optional[int]:
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after_seconds(headers: Any) -> Optional[float]:
+    """retry-after-ms / retry-after（秒数形式）"""
+    if headers is None:
+        return None
+    milliseconds = headers.get("retry-after-ms")
+    if milliseconds is not None:
+        try:
+            return float(milliseconds) / 1000
+        except (TypeError, ValueError):
+            pass
+    seconds = headers.get("retry-after")
+    if seconds is not None:
+        try:
+            return float(seconds)
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+class TokenBucketLimiter:
+    """
+    令牌桶：容量为每分钟 token 数，按秒匀速补充
+
+    acquire 按 FIFO 顺序等待额度；单个请求超过容量时等到桶满后放行（不会永久阻塞）。
+    容量为 0 表示不限 token：只遵守 retry-after 等暂停，直到响应头给出实际上限。
+    """
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = float(tokens_per_minute)
+        self.available = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._inflight = 0
+        self._lock = asyncio.Lock()
+        self.reserved_tokens = 0
+        self.actual_tokens = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.throttled = 0
+
+    @property
+    def limited(self) -> bool:
+        """是否限制 token 数（配置了 TPM 或已从响应头获知上限）"""
+        return self.capacity > 0
+
+    def _clamp(self, tokens: int) -> int:
+        return int(min(tokens, self.capacity)) if self.limited else int(tokens)
+
+    def _refill(self, now: float) -> None:
+        if not self.limited:
+            self._updated = now
+            return
+        self.available = min(self.capacity, self.available + (now - self._updated) * self.capacity / 60)
+        self._updated = now
+
+    async def acquire(self, tokens: int) -> int:
+        """预留 tokens 个额度，返回实际预留数（用于之后的 reconcile）"""
+        tokens = self._clamp(tokens)
+        async with self._lock:
+            waited = False
+            started = time.monotonic()
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                delay = self._blocked_until - now
+                if delay <= 0:
+                    if not self.limited or self.available >= tokens:
+                        break
+                    delay = (tokens - self.available) * 60 / self.capacity
+                waited = True
+                await asyncio.sleep(delay)
+            if self.limited:
+                self.available -= tokens
+            self._inflight += tokens
+            self.reserved_tokens += tokens
+            if waited:
+                self.waits += 1
+                self.wait_seconds += time.monotonic() - started
+        return tokens
+
+    def try_acquire(self, tokens: int) -> Optional[int]:
+        """不等待地预留额度：有请求在排队、暂停中或额度不足时返回 None"""
+        tokens = self._clamp(tokens)
+        if self._lock.locked():
+            return None
+        now = time.monotonic()
+        self._refill(now)
+        if self._blocked_until > now or (self.limited and self.available < tokens):
+            return None
+        if self.limited:
+            self.available -= tokens
+        self._inflight += tokens
+        self.reserved_tokens += tokens
+        return tokens
+
+    def reconcile(self, reserved: int, actual: Optional[int]) -> None:
+        """请求结束：按实际用量退还 / 补扣预留额度（无 usage 时按预留值计）"""
+        self._inflight -= reserved
+        if actual is None:
+            actual = reserved
+        self.actual_tokens += actual
+        if self.limited:
+            self._refill(time.monotonic())
+            self.available = min(self.capacity, self.available + reserved - actual)
+
+    def blocked_seconds(self) -> float:
+        """距离暂停结束的秒数（未暂停时为 0）"""
+        return max(self._blocked_until - time.monotonic(), 0.0)
+
+    def block_for(self, seconds: float) -> None:
+        """在 seconds 秒内不再放行新请求（429 / retry-after / 请求额度耗尽）"""
+        if seconds and seconds > 0:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def observe_headers(self, headers: Any, throttled: bool = False) -> None:
+        """
+        按响应头校正本地状态
+
+        - x-ratelimit-limit-tokens：服务商实际的 TPM 上限（按比例调整当前额度；
+          未配置 TPM 时从此开始限流）
+        - x-ratelimit-remaining-tokens：服务商侧剩余额度，扣除尚未到达服务商的在途预留后
+          作为本地额度上界
+        - x-ratelimit-remaining-requests 为 0：暂停到 x-ratelimit-reset-requests
+        - retry-after(-ms)：暂停指定时间
+        """
+        if throttled:
+            self.throttled += 1
+        if headers is None:
+            return
+
+        self._refill(time.monotonic())
+        limit = _header_int(headers, "x-ratelimit-limit-tokens")
+        if limit and limit != self.capacity:
+            logger.info(f"TPM 上限按响应头调整: {self.capacity:.0f} -> {limit}")
+            self.available = self.available * limit / self.capacity if self.limited else float(limit)
+            self.capacity = float(limit)
+
+        remaining = _header_int(headers, "x-ratelimit-remaining-tokens")
+        if remaining is not None and self.limited:
+            self.available = min(self.available, remaining - self._inflight)
+
+        if _header_int(headers, "x-ratelimit-remaining-requests") == 0:
+            self.block_for(parse_duration(headers.get("x-ratelimit-reset-requests")) or 1.0)
+
+        retry_after = retry_after_seconds(headers)
+        if retry_after is not None:
+            self.block_for(retry_after)
+        elif throttled:
+            self.block_for(parse_duration(headers.get("x-ratelimit-reset-tokens")) or 1.0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        self._refill(time.monotonic())
+        return {
+            "tokens_per_minute": int(self.capacity) if self.limited else None,
+            "available": int(self.available) if self.limited else None,
+            "inflight_reserved": self._inflight,
+            "blocked_seconds": round(self.blocked_seconds(), 2),
+            "reserved_tokens": self.reserved_tokens,
+            "actual_tokens": self.actual_tokens,
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 2),
+            "throttled": self.throttled,
+        }
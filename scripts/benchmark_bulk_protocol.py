@@ -0,0 +1,93 @@
+"""
+批量分类响应协议对比：legacy（回显编码名称） vs compact（编码编号数组）
+
+默认离线估算：按同一批文本构造两种协议的提示词和理想响应，统计每行的输入 / 输出 token。
+加 --live 时实际调用配置的模型（不使用缓存），统计响应 token、耗时和解析成功率。
+
+用法：
+    python scripts/benchmark_bulk_protocol.py
+    python scripts/benchmark_bulk_protocol.py --rows 100 --codes 30 --live
+"""
+import sys
+sys.path.append('.')
+
+import json
+import time
+import random
+import asyncio
+import argparse
+
+from app.core.bulk_protocol import PROTOCOL_LEGACY, PROTOCOL_COMPACT, get_protocol
+from app.core.llm_batching import estimate_tokens
+
+SAMPLE_PHRASES = [
+    "价格有点贵", "服务态度很好", "物流太慢了", "包装破损", "质量不错，会回购",
+    "客服回复及时", "颜色和图片不一样", "尺码偏小", "性价比高", "用了两天就坏了",
+]
+
+
+def make_sample(n_rows: int, n_codes: int, seed: int):
+    rng = random.Random(seed)
+    codes = [{"code": f"类别{i+1}", "description": f"与{SAMPLE_PHRASES[i % len(SAMPLE_PHRASES)]}相关的反馈"}
+             for i in range(n_codes)]
+    texts = [f"{rng.choice(SAMPLE_PHRASES)}，{rng.choice(SAMPLE_PHRASES)}" for _ in range(n_rows)]
+    labels = [rng.randrange(n_codes) for _ in range(n_rows)]
+    return codes, texts, labels
+
+
+def ideal_response(protocol_name: str, codes, labels) -> str:
+    if protocol_name == PROTOCOL_COMPACT:
+        return json.dumps({"codes": [label + 1 for label in labels]})
+    return json.dumps(
+        {"results": [{"index": i + 1, "code": codes[label]["code"]} for i, label in enumerate(labels)]},
+        ensure_ascii=False
+    )
+
+
+def offline(codes, texts, labels):
+    print(f"{'protocol':<10}{'input/row':>12}{'output/row':>12}{'output total':>14}")
+    for name in (PROTOCOL_LEGACY, PROTOCOL_COMPACT):
+        protocol = get_protocol(name, codes)
+        input_tokens = sum(estimate_tokens(m["content"]) for m in protocol.build_messages(texts))
+        output_tokens = estimate_tokens(ideal_response(name, codes, labels))
+        print(f"{name:<10}{input_tokens / len(texts):>12.1f}{output_tokens / len(texts):>12.2f}{output_tokens:>14}")
+
+
+async def live(codes, texts, use_json_schema: bool):
+    from app.services.aigc_service import get_aigc_service
+    aigc = get_aigc_service()
+    print(f"{'protocol':<10}{'output/row':>12}{'seconds':>10}{'decoded':>10}")
+    for name in (PROTOCOL_LEGACY, PROTOCOL_COMPACT):
+        protocol = get_protocol(name, codes, use_json_schema)
+        messages = protocol.build_messages(texts)
+        started = time.perf_counter()
+        content = await aigc.chat_completion(
+            messages=messages, temperature=0.1, response_format=protocol.response_format, use_cache=False
+        )
+        seconds = time.perf_counter() - started
+        try:
+            decoded = len(protocol.decode(json.loads(content), len(texts)))
+        except (TypeError, json.JSONDecodeError):
+            decoded = 0
+        print(f"{name:<10}{estimate_tokens(content or '') / len(texts):>12.2f}{seconds:>10.2f}{decoded:>7}/{len(texts)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50)
+    parser.add_argument("--codes", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--live", action="store_true", help="实际调用模型")
+    parser.add_argument("--json-schema", action="store_true", help="compact 协议使用 JSON Schema 结构化输出")
+    args = parser.parse_args()
+
+    codes, texts, labels = make_sample(args.rows, args.codes, args.seed)
+    print(f"{args.rows} rows, {args.codes} codes (estimated tokens)")
+    offline(codes, texts, labels)
+    if args.live:
+        print()
+        asyncio.run(live(codes, texts, args.json_schema))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+工作坊关键词分类（classify_texts_by_keywords）耗时基准
+
+构造 N 条文本（约一半重复）和 T 个主题 × K 个关键词，分别计时首次（规范化缓存未命中）
+和再次运行，并断言两次都在预算内；同时抽样与逐条子串计数的结果比对，确认分类一致。
+
+用法：
+    python scripts/benchmark_keyword_scoring.py
+    python scripts/benchmark_keyword_scoring.py --texts 100000 --themes 20 --keywords 10 --budget 1.0
+"""
+import sys
+sys.path.append('.')
+
+import time
+import random
+import argparse
+
+from app.api.endpoints.workshop import classify_texts_by_keywords
+from app.core.normalization import normalize_text
+
+CHARS = "价格服务态度质量物流包装速度客服售后体验满意一般不好很好太贵便宜快慢产品功能外观设计推荐失望"
+
+
+def make_sample(n_texts: int, n_themes: int, n_keywords: int, seed: int):
+    rng = random.Random(seed)
+    themes = [
+        {
+            "code": f"主题{t + 1}",
+            "keywords": ["".join(rng.choices(CHARS, k=rng.randint(2, 4))) for _ in range(n_keywords)]
+        }
+        for t in range(n_themes)
+    ]
+    distinct = ["".join(rng.choices(CHARS, k=rng.randint(8, 40))) for _ in range(max(n_texts // 2, 1))]
+    texts = [rng.choice(distinct) for _ in range(n_texts)]
+    return texts, themes
+
+
+def reference(texts, themes):
+    """逐条文本、逐个关键词判断子串（命中数最多的主题，并列取靠前的主题）"""
+    expected = {}
+    for text in texts:
+        normalized = normalize_text(text)
+        best, best_score = "其他", 0
+        for theme in themes:
+            score = sum(1 for kw in theme["keywords"] if normalize_text(kw) and normalize_text(kw) in normalized)
+            if score > best_score:
+                best, best_score = theme["code"], score
+        expected[text] = best
+    return expected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=100000)
+    parser.add_argument("--themes", type=int, default=20)
+    parser.add_argument("--keywords", type=int, default=10)
+    parser.add_argument("--budget", type=float, default=1.0, help="每次运行的耗时上限（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    texts, themes = make_sample(args.texts, args.themes, args.keywords, args.seed)
+    print(f"{args.texts} texts, {args.themes} themes x {args.keywords} keywords")
+
+    timings = []
+    for run in ("cold", "warm"):
+        run_themes = [dict(theme) for theme in themes]
+        started = time.perf_counter()
+        classified = classify_texts_by_keywords(texts, run_themes)
+        seconds = time.perf_counter() - started
+        timings.append(seconds)
+        print(f"{run:<6}{seconds:>8.3f}s")
+
+    sample = random.Random(args.seed).sample(texts, min(2000, len(texts)))
+    assigned = {text: code for code, members in classified.items() for text in members}
+    expected = reference(sample, themes)
+    mismatches = [text for text in sample if assigned[text] != expected[text]]
+    assert not mismatches, f"{len(mismatches)} texts classified differently, e.g. {mismatches[0]!r}"
+    print(f"[OK] {len(sample)} sampled texts match per-keyword substring scoring")
+
+    assert max(timings) < args.budget, f"keyword scoring took {max(timings):.3f}s (budget {args.budget}s)"
+    print(f"[OK] under {args.budget}s budget")
+
+
+if __name__ == "__main__":
+    main()
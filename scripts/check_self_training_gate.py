@@ -0,0 +1,60 @@
+"""
+自训练只在 AI 兜底的模式中生效的检查
+
+构造一列：大量取值能被固定编码确定性匹配（足够训练自训练分类器），另有一批
+与已匹配取值高度相似、但匹配不上的取值。开启自训练后：
+- fixed_then_default：未匹配取值仍归入默认编码（default_fallback），不被预测结果替换
+- fixed_mapping_only：未匹配取值仍标记为 no_match
+
+用法：
+    python scripts/check_self_training_gate.py
+"""
+import sys
+sys.path.append('.')
+
+import asyncio
+
+from app.core.config import settings
+from app.core.coding_extraction import classify_column_batch
+
+CODES = [
+    {"code": "价格", "description": "对价格的评价"},
+    {"code": "服务", "description": "对服务的评价"},
+]
+DEFAULT_CODE = "其他"
+
+
+def make_column():
+    matched = [f"价格{i}号反馈" for i in range(40)] + [f"服务{i}号反馈" for i in range(40)]
+    # 与已匹配取值的字符 n-gram 高度重合，但不包含任何编码名称
+    unmatched = [f"价钱{i}号反馈" for i in range(10)] + [f"服从{i}号反馈" for i in range(10)]
+    return matched, unmatched
+
+
+async def check(classification_mode: str, expected_code: str, expected_method: str) -> None:
+    matched, unmatched = make_column()
+    stats = {}
+    results = await classify_column_batch(
+        texts=matched + unmatched,
+        codes=CODES,
+        classification_mode=classification_mode,
+        mapping_dict={},
+        default_code=DEFAULT_CODE,
+        stats=stats,
+        self_training=True
+    )
+    fallback = results[len(matched):]
+    assert all(r["code"] == expected_code and r["method"] == expected_method for r in fallback), \
+        f"{classification_mode}: unmatched rows changed by self-training: {fallback[:3]}"
+    assert "self_training" not in stats, f"{classification_mode}: self-training ran in a non-AI mode"
+    print(f"[OK] {classification_mode}: {len(fallback)} unmatched rows -> {expected_code} ({expected_method})")
+
+
+async def main():
+    assert len(make_column()[0]) >= settings.SELF_TRAIN_MIN_LABELS
+    await check("fixed_then_default", DEFAULT_CODE, "default_fallback")
+    await check("fixed_mapping_only", "未匹配", "no_match")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())